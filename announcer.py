@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import random
+import time
+
+import discord
+
+from metrics import Counter
+
+# Concurrent dispatcher for the daily birthday announcements.
+#
+# Each guild gets its own worker so a slow channel only delays its own guild,
+# while a global semaphore bounds the number of REST calls in flight. Calls
+# are paced by token buckets that mirror Discord's rate limits (per route and
+# per channel, plus the global limit) and are retried with exponential
+# backoff on 429 and 5xx responses. A call waits for its tokens before taking
+# a slot of the semaphore, so a channel at its limit does not hold up the
+# other guilds.
+
+# Discord's documented defaults: 5 messages per 5 seconds per channel and
+# 50 requests per second overall.
+ROUTE_LIMITS = {
+    "messages": (5, 5.0),
+    "threads": (5, 5.0),
+}
+GLOBAL_LIMIT = (50, 1.0)
+
+api_calls = Counter(
+    "discord_api_calls_total",
+    "REST calls made by the announcements.",
+    labels=("route",),
+)
+api_retries = Counter(
+    "discord_api_retries_total",
+    "Announcement REST calls retried after a 429 or 5xx.",
+    labels=("route", "status"),
+)
+rate_limited_seconds = Counter(
+    "discord_rate_limited_seconds_total",
+    "Time announcements spent waiting on rate limits and retry backoff.",
+)
+
+
+class TokenBucket:
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self):
+        # Returns the time spent waiting for a token.
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                delay = self.blocked_until - now
+            elif self.tokens >= 1:
+                self.tokens -= 1
+                return waited
+            else:
+                delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def block_for(self, seconds):
+        # Called after a 429: nothing goes through this bucket until it resets.
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def retry_after(error):
+    # Seconds to wait according to the rate-limit headers of a 429, if any.
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("Retry-After", "X-RateLimit-Reset-After"):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return None
+
+
+class RunStats:
+    # What one run() did; runs that overlap each count their own calls.
+    def __init__(self):
+        self.api_calls = 0
+        self.retries = 0
+        self.rate_limited_time = 0.0
+        self.duration = 0.0
+
+
+# Stats of the run the current task belongs to (the guild workers inherit it).
+_current_run = contextvars.ContextVar("announcement_run", default=None)
+
+
+class AnnouncementDispatcher:
+    def __init__(self, max_concurrency=10, max_retries=5, base_delay=1.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._global_bucket = TokenBucket(*GLOBAL_LIMIT)
+        # { (route, major_id): TokenBucket }
+        self._buckets = {}
+
+    def _bucket(self, route, major_id):
+        key = (route, major_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*ROUTE_LIMITS[route])
+        return bucket
+
+    async def call(self, route, major_id, func, *args, **kwargs):
+        # Runs one REST call (e.g. channel.send) under the rate limits.
+        # route is a key of ROUTE_LIMITS and major_id the channel it targets.
+        bucket = self._bucket(route, major_id)
+        # Calls made outside of run() are counted by the metrics only.
+        stats = _current_run.get() or RunStats()
+        attempt = 0
+        while True:
+            waited = await bucket.acquire()
+            waited += await self._global_bucket.acquire()
+            stats.rate_limited_time += waited
+            rate_limited_seconds.inc(amount=waited)
+            stats.api_calls += 1
+            api_calls.inc(route)
+            try:
+                async with self._semaphore:
+                    return await func(*args, **kwargs)
+            except discord.HTTPException as e:
+                status = e.status
+                if not (e.status == 429 or e.status >= 500):
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e) if e.status == 429 else None
+                if delay is None:
+                    delay = self.base_delay * 2**attempt
+                    delay += random.uniform(0, self.base_delay)
+                if e.status == 429:
+                    bucket.block_for(delay)
+            attempt += 1
+            stats.retries += 1
+            api_retries.inc(route, status)
+            stats.rate_limited_time += delay
+            rate_limited_seconds.inc(amount=delay)
+            await asyncio.sleep(delay)
+
+    async def run(self, guild_jobs):
+        # guild_jobs: { guild_id: coroutine } - one worker per guild, all
+        # guilds in parallel. Returns the RunStats of this run.
+        stats = RunStats()
+        token = _current_run.set(stats)
+        started_at = time.monotonic()
+        guild_ids = list(guild_jobs)
+        try:
+            # The workers are tasks created here, so they see this run's stats.
+            results = await asyncio.gather(
+                *(guild_jobs[guild_id] for guild_id in guild_ids),
+                return_exceptions=True,
+            )
+        finally:
+            _current_run.reset(token)
+        for guild_id, result in zip(guild_ids, results):
+            if isinstance(result, Exception):
+                print(f"Erreur lors des annonces pour le serveur {guild_id} : {result}")
+        stats.duration = time.monotonic() - started_at
+        return stats
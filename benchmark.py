@@ -0,0 +1,1509 @@
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from array import array
+from collections import Counter
+from compact_store import (
+    CODE_TO_MONTH_DAY,
+    CODE_TO_STR,
+    MONTH_DAY_TO_CODE,
+    CompactBirthdays,
+    GuildBirthdays,
+)
+from sharding import peak_rss_mb
+from storage import migrate_json_to_sqlite
+
+# Offline benchmark suite for the bot.
+#
+# Each data size runs in its own process: synthetic birthdays and config are
+# written to a temporary data directory, bot.py is imported against it (which
+# loads the data like a real start) and its handlers are driven through a
+# local stand-in for the Discord REST API that injects latency and 429s.
+#
+# Usage:
+#   python benchmark.py --guilds 10,1000,100000 --output bench.json
+#   python benchmark.py --guilds 10,1000 --compare bench.json
+#   python benchmark.py --memory --registrations 1000000
+#   python benchmark.py --startup --guilds 1000,10000,100000
+#   python benchmark.py --startup --backend sqlite --shards 4 --guilds 100000
+#   python benchmark.py --handover --guilds 1000,100000
+#   python benchmark.py --split --guilds 1000
+#   python benchmark.py --lookup --lookup-sizes 10000,100000,1000000,10000000
+
+SCENARIOS = ["set", "all", "upcoming", "daily", "grouped", "ready", "contention"]
+
+
+def print_info(message):
+    print(f"\033[94m[INFO]\033[0m {message}")
+
+
+def print_warning(message):
+    print(f"\033[93m[WARNING]\033[0m {message}")
+
+
+# ========================== Synthetic data ==========================
+
+
+def guild_id_for(index):
+    # Snowflake-like IDs so guilds spread over shards like real ones.
+    return str((1_000_000 + index) << 22)
+
+
+def random_date(rng):
+    # "DD/MM"; 2000 is a leap year, so 29/02 can come up like in real data.
+    day = datetime.date(2000, 1, 1) + datetime.timedelta(rng.randrange(366))
+    return day.strftime("%d/%m")
+
+
+def generate_data(guild_count, users_per_guild, seed=0):
+    rng = random.Random(seed)
+    birthdays = {}
+    config = {}
+    for index in range(guild_count):
+        guild_id = guild_id_for(index)
+        guild_birthdays = {}
+        for _ in range(users_per_guild):
+            guild_birthdays[str(rng.getrandbits(60))] = random_date(rng)
+        birthdays[guild_id] = guild_birthdays
+        config[guild_id] = {"birthday_channel": int(guild_id) + 1}
+    return birthdays, config
+
+
+# ========================== Fake Discord transport ==========================
+
+
+class FakeResponse:
+    # Just enough of aiohttp's response for discord.HTTPException.
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.reason = "Too Many Requests" if status == 429 else "OK"
+        self.headers = headers or {}
+
+
+# Interaction callbacks are not subject to the usual rate limits.
+UNLIMITED_ROUTES = {"interaction_responses", "webhooks"}
+
+
+class FakeTransport:
+    def __init__(self, latency=0.02, rate_limit_ratio=0.0, retry_after=0.05, seed=0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.rate_limited = 0
+        self._next_id = 1
+
+    def next_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    async def request(self, route):
+        import discord
+
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)
+        if route not in UNLIMITED_ROUTES and self.rng.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            response = FakeResponse(429, {"Retry-After": str(self.retry_after)})
+            raise discord.HTTPException(response, "You are being rate limited.")
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    def __init__(self, guild_id, members=None):
+        self.id = int(guild_id)
+        self.shard_id = 0
+        self.members = members or {}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+
+class FakeThread:
+    def __init__(self, transport):
+        self.transport = transport
+        self.id = transport.next_id()
+
+    async def send(self, *args, **kwargs):
+        await self.transport.request("thread_messages")
+
+
+class FakeMessage:
+    def __init__(self, transport):
+        self.transport = transport
+        self.id = transport.next_id()
+
+    async def create_thread(self, **kwargs):
+        await self.transport.request("threads")
+        return FakeThread(self.transport)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild, transport):
+        self.id = channel_id
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+        self.transport = transport
+
+    async def send(self, *args, **kwargs):
+        await self.transport.request("messages")
+        return FakeMessage(self.transport)
+
+    async def fetch_message(self, message_id):
+        await self.transport.request("fetch_message")
+        return FakeMessage(self.transport)
+
+
+class FakeClient:
+    def __init__(self, transport, config):
+        self.transport = transport
+        self.guilds = {}
+        self.channels = {}
+        for guild_id, guild_config in config.items():
+            guild = self.guilds[guild_id] = FakeGuild(guild_id)
+            channel_id = guild_config.get("birthday_channel")
+            if channel_id:
+                self.channels[channel_id] = FakeChannel(channel_id, guild, transport)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        # A known announcement channel (the worker has no channel cache),
+        # otherwise one of the threads the announcements created.
+        await self.transport.request("fetch_channel")
+        return self.channels.get(channel_id) or FakeThread(self.transport)
+
+    def get_user(self, user_id):
+        return None
+
+    async def fetch_user(self, user_id):
+        await self.transport.request("users")
+        return FakeUser(user_id)
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    def _mark(self):
+        if self.interaction.responded_at is None:
+            self.interaction.responded_at = time.perf_counter()
+
+    async def send_message(self, *args, **kwargs):
+        self._mark()
+        await self.interaction.transport.request("interaction_responses")
+
+    async def defer(self, **kwargs):
+        self._mark()
+        await self.interaction.transport.request("interaction_responses")
+
+    async def edit_message(self, **kwargs):
+        self._mark()
+        await self.interaction.transport.request("interaction_responses")
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        await self.interaction.transport.request("webhooks")
+        self.interaction.completed_at = time.perf_counter()
+
+
+class FakeInteraction:
+    def __init__(self, transport, guild, user_id, channel=None):
+        self.transport = transport
+        self.guild = guild
+        self.user = FakeUser(user_id)
+        self.channel = channel
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        self.created_at = time.perf_counter()
+        self.responded_at = None
+        self.completed_at = None
+
+    def latency(self):
+        return (self.responded_at or time.perf_counter()) - self.created_at
+
+
+# ========================== Measurements ==========================
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(latencies, duration):
+    return {
+        "count": len(latencies),
+        "duration_s": duration,
+        "throughput_per_s": len(latencies) / duration if duration else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def busiest_day(birthdays, year):
+    # The date, in a leap year, on which the most guilds have a birthday.
+    guilds_per_code = Counter()
+    for guild_birthdays in birthdays.values():
+        guilds_per_code.update(set(guild_birthdays.arrays()[1]))
+    code = guilds_per_code.most_common(1)[0][0]
+    return datetime.date(year, *CODE_TO_MONTH_DAY[code])
+
+
+class Scenario:
+    def __init__(self, bot_module, client, transport, args):
+        self.bot_module = bot_module
+        self.client = client
+        self.transport = transport
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+    def _calls_since(self, before):
+        calls = self.transport.calls - before
+        return {"api_calls": sum(calls.values()), "api_calls_by_route": dict(calls)}
+
+    async def run_set(self):
+        # Concurrent /birthday set calls spread over the guilds.
+        guild_ids = list(self.client.guilds)
+        interactions = []
+        for _ in range(self.args.concurrency):
+            guild = self.client.guilds[self.rng.choice(guild_ids)]
+            interactions.append(
+                FakeInteraction(self.transport, guild, self.rng.getrandbits(60))
+            )
+        before = Counter(self.transport.calls)
+        started_at = time.perf_counter()
+        for interaction in interactions:
+            interaction.created_at = started_at
+        dates = [random_date(self.rng) for _ in interactions]
+        await asyncio.gather(
+            *(
+                self.bot_module.birthday_set.callback(interaction, date)
+                for interaction, date in zip(interactions, dates)
+            )
+        )
+        duration = time.perf_counter() - started_at
+        result = latency_summary([i.latency() for i in interactions], duration)
+        result.update(self._calls_since(before))
+        return result
+
+    async def run_all(self):
+        # /birthday all on a sample of guilds, one after another.
+        guild_ids = list(self.client.guilds)[: self.args.sample]
+        before = Counter(self.transport.calls)
+        latencies = []
+        completions = []
+        started_at = time.perf_counter()
+        for guild_id in guild_ids:
+            interaction = FakeInteraction(
+                self.transport, self.client.guilds[guild_id], self.rng.getrandbits(60)
+            )
+            await self.bot_module.birthday_all.callback(interaction)
+            latencies.append(interaction.latency())
+            if interaction.completed_at is not None:
+                completions.append(interaction.completed_at - interaction.created_at)
+        duration = time.perf_counter() - started_at
+        result = latency_summary(latencies, duration)
+        result["completion_p99_ms"] = percentile(completions, 0.99) * 1000
+        result.update(self._calls_since(before))
+        return result
+
+    async def run_upcoming(self):
+        # /birthday upcoming (30 days, 10 results) on the same sample as all.
+        guild_ids = list(self.client.guilds)[: self.args.sample]
+        before = Counter(self.transport.calls)
+        latencies = []
+        started_at = time.perf_counter()
+        for guild_id in guild_ids:
+            interaction = FakeInteraction(
+                self.transport, self.client.guilds[guild_id], self.rng.getrandbits(60)
+            )
+            await self.bot_module.birthday_upcoming.callback(interaction, 30, 10)
+            latencies.append(interaction.latency())
+        duration = time.perf_counter() - started_at
+        result = latency_summary(latencies, duration)
+        result.update(self._calls_since(before))
+        return result
+
+    def _busiest_day(self, year):
+        return busiest_day(self.bot_module.birthdays, year)
+
+    async def run_daily(self):
+        # The midnight run for every guild at once, on the busiest day.
+        index = self.bot_module.birthday_index
+        local_date = self._busiest_day(2024)
+        due = [(guild_id, local_date) for guild_id in self.client.guilds]
+        before = Counter(self.transport.calls)
+        rate_limited_before = self.transport.rate_limited
+        started_at = time.perf_counter()
+        await self.bot_module.check_birthdays(due)
+        duration = time.perf_counter() - started_at
+        result = {
+            "duration_s": duration,
+            "guilds": len(due),
+            "announcements": index.count_on(local_date.month, local_date.day),
+            "rate_limited": self.transport.rate_limited - rate_limited_before,
+        }
+        result.update(self._calls_since(before))
+        return result
+
+    async def _announce_day(self, local_date):
+        # The midnight run for every guild; returns (duration, calls by route).
+        due = [(guild_id, local_date) for guild_id in self.client.guilds]
+        before = Counter(self.transport.calls)
+        started_at = time.perf_counter()
+        await self.bot_module.check_birthdays(due)
+        return time.perf_counter() - started_at, self.transport.calls - before
+
+    async def run_grouped(self):
+        # The busiest day announced once with one announcement per birthday and
+        # once with the same-day birthdays grouped (/birthday set_grouping at
+        # its maximum), in two years the other scenarios do not use.
+        storage = self.bot_module.storage
+        index = self.bot_module.birthday_index
+        local_date = self._busiest_day(2032)
+        separate_duration, separate_calls = await self._announce_day(local_date)
+        for guild_id in self.client.guilds:
+            storage.set_config_value(
+                guild_id, "group_size", self.bot_module.MAX_GROUP_SIZE
+            )
+        try:
+            duration, calls = await self._announce_day(self._busiest_day(2036))
+        finally:
+            for guild_id in self.client.guilds:
+                storage.remove_config_value(guild_id, "group_size")
+        return {
+            "duration_s": duration,
+            "announcements": index.count_on(local_date.month, local_date.day),
+            "separate_duration_s": separate_duration,
+            "separate_api_calls": sum(separate_calls.values()),
+            "api_calls": sum(calls.values()),
+            "api_calls_by_route": dict(calls),
+        }
+
+    async def _set_stream(self, interval, count=None, until=None):
+        # /birthday set calls started every `interval` seconds, either `count`
+        # of them or until the `until` task is done. Returns their latencies.
+        guild_ids = list(self.client.guilds)
+        interactions = []
+        tasks = []
+        while (until is not None and not until.done()) or len(tasks) < (count or 0):
+            guild = self.client.guilds[self.rng.choice(guild_ids)]
+            interaction = FakeInteraction(
+                self.transport, guild, self.rng.getrandbits(60)
+            )
+            interactions.append(interaction)
+            tasks.append(
+                asyncio.create_task(
+                    self.bot_module.birthday_set.callback(
+                        interaction, random_date(self.rng)
+                    )
+                )
+            )
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+        return [interaction.latency() for interaction in interactions]
+
+    async def run_contention(self):
+        # /birthday set latency while the busiest day's announcements run in
+        # the same process (RUN_MODE=all), against the same stream of commands
+        # alone: what the gateway sees once the worker sends the announcements.
+        interval = 0.005
+        # A year the daily scenario did not use, so the ledger has work to do.
+        local_date = self._busiest_day(2028)
+        due = [(guild_id, local_date) for guild_id in self.client.guilds]
+        before = Counter(self.transport.calls)
+        started_at = time.perf_counter()
+        daily = asyncio.create_task(self.bot_module.check_birthdays(due))
+        during = await self._set_stream(interval, until=daily)
+        await daily
+        duration = time.perf_counter() - started_at
+        baseline = await self._set_stream(interval, count=len(during))
+        result = latency_summary(during, duration)
+        result["baseline_p50_ms"] = percentile(baseline, 0.50) * 1000
+        result["baseline_p99_ms"] = percentile(baseline, 0.99) * 1000
+        result.update(self._calls_since(before))
+        return result
+
+    async def run_ready(self):
+        # Command sync on startup, for at most --max-sync guilds.
+        guild_ids = [int(guild_id) for guild_id in self.client.guilds][
+            : self.args.max_sync
+        ]
+        transport = self.transport
+
+        async def fake_sync(guild=None):
+            await transport.request("commands")
+
+        self.bot_module.bot.tree.sync = fake_sync
+        before = Counter(self.transport.calls)
+        started_at = time.perf_counter()
+        await self.bot_module.sync_guild_commands(guild_ids, force=True)
+        duration = time.perf_counter() - started_at
+        result = {
+            "duration_s": duration,
+            "guilds": len(guild_ids),
+            "throughput_per_s": len(guild_ids) / duration if duration else 0.0,
+        }
+        result.update(self._calls_since(before))
+        return result
+
+
+def write_data(data_dir, guild_count, users_per_guild, seed=0):
+    # Writes the synthetic data files and returns the config.
+    birthdays, config = generate_data(guild_count, users_per_guild, seed)
+    with open(os.path.join(data_dir, "birthdays.json"), "w", encoding="utf-8") as f:
+        json.dump(birthdays, f)
+    with open(os.path.join(data_dir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return config
+
+
+def import_bot(data_dir, backend):
+    # Imports bot.py against data_dir and loads its data like a real start.
+    # Returns the module, the import time and the data loading time.
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.setdefault("STORAGE_BACKEND", backend)
+    started_at = time.perf_counter()
+    bot_module = importlib.import_module("bot")
+    imported_at = time.perf_counter()
+    asyncio.run(bot_module.load_data())
+    loaded_at = time.perf_counter()
+    return bot_module, imported_at - started_at, loaded_at - imported_at
+
+
+def run_one(args):
+    # Runs every scenario for one data size in this process.
+    data_dir = tempfile.mkdtemp(prefix="birthdaybot-bench-")
+    config = write_data(data_dir, args.guild_count, args.users, args.seed)
+    bot_module, import_time, load_time = import_bot(data_dir, args.backend)
+
+    transport = FakeTransport(args.latency, args.rate_limit_ratio, seed=args.seed)
+    client = FakeClient(transport, config)
+    bot_module.bot.get_channel = client.get_channel
+    bot_module.bot.fetch_channel = client.fetch_channel
+    bot_module.user_resolver.client = client
+    scenario = Scenario(bot_module, client, transport, args)
+
+    async def run_scenarios():
+        results = {}
+        for name in args.scenarios:
+            results[name] = await getattr(scenario, f"run_{name}")()
+        return results
+
+    scenarios = asyncio.run(run_scenarios())
+    bot_module.storage.close()
+    bot_module.ledger.close()
+    return {
+        "guilds": args.guild_count,
+        "users_per_guild": args.users,
+        "startup_s": import_time + load_time,
+        "peak_rss_mb": peak_rss_mb(),
+        "scenarios": scenarios,
+    }
+
+
+# ========================== Startup ==========================
+
+# The first start reads the data files and writes the snapshot, the second
+# one reads the snapshot.
+STARTUP_RUNS = ["cold", "snapshot"]
+
+
+def run_startup(args):
+    # One start of the bot against an existing data directory; with --shards,
+    # a process running only shard --shard-id of them.
+    if args.shard_id is not None:
+        os.environ["SHARD_COUNT"] = str(args.shards)
+        os.environ["SHARD_IDS"] = str(args.shard_id)
+    bot_module, import_time, load_time = import_bot(args.data_dir, args.backend)
+    result = {
+        "guilds": args.guild_count,
+        "users_per_guild": args.users,
+        "shard": bot_module.shards.label(),
+        "loaded_guilds": len(bot_module.config),
+        "loaded_birthdays": len(bot_module.birthday_index),
+        "loaded_from": bot_module.storage.loaded_from,
+        # Time before bot.run can start connecting to the gateway.
+        "gateway_s": import_time,
+        # Time until the commands and the scheduler have their data.
+        "ready_s": import_time + load_time,
+        "load_s": load_time,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    bot_module.storage.close()
+    bot_module.ledger.close()
+    return result
+
+
+# ========================== Handover ==========================
+
+# "old" runs first and holds the scheduler lease, "new" takes over from it;
+# "restart" then starts alone, like after a systemctl restart.
+HANDOVER_ROLES = ["old", "new", "restart"]
+# User registered on the old instance after the new one loaded its data.
+LATE_USER_ID = "424242"
+LATE_DATE = "01/01"
+# Guild the bot joins while the new instance waits for the lease: it is not
+# in fetch_guilds() but is in the guild cache once connected.
+JOINED_GUILD_ID = 10**12
+
+
+class FakeGateway:
+    # Stands in for the Discord client of one instance: login() runs
+    # setup_hook like discord.py does, connect() fills the guild cache and
+    # dispatches on_ready, and returns once the bot is closed, fetch_guilds()
+    # and the command sync go through the fake transport.
+
+    def __init__(self, bot_module, client, transport, record, lifetime, joined=()):
+        self.bot_module = bot_module
+        self.client = client
+        self.transport = transport
+        self.record = record
+        # How long the instance stays connected unless something closes it.
+        self.lifetime = lifetime
+        # Guilds joined before connecting, missing from fetch_guilds().
+        self.joined = [FakeGuild(guild_id) for guild_id in joined]
+        self._closed = None
+
+    async def login(self, token):
+        self.record("login")
+        await self.bot_module.setup_hook()
+
+    async def connect(self, reconnect=True):
+        self._closed = asyncio.Event()
+        self.record("gateway_open")
+        # What discord.py receives in the READY and GUILD_CREATE events.
+        cache = self.bot_module.bot._connection._guilds
+        for guild in [*self.client.guilds.values(), *self.joined]:
+            cache[guild.id] = guild
+        await self.bot_module.on_ready()
+        self.record("ready")
+        try:
+            await asyncio.wait_for(self._closed.wait(), self.lifetime)
+        except asyncio.TimeoutError:
+            await self.close()
+
+    async def close(self):
+        if self._closed is not None and not self._closed.is_set():
+            self.record("gateway_closed")
+            self._closed.set()
+
+    async def fetch_guilds(self, limit=None):
+        await self.transport.request("guilds")
+        for guild in self.client.guilds.values():
+            yield guild
+
+    async def sync(self, guild=None):
+        await self.transport.request("commands")
+
+    def missing_commands(self):
+        # Connected guilds without the /birthday group in the tree, or whose
+        # commands no instance synced.
+        bot_module = self.bot_module
+        tree, tree_hash = bot_module.bot.tree, bot_module.command_tree_hash()
+        missing = []
+        for guild in bot_module.bot.guilds:
+            in_tree = tree.get_command(
+                "birthday", guild=bot_module.discord.Object(id=guild.id)
+            )
+            synced = bot_module.command_hashes.get(str(guild.id)) == tree_hash
+            if in_tree is None or not synced:
+                missing.append(guild.id)
+        return missing
+
+
+def run_handover_child(args):
+    # One instance of the bot, with the gateway and the REST API faked.
+    record = event_recorder(args.data_dir, args.handover_role)
+    record("start")
+    os.environ["DATA_DIR"] = args.data_dir
+    os.environ.setdefault("STORAGE_BACKEND", args.backend)
+    bot_module = importlib.import_module("bot")
+    with open(os.path.join(args.data_dir, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    transport = FakeTransport(args.latency, seed=args.seed)
+    client = FakeClient(transport, config)
+    lifetime = 600.0 if args.handover_role == "old" else 1.0
+    joined = [JOINED_GUILD_ID] if args.handover_role == "new" else []
+    gateway = FakeGateway(bot_module, client, transport, record, lifetime, joined)
+    bot = bot_module.bot
+    bot.login = gateway.login
+    bot.connect = gateway.connect
+    bot.close = gateway.close
+    bot.fetch_guilds = gateway.fetch_guilds
+    bot.tree.sync = gateway.sync
+    bot.get_channel = client.get_channel
+    bot.fetch_channel = client.fetch_channel
+    bot_module.user_resolver.client = client
+
+    lease = bot_module.lease
+    try_acquire, release = lease.try_acquire, lease.release
+
+    def recorded_try_acquire():
+        acquired = try_acquire()
+        if acquired:
+            record("lease_acquired")
+        return acquired
+
+    def recorded_release():
+        record("lease_released")
+        release()
+
+    lease.try_acquire = recorded_try_acquire
+    lease.release = recorded_release
+    scheduler = bot_module.scheduler
+    start_scheduler, stop_scheduler = scheduler.start, scheduler.stop
+
+    def recorded_start_scheduler():
+        record("scheduler_started")
+        start_scheduler()
+
+    def recorded_stop_scheduler():
+        record("scheduler_stopped")
+        stop_scheduler()
+
+    scheduler.start = recorded_start_scheduler
+    scheduler.stop = recorded_stop_scheduler
+    guild_id = next(iter(config))
+    if args.handover_role == "old":
+        hand_over = bot_module.hand_over
+
+        async def late_write_then_hand_over():
+            # A registration the new instance did not load: it must find it
+            # after the handover.
+            bot_module.storage.set_birthday(guild_id, LATE_USER_ID, LATE_DATE)
+            return await hand_over()
+
+        bot_module.hand_over = late_write_then_hand_over
+    elif args.handover_role == "new":
+        request_handover = lease.request_handover
+        prepare_commands = bot_module.prepare_commands
+
+        def recorded_request_handover():
+            record("handover_requested")
+            request_handover()
+
+        async def recorded_prepare_commands(guild_ids):
+            record("sync_started")
+            await prepare_commands(guild_ids)
+            record("sync_done")
+
+        lease.request_handover = recorded_request_handover
+        bot_module.prepare_commands = recorded_prepare_commands
+
+    asyncio.run(bot_module.run_bot())
+    bot_module.storage.close()
+    bot_module.ledger.close()
+    late_date = bot_module.birthdays.get(guild_id, {}).get(LATE_USER_ID)
+    record(
+        "exited",
+        late_write_seen=late_date == LATE_DATE,
+        missing_commands=len(gateway.missing_commands()),
+    )
+
+
+def start_handover_child(argv, data_dir, guild_count, role):
+    return subprocess.Popen(
+        child_command(
+            argv,
+            "--data-dir",
+            data_dir,
+            "--guild-count",
+            str(guild_count),
+            "--handover-role",
+            role,
+        ),
+        stdout=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def event_recorder(data_dir, role, name="handover"):
+    # record(event, **fields) appends one line to the run's events file.
+    events_file = os.path.join(data_dir, f"{name}_events.jsonl")
+
+    def record(event, **fields):
+        line = {"role": role, "event": event, "at": time.time()}
+        line.update(fields)
+        with open(events_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line) + "\n")
+
+    return record
+
+
+def read_handover_events(data_dir, name="handover"):
+    # { role: { event: (time, fields) } }, first occurrence of each event.
+    events = {}
+    try:
+        with open(
+            os.path.join(data_dir, f"{name}_events.jsonl"), encoding="utf-8"
+        ) as f:
+            for line in f:
+                event = json.loads(line)
+                events.setdefault(event["role"], {}).setdefault(event["event"], event)
+    except FileNotFoundError:
+        pass
+    return events
+
+
+def wait_for_children(processes, until=None, timeout=300):
+    # Polls (and so reaps) the children until `until()` is true or they all
+    # exited; a child that fails stops the benchmark.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        codes = [process.poll() for process in processes]
+        if any(code for code in codes):
+            raise RuntimeError(f"Child failed with exit code {codes}")
+        if until() if until else all(code == 0 for code in codes):
+            return
+        time.sleep(0.01)
+    raise RuntimeError("Children timed out")
+
+
+def run_handover(argv, args, guild_count):
+    data_dir = tempfile.mkdtemp(prefix="birthdaybot-bench-")
+    write_data(data_dir, guild_count, args.users, args.seed)
+    old = start_handover_child(argv, data_dir, guild_count, "old")
+    wait_for_children(
+        [old], until=lambda: "ready" in read_handover_events(data_dir).get("old", {})
+    )
+    new = start_handover_child(argv, data_dir, guild_count, "new")
+    wait_for_children([old, new])
+    restart = start_handover_child(argv, data_dir, guild_count, "restart")
+    wait_for_children([restart])
+    events = read_handover_events(data_dir)
+    shutil.rmtree(data_dir)
+
+    def at(role, event):
+        return events[role][event]["at"]
+
+    return {
+        "guilds": guild_count,
+        "users_per_guild": args.users,
+        # Spent by the new instance while the old one was still serving.
+        "warmup_s": at("new", "handover_requested") - at("new", "login"),
+        "gateway_gap_s": at("new", "gateway_open") - at("old", "gateway_closed"),
+        "ready_gap_s": at("new", "ready") - at("old", "gateway_closed"),
+        "scheduler_gap_s": at("new", "lease_acquired")
+        - at("old", "lease_released"),
+        # Must be 0: both instances never held the lease, or ran their
+        # scheduler, at once.
+        "lease_overlap_s": max(
+            0.0, at("old", "lease_released") - at("new", "lease_acquired")
+        ),
+        "scheduler_overlap_s": max(
+            0.0, at("old", "scheduler_stopped") - at("new", "scheduler_started")
+        ),
+        "late_write_seen": events["new"]["exited"]["late_write_seen"],
+        # Must be 0, the guild joined during the handover included.
+        "missing_commands": events["new"]["exited"]["missing_commands"],
+        # A systemctl restart instead: the old instance stops, then a new one
+        # starts alone and syncs the commands once connected (timed on "new",
+        # whose first sync covers every guild it fetched).
+        "stop_s": at("old", "exited") - at("old", "gateway_closed"),
+        "sync_s": at("new", "sync_done") - at("new", "sync_started"),
+        "restart_ready_s": at("restart", "ready") - at("restart", "start"),
+    }
+
+
+# ========================== Split ==========================
+
+# A split deployment in two processes: the worker (RUN_MODE=worker) sends the
+# busiest day's announcements while the gateway (RUN_MODE=gateway) answers
+# /birthday set and forwards each change over the IPC socket; the same stream
+# of commands is then timed again once the worker is idle.
+SPLIT_ROLES = ["worker", "gateway"]
+SPLIT_INTERVAL = 0.005
+# Marks the end of the gateway's commands; the worker reports what it applied.
+SPLIT_DONE = "benchmark_done"
+
+
+def import_split_bot(args, role):
+    os.environ["RUN_MODE"] = role
+    os.environ["IPC_SOCKET"] = os.path.join(args.data_dir, "worker.sock")
+    os.environ["DATA_DIR"] = args.data_dir
+    os.environ.setdefault("STORAGE_BACKEND", args.backend)
+    return importlib.import_module("bot")
+
+
+async def wait_for_event(data_dir, role, event):
+    while event not in read_handover_events(data_dir, "split").get(role, {}):
+        await asyncio.sleep(0.01)
+
+
+def run_split_worker(args):
+    record = event_recorder(args.data_dir, "worker", "split")
+    bot_module = import_split_bot(args, "worker")
+    with open(os.path.join(args.data_dir, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    transport = FakeTransport(args.latency, args.rate_limit_ratio, seed=args.seed)
+    client = FakeClient(transport, config)
+    bot = bot_module.bot
+
+    async def login(token):
+        await bot_module.setup_hook()
+
+    async def close():
+        pass
+
+    bot.login = login
+    bot.close = close
+    bot.get_channel = client.get_channel
+    bot.fetch_channel = client.fetch_channel
+    bot_module.user_resolver.client = client
+    bot_module.RELOAD_DELAY = 0.1
+    serve_events = bot_module.serve_events
+    handle_worker_event = bot_module.handle_worker_event
+    state = {"applied": 0, "daily": None}
+
+    async def recorded_serve_events(socket_path, handler):
+        server = await serve_events(socket_path, handler)
+        record("listening")
+        return server
+
+    async def run_daily():
+        local_date = busiest_day(bot_module.birthdays, 2024)
+        record("daily_started")
+        await bot_module.check_birthdays(
+            [(guild_id, local_date) for guild_id in bot_module.config]
+        )
+        record("daily_done")
+
+    async def recorded_handle_worker_event(event):
+        if event["op"] == SPLIT_DONE:
+            record("applied", applied=state["applied"])
+            state["done"].set()
+            return
+        await handle_worker_event(event)
+        if event["op"] != "reload":
+            state["applied"] += 1
+        elif state["daily"] is None:
+            # The gateway is connected: the announcements start.
+            state["daily"] = asyncio.create_task(run_daily())
+
+    bot_module.serve_events = recorded_serve_events
+    bot_module.handle_worker_event = recorded_handle_worker_event
+
+    async def main():
+        state["done"] = asyncio.Event()
+        worker = asyncio.create_task(bot_module.run_worker())
+        await state["done"].wait()
+        await state["daily"]
+        await wait_for_event(args.data_dir, "gateway", "latencies")
+        worker.cancel()
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    bot_module.storage.close()
+    bot_module.ledger.close()
+    record("exited")
+
+
+def run_split_gateway(args):
+    record = event_recorder(args.data_dir, "gateway", "split")
+    bot_module = import_split_bot(args, "gateway")
+    with open(os.path.join(args.data_dir, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    transport = FakeTransport(args.latency, seed=args.seed)
+    client = FakeClient(transport, config)
+    scenario = Scenario(bot_module, client, transport, args)
+    publisher = bot_module.publisher
+    publish = publisher.publish
+    published = []
+
+    def counted_publish(event):
+        published.append(event["op"])
+        publish(event)
+
+    publisher.publish = counted_publish
+
+    async def main():
+        await bot_module.load_data()
+        publisher.start()
+        await wait_for_event(args.data_dir, "worker", "daily_started")
+        daily_done = asyncio.create_task(
+            wait_for_event(args.data_dir, "worker", "daily_done")
+        )
+        during = await scenario._set_stream(SPLIT_INTERVAL, until=daily_done)
+        idle = await scenario._set_stream(SPLIT_INTERVAL, count=len(during))
+        changes = len(published)
+        publish({"op": SPLIT_DONE, "guild_id": None})
+        await wait_for_event(args.data_dir, "worker", "applied")
+        # Closes the connection, so the worker sees it end before it stops.
+        publisher._task.cancel()
+        await asyncio.gather(publisher._task, return_exceptions=True)
+        return during, idle, changes
+
+    during, idle, changes = asyncio.run(main())
+    bot_module.storage.close()
+    bot_module.ledger.close()
+    record("latencies", during=during, idle=idle, changes=changes)
+
+
+def start_split_child(argv, data_dir, guild_count, role):
+    return subprocess.Popen(
+        child_command(
+            argv,
+            "--data-dir",
+            data_dir,
+            "--guild-count",
+            str(guild_count),
+            "--split-role",
+            role,
+        ),
+        stdout=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+
+def run_split(argv, args, guild_count):
+    data_dir = tempfile.mkdtemp(prefix="birthdaybot-bench-")
+    write_data(data_dir, guild_count, args.users, args.seed)
+    worker = start_split_child(argv, data_dir, guild_count, "worker")
+    wait_for_children(
+        [worker],
+        until=lambda: "listening"
+        in read_handover_events(data_dir, "split").get("worker", {}),
+    )
+    gateway = start_split_child(argv, data_dir, guild_count, "gateway")
+    wait_for_children([worker, gateway])
+    events = read_handover_events(data_dir, "split")
+    shutil.rmtree(data_dir)
+    worker_events = events["worker"]
+    latencies = events["gateway"]["latencies"]
+    during, idle = latencies["during"], latencies["idle"]
+    return {
+        "guilds": guild_count,
+        "users_per_guild": args.users,
+        "daily_s": worker_events["daily_done"]["at"]
+        - worker_events["daily_started"]["at"],
+        "sets": len(during) + len(idle),
+        # Changes published by the gateway (an invalid date, such as 29/02
+        # with the year strptime assumes, is answered without one), and how
+        # many the worker applied to its mirror: they must be equal.
+        "changes": latencies["changes"],
+        "applied": worker_events["applied"]["applied"],
+        "p50_ms": percentile(during, 0.50) * 1000,
+        "p99_ms": percentile(during, 0.99) * 1000,
+        "idle_p50_ms": percentile(idle, 0.50) * 1000,
+        "idle_p99_ms": percentile(idle, 0.99) * 1000,
+    }
+
+
+# ========================== Memory ==========================
+
+MEMORY_LAYOUTS = ["dict", "compact"]
+
+
+def build_layout(layout, registrations, users_per_guild, seed=0):
+    # Builds the birthdays in the given layout one guild at a time, so the
+    # peak RSS is that of the layout and not of an intermediate copy.
+    rng = random.Random(seed)
+    birthdays = {} if layout == "dict" else CompactBirthdays()
+    for index in range(max(1, registrations // users_per_guild)):
+        birthdays[guild_id_for(index)] = {
+            str(rng.getrandbits(60)): random_date(rng) for _ in range(users_per_guild)
+        }
+    return birthdays
+
+
+def run_memory(args):
+    # Peak RSS taken by one layout, in this process.
+    baseline = peak_rss_mb()
+    started_at = time.perf_counter()
+    birthdays = build_layout(args.layout, args.registrations, args.users, args.seed)
+    build = time.perf_counter() - started_at
+    used = peak_rss_mb() - baseline
+    return {
+        "layout": args.layout,
+        "registrations": args.registrations,
+        "guilds": len(birthdays),
+        "build_s": build,
+        "rss_mb": used,
+        "rss_mb_per_million": used * 1_000_000 / args.registrations,
+    }
+
+
+# ========================== Daily lookup ==========================
+
+# The lookup mode grows the total number of registrations while the guilds and
+# the birthdays of the measured day stay the same, and times what midnight
+# does for them: the index lookups and the ledger writes. That time must not
+# grow with the registrations on the other days.
+LOOKUP_DAY = (6, 15)
+LOOKUP_DUE_PER_GUILD = 3
+LOOKUP_RUNS = 5
+# Largest size against smallest: allowed ratio, plus slack for timer noise.
+LOOKUP_MAX_GROWTH = 2.0
+LOOKUP_SLACK_S = 0.005
+
+
+def build_lookup_birthdays(registrations, guild_count):
+    # LOOKUP_DUE_PER_GUILD birthdays on LOOKUP_DAY per guild, the rest spread
+    # over the other days. Built from arrays: at 10M registrations, dicts of
+    # strings would take most of the time and memory.
+    due = MONTH_DAY_TO_CODE[LOOKUP_DAY]
+    other_codes = [code for code in range(1, len(CODE_TO_STR)) if code != due]
+    users_per_guild = max(LOOKUP_DUE_PER_GUILD, registrations // guild_count)
+    others = users_per_guild - LOOKUP_DUE_PER_GUILD
+    codes = array("H", [due] * LOOKUP_DUE_PER_GUILD)
+    codes += array("H", other_codes * (others // len(other_codes) + 1))[:others]
+    birthdays = CompactBirthdays()
+    for index in range(guild_count):
+        first_user = (index + 1) << 32
+        birthdays[guild_id_for(index)] = GuildBirthdays.from_arrays(
+            array("Q", range(first_user, first_user + users_per_guild)),
+            array("H", codes),
+        )
+    return birthdays
+
+
+def run_lookup(args):
+    # One size in this process: the bot's own enqueue_birthdays, against an
+    # index built from the synthetic birthdays and the bot's ledger.
+    data_dir = tempfile.mkdtemp(prefix="birthdaybot-bench-")
+    bot_module, _, _ = import_bot(data_dir, args.backend)
+    birthdays = build_lookup_birthdays(args.lookup_size, args.lookup_guilds)
+    started_at = time.perf_counter()
+    bot_module.birthday_index = bot_module.BirthdayIndex.from_birthdays(birthdays)
+    build = time.perf_counter() - started_at
+    timings = []
+    for run in range(LOOKUP_RUNS):
+        # A new date each run, so no run finds the previous one's entries.
+        local_date = datetime.date(2001 + run, *LOOKUP_DAY)
+        due = [(guild_id, local_date) for guild_id in birthdays]
+        started_at = time.perf_counter()
+        bot_module.enqueue_birthdays(due)
+        timings.append(time.perf_counter() - started_at)
+    announcements = bot_module.ledger.conn.execute(
+        "SELECT count(*) FROM announcements WHERE date = ?", (local_date.isoformat(),)
+    ).fetchone()[0]
+    bot_module.storage.close()
+    bot_module.ledger.close()
+    shutil.rmtree(data_dir)
+    return {
+        "registrations": sum(map(len, birthdays.values())),
+        "guilds": len(birthdays),
+        "announcements": announcements,
+        "build_s": build,
+        "lookup_s": percentile(timings, 0.5),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def check_lookup_growth(runs):
+    # Returns the failure message if the largest size is not flat.
+    first, last = runs[0], runs[-1]
+    allowed = first["lookup_s"] * LOOKUP_MAX_GROWTH + LOOKUP_SLACK_S
+    if last["lookup_s"] > allowed:
+        return (
+            f"daily lookup grew from {first['lookup_s'] * 1000:.1f} ms at "
+            f"{first['registrations']} registrations to "
+            f"{last['lookup_s'] * 1000:.1f} ms at {last['registrations']} "
+            f"(allowed: {allowed * 1000:.1f} ms)"
+        )
+    return None
+
+
+# ========================== Reporting ==========================
+
+# Metrics where a higher value is a regression.
+COMPARED_METRICS = ["p50_ms", "p99_ms", "duration_s", "api_calls"]
+
+
+def compare(previous, current, threshold):
+    previous_runs = {run["guilds"]: run for run in previous.get("runs", [])}
+    regressions = []
+    for run in current["runs"]:
+        old_run = previous_runs.get(run["guilds"])
+        if old_run is None:
+            continue
+        for name, metrics in run["scenarios"].items():
+            old_metrics = old_run["scenarios"].get(name, {})
+            for metric in COMPARED_METRICS:
+                old, new = old_metrics.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                line = (
+                    f"{run['guilds']} guilds / {name} / {metric}: "
+                    f"{old:.3f} -> {new:.3f} ({change:+.1%})"
+                )
+                if change > threshold:
+                    regressions.append(line)
+                    print_warning(line)
+                else:
+                    print_info(line)
+    return regressions
+
+
+def print_memory(run):
+    print_info(
+        f"{run['layout']}: {run['registrations']} registrations in "
+        f"{run['guilds']} guilds, built in {run['build_s']:.2f}s, "
+        f"{run['rss_mb']:.1f} MB ({run['rss_mb_per_million']:.1f} MB per million)"
+    )
+
+
+def print_lookup(run):
+    print_info(
+        f"{run['registrations']} registrations in {run['guilds']} guilds: "
+        f"{run['announcements']} due, looked up and enqueued in "
+        f"{run['lookup_s'] * 1000:.1f} ms (index built in {run['build_s']:.2f}s, "
+        f"peak RSS {run['peak_rss_mb']:.1f} MB)"
+    )
+
+
+def print_split(run):
+    print_info(
+        f"{run['guilds']} guilds x {run['users_per_guild']} users: /birthday set "
+        f"p50 {run['p50_ms']:.1f} ms, p99 {run['p99_ms']:.1f} ms while the "
+        f"worker announced for {run['daily_s']:.2f}s (idle worker: p50 "
+        f"{run['idle_p50_ms']:.1f} ms, p99 {run['idle_p99_ms']:.1f} ms), "
+        f"{run['applied']}/{run['changes']} changes applied by the worker"
+    )
+    if run["applied"] != run["changes"]:
+        print_warning("the worker did not apply every change")
+
+
+def print_startup(run):
+    print_info(
+        f"{run['guilds']} guilds x {run['users_per_guild']} users, "
+        f"shards {run['shard']} ({run['loaded_guilds']} guilds, "
+        f"{run['loaded_birthdays']} birthdays), "
+        f"from {run['loaded_from']}: gateway after {run['gateway_s']:.2f}s, "
+        f"data ready after {run['ready_s']:.2f}s, "
+        f"peak RSS {run['peak_rss_mb']:.1f} MB"
+    )
+
+
+def handover_ok(run):
+    return (
+        not run["lease_overlap_s"]
+        and not run["scheduler_overlap_s"]
+        and run["late_write_seen"]
+        and not run["missing_commands"]
+    )
+
+
+def print_handover(run):
+    restart_s = run["stop_s"] + run["restart_ready_s"] + run["sync_s"]
+    print_info(
+        f"{run['guilds']} guilds x {run['users_per_guild']} users: "
+        f"warmup {run['warmup_s']:.2f}s while the old instance served, then "
+        f"gateway down {run['gateway_gap_s']:.2f}s, ready after "
+        f"{run['ready_gap_s']:.2f}s (restart: {restart_s:.2f}s), "
+        f"scheduler handed over in {run['scheduler_gap_s']:.2f}s"
+    )
+    if not handover_ok(run):
+        print_warning(
+            f"lease overlap {run['lease_overlap_s']:.3f}s, "
+            f"scheduler overlap {run['scheduler_overlap_s']:.3f}s, "
+            f"late write seen: {run['late_write_seen']}, "
+            f"guilds without commands: {run['missing_commands']}"
+        )
+
+
+def print_run(run):
+    print_info(
+        f"{run['guilds']} guilds x {run['users_per_guild']} users: "
+        f"startup {run['startup_s']:.2f}s, peak RSS {run['peak_rss_mb']:.1f} MB"
+    )
+    for name, metrics in run["scenarios"].items():
+        summary = ", ".join(
+            f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in metrics.items()
+            if key != "api_calls_by_route"
+        )
+        print(f"    {name}: {summary}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for BirthdayBot")
+    parser.add_argument(
+        "--guilds",
+        default="10,1000,100000",
+        help="comma-separated guild counts, one run per count",
+    )
+    parser.add_argument("--users", type=int, default=20, help="users per guild")
+    parser.add_argument(
+        "--scenarios", default=",".join(SCENARIOS), help="scenarios to run"
+    )
+    parser.add_argument("--latency", type=float, default=0.02, help="API latency (s)")
+    parser.add_argument(
+        "--rate-limit-ratio",
+        type=float,
+        default=0.01,
+        help="share of calls answered with a 429",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1000, help="concurrent /birthday set calls"
+    )
+    parser.add_argument(
+        "--sample", type=int, default=50, help="guilds queried by /birthday all"
+    )
+    parser.add_argument(
+        "--max-sync", type=int, default=1000, help="guilds synced in the ready scenario"
+    )
+    parser.add_argument("--backend", default="json", help="storage backend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="compare the RSS of the birthday layouts instead of the scenarios",
+    )
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="measure the startup time (data files, then snapshot) per size",
+    )
+    parser.add_argument(
+        "--handover",
+        action="store_true",
+        help="hand over between two local instances with a fake gateway, per size",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="with --startup, start each of this many shards in its own process",
+    )
+    parser.add_argument(
+        "--split",
+        action="store_true",
+        help="time /birthday set on a gateway process while a worker announces",
+    )
+    parser.add_argument(
+        "--lookup",
+        action="store_true",
+        help="time the daily lookup and enqueue as the registrations grow",
+    )
+    parser.add_argument(
+        "--lookup-sizes",
+        default="10000,100000,1000000,10000000",
+        help="comma-separated registration counts for --lookup",
+    )
+    parser.add_argument(
+        "--lookup-guilds", type=int, default=1000, help="due guilds in --lookup"
+    )
+    parser.add_argument(
+        "--registrations",
+        type=int,
+        default=1_000_000,
+        help="registrations built by --memory",
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed slowdown when comparing"
+    )
+    # Internal: run a single data size and write its result to a file.
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--guild-count", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    parser.add_argument("--layout", choices=MEMORY_LAYOUTS, help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--lookup-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--shard-id", type=int, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--handover-role", choices=HANDOVER_ROLES, help=argparse.SUPPRESS
+    )
+    parser.add_argument("--split-role", choices=SPLIT_ROLES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    return args
+
+
+def child_command(argv, *extra):
+    # This script again, with the same arguments plus `extra`.
+    child_args = [a for a in (argv or sys.argv[1:]) if a]
+    return [sys.executable, os.path.abspath(__file__), *child_args, *extra]
+
+
+def run_child(argv, *extra):
+    # Runs this script again in a fresh process (so RSS and import costs are
+    # not shared between runs) and returns the result it wrote.
+    fd, result_file = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    subprocess.run(
+        child_command(argv, *extra, "--result-file", result_file),
+        check=True,
+        stdout=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    with open(result_file, encoding="utf-8") as f:
+        result = json.load(f)
+    os.unlink(result_file)
+    return result
+
+
+def save_results(args, results):
+    results = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        **results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print_info(f"Results saved to {args.output}.")
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.handover_role:
+        run_handover_child(args)
+        return 0
+    if args.split_role == "worker":
+        run_split_worker(args)
+        return 0
+    if args.split_role == "gateway":
+        run_split_gateway(args)
+        return 0
+    if args.result_file:
+        if args.layout:
+            result = run_memory(args)
+        elif args.lookup_size:
+            result = run_lookup(args)
+        elif args.data_dir:
+            result = run_startup(args)
+        else:
+            result = run_one(args)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    if args.memory:
+        layouts = []
+        for layout in MEMORY_LAYOUTS:
+            print_info(f"Building {args.registrations} registrations ({layout})...")
+            run = run_child(argv, "--layout", layout)
+            print_memory(run)
+            layouts.append(run)
+        save_results(args, {"users_per_guild": args.users, "memory": layouts})
+        return 0
+
+    if args.lookup:
+        runs = []
+        for size in [int(size) for size in args.lookup_sizes.split(",")]:
+            print_info(f"Looking up the day among {size} registrations...")
+            run = run_child(argv, "--lookup-size", str(size))
+            print_lookup(run)
+            runs.append(run)
+        save_results(args, {"backend": args.backend, "lookup": runs})
+        failure = check_lookup_growth(runs)
+        if failure:
+            print_warning(failure)
+            return 1
+        return 0
+
+    if args.startup:
+        if args.shards and args.backend != "sqlite":
+            print_warning("--shards requires --backend sqlite")
+            return 2
+        # One process for all the shards, or one per shard.
+        shard_args = [[]]
+        if args.shards:
+            shard_args = [["--shard-id", str(i)] for i in range(args.shards)]
+        runs = []
+        for guild_count in [int(count) for count in args.guilds.split(",")]:
+            print_info(f"Starting with {guild_count} guilds...")
+            data_dir = tempfile.mkdtemp(prefix="birthdaybot-bench-")
+            write_data(data_dir, guild_count, args.users, args.seed)
+            if args.backend == "sqlite":
+                # Migrated once here rather than by the first start timed.
+                migrate_json_to_sqlite(
+                    os.path.join(data_dir, "birthdays.json"),
+                    os.path.join(data_dir, "config.json"),
+                    os.path.join(data_dir, "birthdays.db"),
+                )
+            for extra in shard_args:
+                for _ in STARTUP_RUNS:
+                    run = run_child(
+                        argv,
+                        "--data-dir",
+                        data_dir,
+                        "--guild-count",
+                        str(guild_count),
+                        *extra,
+                    )
+                    print_startup(run)
+                    runs.append(run)
+            shutil.rmtree(data_dir)
+        save_results(args, {"backend": args.backend, "startup": runs})
+        return 0
+
+    if args.split:
+        runs = []
+        for guild_count in [int(count) for count in args.guilds.split(",")]:
+            print_info(f"Splitting gateway and worker with {guild_count} guilds...")
+            run = run_split(argv, args, guild_count)
+            print_split(run)
+            runs.append(run)
+        save_results(args, {"backend": args.backend, "split": runs})
+        return 1 if any(run["applied"] != run["changes"] for run in runs) else 0
+
+    if args.handover:
+        runs = []
+        for guild_count in [int(count) for count in args.guilds.split(",")]:
+            print_info(f"Handing over with {guild_count} guilds...")
+            run = run_handover(argv, args, guild_count)
+            print_handover(run)
+            runs.append(run)
+        save_results(args, {"backend": args.backend, "handover": runs})
+        return 0 if all(handover_ok(run) for run in runs) else 1
+
+    runs = []
+    for guild_count in [int(count) for count in args.guilds.split(",")]:
+        print_info(f"Running {guild_count} guilds...")
+        run = run_child(argv, "--run-one", "--guild-count", str(guild_count))
+        print_run(run)
+        runs.append(run)
+
+    settings = {
+        "users_per_guild": args.users,
+        "latency": args.latency,
+        "rate_limit_ratio": args.rate_limit_ratio,
+        "backend": args.backend,
+    }
+    results = save_results(args, {"settings": settings, "runs": runs})
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(previous, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import calendar
+import datetime
+
+from array import array
+from bisect import bisect_left, bisect_right
+from compact_store import (
+    CODE_TO_MONTH_DAY,
+    CODE_TO_STR,
+    MONTH_DAY_TO_CODE,
+    encode_date,
+)
+
+# In-memory index of registered birthdays, keyed by day of the year.
+#
+# The daily check only needs the users whose birthday falls on the current
+# date, so instead of scanning every guild for each of them we keep a bucket
+# per day-of-year code (see compact_store): two parallel arrays of guild IDs
+# and user IDs, sorted by (guild ID, user ID), so one guild's birthdays of the
+# day are found by bisection.
+#
+# The buckets are built once when the data is loaded, in the loader thread,
+# with a counting sort over the codes, and then kept up to date on writes.
+# That is 16 bytes per registration, and a day's lookup costs the same
+# whatever the number of registrations on the other days.
+
+BYTES_PER_ENTRY = 2 * array("Q").itemsize
+
+# Longest window of upcoming_birthdays: a year, so nobody is listed twice.
+MAX_UPCOMING_DAYS = 365
+_FEB_29 = MONTH_DAY_TO_CODE[(2, 29)]
+
+
+def parse_day_month(date_str):
+    # "DD/MM" -> (month, day)
+    day, month = map(int, date_str.split("/"))
+    return month, day
+
+
+class BirthdayIndex:
+    def __init__(self):
+        # Per code (index 0 unused): guild IDs and user IDs as uint64.
+        self._guild_ids = [array("Q") for _ in CODE_TO_STR]
+        self._user_ids = [array("Q") for _ in CODE_TO_STR]
+
+    @classmethod
+    def from_birthdays(cls, birthdays):
+        # Counting sort: the guilds are read in ID order and each guild's
+        # users are already sorted, so every bucket comes out sorted without
+        # comparing any pair.
+        index = cls()
+        add_guild = [guild_ids.append for guild_ids in index._guild_ids]
+        add_user = [user_ids.append for user_ids in index._user_ids]
+        for guild_id in sorted(birthdays, key=int):
+            guild = int(guild_id)
+            for user_id, code in birthdays[guild_id].packed_items():
+                add_guild[code](guild)
+                add_user[code](user_id)
+        return index
+
+    def _guild_range(self, code, guild):
+        guild_ids = self._guild_ids[code]
+        start = bisect_left(guild_ids, guild)
+        return start, bisect_right(guild_ids, guild, start)
+
+    def add(self, guild_id, user_id, date_str, previous=None):
+        # Called after the birthday was written: moves the user from the
+        # bucket of `previous`, the date they had before if any, to the bucket
+        # of the new date.
+        guild, user = int(guild_id), int(user_id)
+        if previous is not None:
+            code = encode_date(previous)
+            start, end = self._guild_range(code, guild)
+            i = bisect_left(self._user_ids[code], user, start, end)
+            if i < end and self._user_ids[code][i] == user:
+                del self._guild_ids[code][i]
+                del self._user_ids[code][i]
+        code = encode_date(date_str)
+        start, end = self._guild_range(code, guild)
+        i = bisect_left(self._user_ids[code], user, start, end)
+        self._guild_ids[code].insert(i, guild)
+        self._user_ids[code].insert(i, user)
+
+    def set_guild(self, guild_id, guild_birthdays):
+        # Replaces all of a guild's entries, e.g. after a bulk import: its
+        # slice of each bucket is swapped for the new one.
+        guild = int(guild_id)
+        by_code = [[] for _ in CODE_TO_STR]
+        if guild_birthdays:
+            for user_id, code in guild_birthdays.packed_items():
+                by_code[code].append(user_id)
+        for code in range(1, len(CODE_TO_STR)):
+            start, end = self._guild_range(code, guild)
+            user_ids = by_code[code]
+            self._guild_ids[code][start:end] = array("Q", [guild]) * len(user_ids)
+            self._user_ids[code][start:end] = array("Q", user_ids)
+
+    def remove_guild(self, guild_id):
+        self.set_guild(guild_id, None)
+
+    def users_on(self, guild_id, month, day):
+        # The guild's user IDs (strings) whose birthday is on the given day.
+        code = MONTH_DAY_TO_CODE.get((month, day))
+        if code is None:
+            return []
+        start, end = self._guild_range(code, int(guild_id))
+        return [str(user_id) for user_id in self._user_ids[code][start:end]]
+
+    def count_on(self, month, day):
+        # Birthdays on the given day, all guilds together.
+        code = MONTH_DAY_TO_CODE.get((month, day))
+        return len(self._user_ids[code]) if code else 0
+
+    def __len__(self):
+        return sum(map(len, self._user_ids))
+
+
+def upcoming_birthdays(guild_birthdays, today, days=MAX_UPCOMING_DAYS, limit=None):
+    # [(delta, date, user_id)] for a guild's birthdays in the `days` days from
+    # today (included), soonest first, at most `limit` of them. The guild's
+    # birthdays are read in date order from today's code, wrapping into next
+    # year, so the cost depends on what is returned and not on the guild size.
+    # Like the announcements, 29/02 only counts in leap years.
+    upcoming = []
+    end = today + datetime.timedelta(days=min(days, MAX_UPCOMING_DAYS) - 1)
+    first = MONTH_DAY_TO_CODE[(today.month, today.day)]
+    for year in range(today.year, end.year + 1):
+        last = MONTH_DAY_TO_CODE[(end.month, end.day)] if year == end.year else 366
+        # (delta, date) per code, shared by everyone born that day.
+        dates = {}
+        for code, user_id in guild_birthdays.between(first, last):
+            entry = dates.get(code)
+            if entry is None:
+                if code == _FEB_29 and not calendar.isleap(year):
+                    continue
+                date = datetime.date(year, *CODE_TO_MONTH_DAY[code])
+                entry = dates[code] = ((date - today).days, date)
+            upcoming.append((*entry, user_id))
+            if limit is not None and len(upcoming) >= limit:
+                return upcoming
+        first = 1
+    return upcoming
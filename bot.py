@@ -1,15 +1,80 @@
+import aiohttp
+import asyncio
 import datetime
 import discord
+import functools
+import hashlib
+import json
+import loop_monitor
 import os
-import random
+import signal
+import time
+import zoneinfo
 
-from discord.ext import commands, tasks
+from announcer import AnnouncementDispatcher
+from birthday_index import (
+    BYTES_PER_ENTRY,
+    MAX_UPCOMING_DAYS,
+    BirthdayIndex,
+    upcoming_birthdays,
+)
+from bulk_io import (
+    MAX_IMPORT_BYTES,
+    BulkImportError,
+    download,
+    import_format,
+    parse_import,
+    write_export,
+)
+from compact_store import BYTES_PER_BIRTHDAY, CompactBirthdays, encode_date
+from discord.ext import commands
 from dotenv import load_dotenv
-from json_helper import load_json, save_json
+from handover import HANDOVER_TIMEOUT, POLL_INTERVAL, SchedulerLease, wait_for_exit
+from ipc import EventPublisher, serve_events
+from json_helper import load_json, save_json_atomic
+from ledger import POSTED, PENDING, THREADED, AnnouncementLedger
+from metrics import Counter, Histogram, instrument_command, serve as serve_metrics
+from pruning import BATCH_SIZE, PendingRemovals, pruned_birthdays, pruned_guilds
+from resource_manager import ResourceManager
+from scheduler import DEFAULT_TIMEZONE, GuildScheduler, get_timezone
+from sharding import ShardFilter, parse_shard_ids, peak_rss_mb
+from storage import open_storage
+from typing import Literal
+from user_resolver import UserResolver
+
+started_at = time.monotonic()
 
 # Load environment variables from .env file
 load_dotenv(".env")
 TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+# "json" (default) or "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+# Optional sharding: SHARD_COUNT shards in total, of which this process runs
+# SHARD_IDS (e.g. "0-3"). Without SHARD_IDS the process runs every shard.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS", "")) or None
+# Optional metrics endpoint (Prometheus text format) on METRICS_HOST:METRICS_PORT.
+# METRICS_TRACE_SLOW keeps that many of the slowest handler calls for /debug/slow.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_TRACE_SLOW = int(os.getenv("METRICS_TRACE_SLOW", "0"))
+# "all" (default) runs everything in one process. A split deployment runs one
+# process with RUN_MODE=gateway (interactions) and one with RUN_MODE=worker
+# (scheduling and announcements, over REST only), connected by IPC_SOCKET.
+RUN_MODE = os.getenv("RUN_MODE", "all")
+if RUN_MODE not in ("all", "gateway", "worker"):
+    raise ValueError(f"Unknown RUN_MODE: {RUN_MODE}")
+IPC_SOCKET = os.getenv("IPC_SOCKET")
+# The event loop blocked for longer than LOOP_STALL_THRESHOLD seconds is logged
+# with the stack it is stuck in (0 disables it). SIGUSR1 writes a profile of
+# PROFILE_SECONDS seconds to the profiles/ folder of the data directory.
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.5"))
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))
+# The data of a guild the bot left, or of a member who left a guild, is removed
+# PRUNE_GRACE_DAYS days later by a compaction pass run every PRUNE_INTERVAL
+# seconds (0 disables the removal; departures are still recorded).
+PRUNE_GRACE_DAYS = float(os.getenv("PRUNE_GRACE_DAYS", "7"))
+PRUNE_INTERVAL = float(os.getenv("PRUNE_INTERVAL", "3600"))
 
 # Activate necessary intents
 intents = discord.Intents.default()
@@ -17,25 +82,64 @@ intents.message_content = True  # To access message content if needed
 intents.guilds = True  # To interact with servers
 intents.members = True  # To access member information
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+shards = ShardFilter(SHARD_COUNT, SHARD_IDS)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS,
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
+
+# Resolves user IDs through the member/user caches before calling fetch_user.
+user_resolver = UserResolver(bot)
+# Paces and retries the REST calls made by the daily announcements.
+dispatcher = AnnouncementDispatcher()
 
 # ========================== Load data ==========================
 
-data_dir = "data"
+data_dir = os.getenv("DATA_DIR", "data")
 
 # Create a data directory if it doesn't exist
 if not os.path.exists(data_dir):
     os.makedirs(data_dir)
 
-birthdays_file = os.path.join(data_dir, "birthdays.json")
-config_file = os.path.join(data_dir, "config.json")
+# Binary copy of the data, read on the next start instead of the data files
+# when they did not change in between (see snapshot.py).
+if shards.is_partial:
+    snapshot_file = os.path.join(data_dir, f"snapshot_shards_{shards.label()}.bin")
+else:
+    snapshot_file = os.path.join(data_dir, "snapshot.bin")
 
-# The birthdays.json file should have a structure like:
+# The data is loaded by load_data() in a worker thread while the gateway
+# connects; the commands wait for data_ready (see requires_data).
+storage = None
+# The birthdays have a structure like:
 # { guild_id: { user_id: "DD/MM", ... }, ... }
-birthdays = load_json(birthdays_file)
-# The config.json file should have a structure like:
+# stored compactly by compact_store (packed user IDs and day-of-year codes).
+birthdays = CompactBirthdays()
+# The config has a structure like:
 # { guild_id: { "birthday_channel": channel_id, ... }, ... }
-config = load_json(config_file)
+config = {}
+# Index birthdays by (month, day) so the daily check only reads today's bucket.
+birthday_index = BirthdayIndex()
+data_ready = asyncio.Event()
+
+# Every announcement goes through this ledger so restarts neither skip nor
+# repeat one.
+ledger = AnnouncementLedger(os.path.join(data_dir, "announcements.db"))
+
+# Guilds and members that left, waiting for the grace period before their data
+# is removed (see pruning.py).
+if shards.is_partial:
+    removals_file = os.path.join(data_dir, f"departures_shards_{shards.label()}.json")
+else:
+    removals_file = os.path.join(data_dir, "departures.json")
+removals = PendingRemovals(removals_file)
+# A small file, read now so no departure event can arrive before it is loaded.
+removals.load()
 
 # =================== Load resources (GIFs and messages) ===================
 
@@ -44,14 +148,74 @@ birthday_messages_file = os.path.join(resources_dir, "birthday_messages.json")
 gifs_file = os.path.join(resources_dir, "gifs.json")
 
 # The birthday_messages.json in resources should have a structure like:
-# { "BIRTHDAY_MESSAGES": [ "message1", "message2", ... ] }
-resources_birthday_data = load_json(birthday_messages_file)
-BIRTHDAY_MESSAGES = resources_birthday_data.get("BIRTHDAY_MESSAGES", [])
-
+# { "BIRTHDAY_MESSAGES": [ "message1 {user}", "message2 {user}", ... ] }
 # The gifs.json in resources should have a structure like:
 # { "GIFS": [ "gif_url1", "gif_url2", ... ] }
-resources_gif_data = load_json(gifs_file)
-GIFS = resources_gif_data.get("GIFS", [])
+# Both are reloaded when they change, without a restart.
+resources = ResourceManager(birthday_messages_file, gifs_file)
+
+
+def load_all():
+    # Runs in a worker thread: everything read from disk at startup.
+    # A process running only some of the shards loads only their guilds.
+    loaded_storage = open_storage(
+        STORAGE_BACKEND,
+        data_dir,
+        owns=shards.owns if shards.is_partial else None,
+        snapshot_file=snapshot_file,
+        shards=shards.label(),
+    )
+    index = BirthdayIndex.from_birthdays(loaded_storage.birthdays)
+    resources.load()
+    return loaded_storage, index
+
+
+async def load_data():
+    # Also used to reload the data, e.g. after a handover.
+    global storage, birthdays, config, birthday_index
+    previous_storage = storage
+    load_started_at = time.perf_counter()
+    try:
+        storage, birthday_index = await asyncio.to_thread(load_all)
+    except Exception as e:
+        # Without its data the bot cannot do anything useful.
+        print(f"Erreur lors du chargement des données : {e}")
+        await bot.close()
+        raise
+    birthdays = storage.birthdays
+    config = storage.config
+    if previous_storage is not None:
+        previous_storage.discard()
+    data_ready.set()
+    print(
+        f"Données chargées depuis {storage.loaded_from} en "
+        f"{time.perf_counter() - load_started_at:.2f}s "
+        f"({sum(map(len, birthdays.values()))} anniversaires)."
+    )
+
+
+# Interactions must be answered within 3 seconds.
+DATA_WAIT_TIMEOUT = 2.0
+
+
+def requires_data(func):
+    # Decorator for the commands that read or write the data: while it is
+    # still loading, wait a little, then ask the user to retry.
+    @functools.wraps(func)
+    async def wrapper(interaction, *args, **kwargs):
+        if not data_ready.is_set():
+            try:
+                await asyncio.wait_for(data_ready.wait(), DATA_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                await interaction.response.send_message(
+                    "⏳ Le bot démarre, réessaie dans quelques secondes.",
+                    ephemeral=True,
+                )
+                return
+        return await func(interaction, *args, **kwargs)
+
+    return wrapper
+
 
 # ========================== Define the /birthday Command Group ==========================
 
@@ -62,6 +226,8 @@ birthday = discord.app_commands.Group(
 
 # -------- /birthday set DD/MM --------
 @birthday.command(name="set", description="Enregistre ton anniversaire (format: DD/MM)")
+@instrument_command("set")
+@requires_data
 async def birthday_set(interaction: discord.Interaction, date: str):
     if not interaction.guild:
         await interaction.response.send_message(
@@ -76,10 +242,12 @@ async def birthday_set(interaction: discord.Interaction, date: str):
         )
         return
     guild_id = str(interaction.guild.id)
-    if guild_id not in birthdays:
-        birthdays[guild_id] = {}
-    birthdays[guild_id][str(interaction.user.id)] = date
-    save_json(birthdays_file, birthdays)
+    user_id = str(interaction.user.id)
+    previous = birthdays.get(guild_id, {}).get(user_id)
+    storage.set_birthday(guild_id, user_id, date)
+    data_changed(
+        "set_birthday", guild_id, user_id=user_id, date=date, previous=previous
+    )
     await interaction.response.send_message(
         f"🎂 {interaction.user.mention}, ton anniversaire a été enregistré pour le {date} !",
         ephemeral=True,
@@ -88,6 +256,8 @@ async def birthday_set(interaction: discord.Interaction, date: str):
 
 # -------- /birthday show --------
 @birthday.command(name="show", description="Affiche ton anniversaire enregistré")
+@instrument_command("show")
+@requires_data
 async def birthday_show(interaction: discord.Interaction):
     if not interaction.guild:
         await interaction.response.send_message(
@@ -106,11 +276,103 @@ async def birthday_show(interaction: discord.Interaction):
         )
 
 
+# -------- Pagination View for /birthday all --------
+class BirthdayPaginationView(discord.ui.View):
+    PAGE_SIZE = 10
+
+    def __init__(self, interaction: discord.Interaction, upcoming: list):
+        super().__init__(timeout=180)
+        self.interaction = interaction
+        # (delta, next_birthday, user_id) tuples, sorted by delta.
+        self.upcoming = upcoming
+        self.page = 0
+        self.page_count = (len(upcoming) - 1) // self.PAGE_SIZE + 1
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+
+    async def build_embed(self) -> discord.Embed:
+        # Only the current page's users are resolved.
+        start = self.page * self.PAGE_SIZE
+        entries = self.upcoming[start : start + self.PAGE_SIZE]
+        users = await user_resolver.resolve_many(
+            [int(user_id) for _, _, user_id in entries], guild=self.interaction.guild
+        )
+        embed = discord.Embed(
+            title="🎉 Anniversaires à venir",
+            description="Voici la liste des anniversaires à venir :",
+            color=discord.Color.blue(),
+        )
+        for delta, next_birthday, user_id in entries:
+            user = users.get(int(user_id))
+            if user is not None:
+                username = user.name
+            else:
+                username = f"Utilisateur inconnu ({user_id})"
+            formatted_date = next_birthday.strftime("%d/%m")
+            day_text = "jour" if delta == 1 else "jours"
+            embed.add_field(
+                name=username,
+                value=f"Le **{formatted_date}** (dans **{delta}** {day_text})",
+                inline=False,
+            )
+        embed.set_footer(text=f"Page {self.page + 1}/{self.page_count}")
+        return embed
+
+    async def _show_page(self, interaction: discord.Interaction, page: int):
+        self.page = page
+        self._update_buttons()
+        embed = await self.build_embed()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(label="◀ Précédent", style=discord.ButtonStyle.secondary)
+    async def previous_page(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await self._show_page(interaction, max(self.page - 1, 0))
+
+    @discord.ui.button(label="Suivant ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await self._show_page(interaction, min(self.page + 1, self.page_count - 1))
+
+    async def on_timeout(self):
+        self.previous_page.disabled = True
+        self.next_page.disabled = True
+        try:
+            await self.interaction.edit_original_response(view=self)
+        except discord.HTTPException:
+            pass
+
+
+async def send_upcoming(interaction: discord.Interaction, upcoming: list):
+    # Resolving names may take a few REST calls: acknowledge the interaction
+    # first so the 3-second deadline is not an issue.
+    await interaction.response.defer(ephemeral=True)
+    view = BirthdayPaginationView(interaction, upcoming)
+    embed = await view.build_embed()
+    if view.page_count > 1:
+        await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+    else:
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+def guild_today(guild_id: str) -> datetime.date:
+    # Today in the guild's announcement timezone.
+    tz = get_timezone(config.get(guild_id, {}).get("timezone", DEFAULT_TIMEZONE))
+    return datetime.datetime.now(tz).date()
+
+
 # -------- /birthday all --------
 @birthday.command(
     name="all",
     description="Affiche tous les anniversaires enregistrés sur le serveur",
 )
+@instrument_command("all")
+@requires_data
 async def birthday_all(interaction: discord.Interaction):
     if not interaction.guild:
         await interaction.response.send_message(
@@ -118,48 +380,49 @@ async def birthday_all(interaction: discord.Interaction):
         )
         return
     guild_id = str(interaction.guild.id)
-    today = datetime.datetime.utcnow().date()
     upcoming = []
     if guild_id in birthdays:
-        for user_id, bday_str in birthdays[guild_id].items():
-            try:
-                day, month = map(int, bday_str.split("/"))
-                birthday_this_year = datetime.date(today.year, month, day)
-                if birthday_this_year < today:
-                    next_birthday = datetime.date(today.year + 1, month, day)
-                else:
-                    next_birthday = birthday_this_year
-                delta = (next_birthday - today).days
-                upcoming.append((delta, next_birthday, user_id))
-            except Exception as e:
-                print(
-                    f"Erreur pour l'utilisateur {user_id} avec la date {bday_str}: {e}"
-                )
+        # The whole year from today, already in date order.
+        upcoming = upcoming_birthdays(birthdays[guild_id], guild_today(guild_id))
     if not upcoming:
         await interaction.response.send_message(
             "Aucun anniversaire n'est enregistré sur ce serveur.", ephemeral=True
         )
         return
-    upcoming.sort(key=lambda x: x[0])
-    embed = discord.Embed(
-        title="🎉 Anniversaires à venir",
-        description="Voici la liste des anniversaires à venir :",
-        color=discord.Color.blue(),
-    )
-    for delta, next_birthday, user_id in upcoming:
-        try:
-            user = await bot.fetch_user(int(user_id))
-            username = user.name
-        except Exception:
-            username = f"Utilisateur inconnu ({user_id})"
-        formatted_date = next_birthday.strftime("%d/%m")
-        day_text = "jour" if delta == 1 else "jours"
-        embed.add_field(
-            name=username,
-            value=f"Le **{formatted_date}** (dans **{delta}** {day_text})",
-            inline=False,
+    await send_upcoming(interaction, upcoming)
+
+
+# -------- /birthday upcoming [days] [limit] --------
+@birthday.command(
+    name="upcoming",
+    description="Affiche les prochains anniversaires du serveur",
+)
+@instrument_command("upcoming")
+@requires_data
+async def birthday_upcoming(
+    interaction: discord.Interaction,
+    days: discord.app_commands.Range[int, 1, MAX_UPCOMING_DAYS] = 30,
+    limit: discord.app_commands.Range[int, 1, 100] = 10,
+):
+    if not interaction.guild:
+        await interaction.response.send_message(
+            "Cette commande ne peut être utilisée que sur un serveur.", ephemeral=True
         )
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    guild_id = str(interaction.guild.id)
+    upcoming = []
+    if guild_id in birthdays:
+        upcoming = upcoming_birthdays(
+            birthdays[guild_id], guild_today(guild_id), days, limit
+        )
+    if not upcoming:
+        day_text = "jour" if days == 1 else "jours"
+        await interaction.response.send_message(
+            f"Aucun anniversaire dans les {days} prochains {day_text}.",
+            ephemeral=True,
+        )
+        return
+    await send_upcoming(interaction, upcoming)
 
 
 # -------- /birthday set_channel (Admin only) --------
@@ -168,6 +431,8 @@ async def birthday_all(interaction: discord.Interaction):
     description="Configure ce salon pour les annonces d'anniversaire (Admin uniquement)",
 )
 @discord.app_commands.checks.has_permissions(administrator=True)
+@instrument_command("set_channel")
+@requires_data
 async def birthday_set_channel(interaction: discord.Interaction):
     if not interaction.guild:
         await interaction.response.send_message(
@@ -175,10 +440,10 @@ async def birthday_set_channel(interaction: discord.Interaction):
         )
         return
     guild_id = str(interaction.guild.id)
-    if guild_id not in config:
-        config[guild_id] = {}
-    config[guild_id]["birthday_channel"] = interaction.channel.id
-    save_json(config_file, config)
+    storage.set_config_value(guild_id, "birthday_channel", interaction.channel.id)
+    data_changed(
+        "set_config", guild_id, key="birthday_channel", value=interaction.channel.id
+    )
     await interaction.response.send_message(
         f"🎉 Ce salon ({interaction.channel.mention}) est configuré pour les annonces d'anniversaire.",
         ephemeral=True,
@@ -191,6 +456,8 @@ async def birthday_set_channel(interaction: discord.Interaction):
     description="Supprime la configuration du salon d'annonces (Admin uniquement)",
 )
 @discord.app_commands.checks.has_permissions(administrator=True)
+@instrument_command("remove_channel")
+@requires_data
 async def birthday_remove_channel(interaction: discord.Interaction):
     if not interaction.guild:
         await interaction.response.send_message(
@@ -199,8 +466,8 @@ async def birthday_remove_channel(interaction: discord.Interaction):
         return
     guild_id = str(interaction.guild.id)
     if guild_id in config and "birthday_channel" in config[guild_id]:
-        del config[guild_id]["birthday_channel"]
-        save_json(config_file, config)
+        storage.remove_config_value(guild_id, "birthday_channel")
+        data_changed("remove_config", guild_id, key="birthday_channel")
         await interaction.response.send_message(
             "✅ La configuration du salon d'annonces a été supprimée.", ephemeral=True
         )
@@ -211,6 +478,171 @@ async def birthday_remove_channel(interaction: discord.Interaction):
         )
 
 
+# -------- /birthday set_timezone (Admin only) --------
+@birthday.command(
+    name="set_timezone",
+    description="Définit le fuseau horaire des annonces (ex : Europe/Paris) (Admin uniquement)",
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@instrument_command("set_timezone")
+@requires_data
+async def birthday_set_timezone(interaction: discord.Interaction, timezone: str):
+    if not interaction.guild:
+        await interaction.response.send_message(
+            "Cette commande ne peut être utilisée que sur un serveur.", ephemeral=True
+        )
+        return
+    try:
+        zoneinfo.ZoneInfo(timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        await interaction.response.send_message(
+            "❌ Fuseau horaire invalide ! Utilise un nom comme Europe/Paris ou UTC.",
+            ephemeral=True,
+        )
+        return
+    guild_id = str(interaction.guild.id)
+    storage.set_config_value(guild_id, "timezone", timezone)
+    data_changed("set_config", guild_id, key="timezone", value=timezone)
+    await interaction.response.send_message(
+        f"🕛 Les anniversaires seront annoncés à minuit ({timezone}).", ephemeral=True
+    )
+
+
+# Most birthdays in one grouped announcement: the mentions must fit in the
+# embed and the names in the thread title.
+MAX_GROUP_SIZE = 25
+
+
+# -------- /birthday set_grouping <size> (Admin only) --------
+@birthday.command(
+    name="set_grouping",
+    description="Regroupe les anniversaires du même jour dans une seule annonce (Admin uniquement)",
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@instrument_command("set_grouping")
+@requires_data
+async def birthday_set_grouping(
+    interaction: discord.Interaction,
+    size: discord.app_commands.Range[int, 1, MAX_GROUP_SIZE],
+):
+    if not interaction.guild:
+        await interaction.response.send_message(
+            "Cette commande ne peut être utilisée que sur un serveur.", ephemeral=True
+        )
+        return
+    guild_id = str(interaction.guild.id)
+    if size == 1:
+        # The default: one announcement and one thread per birthday.
+        if "group_size" in config.get(guild_id, {}):
+            storage.remove_config_value(guild_id, "group_size")
+            data_changed("remove_config", guild_id, key="group_size")
+        await interaction.response.send_message(
+            "📢 Chaque anniversaire aura sa propre annonce.", ephemeral=True
+        )
+        return
+    storage.set_config_value(guild_id, "group_size", size)
+    data_changed("set_config", guild_id, key="group_size", value=size)
+    await interaction.response.send_message(
+        f"📢 Les anniversaires du même jour seront annoncés ensemble, jusqu'à {size} "
+        "par annonce, avec un seul fil de discussion par annonce.",
+        ephemeral=True,
+    )
+
+
+# -------- /birthday import <file> (Admin only) --------
+@birthday.command(
+    name="import",
+    description="Importe des anniversaires depuis un fichier CSV ou JSON (Admin uniquement)",
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@instrument_command("import")
+@requires_data
+async def birthday_import(interaction: discord.Interaction, file: discord.Attachment):
+    if not interaction.guild:
+        await interaction.response.send_message(
+            "Cette commande ne peut être utilisée que sur un serveur.", ephemeral=True
+        )
+        return
+    file_format = import_format(file.filename)
+    if file_format is None:
+        await interaction.response.send_message(
+            "❌ Le fichier doit être un .csv (user_id,date) ou un .json.",
+            ephemeral=True,
+        )
+        return
+    if file.size > MAX_IMPORT_BYTES:
+        await interaction.response.send_message(
+            f"❌ Le fichier dépasse {MAX_IMPORT_BYTES // (1024 * 1024)} Mo.",
+            ephemeral=True,
+        )
+        return
+    # Downloading and parsing a large file takes longer than 3 seconds.
+    await interaction.response.defer(ephemeral=True)
+    try:
+        result = await parse_import(download(file.url), file_format)
+    except (BulkImportError, aiohttp.ClientError) as e:
+        await interaction.followup.send(f"❌ Import impossible : {e}", ephemeral=True)
+        return
+    guild_id = str(interaction.guild.id)
+    if result.entries:
+        # All the rows in one write, instead of one rewrite per birthday.
+        storage.set_birthdays(guild_id, result.entries.items())
+        data_changed("set_birthdays", guild_id, entries=list(result.entries.items()))
+    lines = [
+        f"✅ {len(result.entries)} anniversaire(s) importé(s) sur {result.rows} "
+        f"ligne(s), {result.rejected_count} ligne(s) rejetée(s)."
+    ]
+    for row, reason in result.rejected:
+        lines.append(f"• Ligne {row} : {reason}")
+    if result.rejected_count > len(result.rejected):
+        lines.append(f"… et {result.rejected_count - len(result.rejected)} autre(s).")
+    await interaction.followup.send("\n".join(lines), ephemeral=True)
+
+
+# -------- /birthday export [format] (Admin only) --------
+@birthday.command(
+    name="export",
+    description="Exporte les anniversaires du serveur en CSV ou JSON (Admin uniquement)",
+)
+@discord.app_commands.rename(file_format="format")
+@discord.app_commands.checks.has_permissions(administrator=True)
+@instrument_command("export")
+@requires_data
+async def birthday_export(
+    interaction: discord.Interaction, file_format: Literal["csv", "json"] = "csv"
+):
+    if not interaction.guild:
+        await interaction.response.send_message(
+            "Cette commande ne peut être utilisée que sur un serveur.", ephemeral=True
+        )
+        return
+    guild_id = str(interaction.guild.id)
+    guild_birthdays = birthdays.get(guild_id)
+    if not guild_birthdays:
+        await interaction.response.send_message(
+            "Aucun anniversaire n'est enregistré sur ce serveur.", ephemeral=True
+        )
+        return
+    await interaction.response.defer(ephemeral=True)
+    # The copy only duplicates the packed arrays; the file is written row by
+    # row in a worker thread.
+    path = await asyncio.to_thread(write_export, guild_birthdays.copy(), file_format)
+    try:
+        if os.path.getsize(path) > interaction.guild.filesize_limit:
+            await interaction.followup.send(
+                "❌ L'export dépasse la taille maximale des fichiers de ce serveur.",
+                ephemeral=True,
+            )
+            return
+        await interaction.followup.send(
+            f"📦 {len(guild_birthdays)} anniversaire(s) exporté(s).",
+            file=discord.File(path, filename=f"anniversaires.{file_format}"),
+            ephemeral=True,
+        )
+    finally:
+        os.unlink(path)
+
+
 # -------- Confirmation View for /birthday announce --------
 class ConfirmAnnouncementView(discord.ui.View):
     def __init__(
@@ -261,9 +693,7 @@ class ConfirmAnnouncementView(discord.ui.View):
             )
             return
 
-        gif_url = random.choice(GIFS)
-        user_display = self.target.mention
-        message_text = random.choice(BIRTHDAY_MESSAGES).format(user=user_display)
+        message_text, gif_url = resources.pick(guild_id, self.target.mention)
         embed = discord.Embed(description=message_text, color=discord.Color.green())
         embed.set_image(url=gif_url)
 
@@ -309,6 +739,8 @@ class ConfirmAnnouncementView(discord.ui.View):
     ),
 )
 @discord.app_commands.checks.has_permissions(administrator=True)
+@instrument_command("announce")
+@requires_data
 async def birthday_announce(interaction: discord.Interaction, user: discord.Member):
     if not interaction.guild:
         await interaction.response.send_message(
@@ -331,12 +763,12 @@ async def birthday_announce(interaction: discord.Interaction, user: discord.Memb
             # The admin provided the bot itself.
             # Announce the bot's birthday and record today's date if not already set.
             target = bot.user
-            if guild_id not in birthdays:
-                birthdays[guild_id] = {}
-            if str(bot.user.id) not in birthdays[guild_id]:
+            if str(bot.user.id) not in birthdays.get(guild_id, {}):
                 today = datetime.datetime.utcnow().strftime("%d/%m")
-                birthdays[guild_id][str(bot.user.id)] = today
-                save_json(birthdays_file, birthdays)
+                storage.set_birthday(guild_id, str(bot.user.id), today)
+                data_changed(
+                    "set_birthday", guild_id, user_id=str(bot.user.id), date=today
+                )
         else:
             # Announce for the specified user.
             target = user
@@ -354,6 +786,7 @@ async def birthday_announce(interaction: discord.Interaction, user: discord.Memb
 @birthday.command(
     name="help", description="Affiche l'aide pour les commandes d'anniversaire"
 )
+@instrument_command("help")
 async def birthday_help(interaction: discord.Interaction):
     is_admin = interaction.user.guild_permissions.administrator
 
@@ -379,6 +812,11 @@ async def birthday_help(interaction: discord.Interaction):
         value="Affiche tous les anniversaires enregistrés sur le serveur.",
         inline=False,
     )
+    embed.add_field(
+        name="/birthday upcoming [days] [limit]",
+        value="Affiche les prochains anniversaires, sur 30 jours par défaut.",
+        inline=False,
+    )
 
     # Admin-only commands
     if is_admin:
@@ -387,11 +825,41 @@ async def birthday_help(interaction: discord.Interaction):
             value="Configure ce salon pour les annonces d'anniversaire. (Admin uniquement)",
             inline=False,
         )
+        embed.add_field(
+            name="/birthday set_timezone <timezone>",
+            value=(
+                "Définit le fuseau horaire des annonces, ex : Europe/Paris. "
+                "(Admin uniquement)"
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="/birthday set_grouping <size>",
+            value=(
+                "Annonce ensemble jusqu'à <size> anniversaires du même jour, "
+                "avec un seul fil de discussion. 1 pour une annonce par "
+                "anniversaire. (Admin uniquement)"
+            ),
+            inline=False,
+        )
         embed.add_field(
             name="/birthday remove_channel",
             value="Supprime la configuration du salon d'annonces. (Admin uniquement)",
             inline=False,
         )
+        embed.add_field(
+            name="/birthday import <file>",
+            value=(
+                "Importe des anniversaires depuis un fichier CSV (user_id,date) "
+                "ou JSON. (Admin uniquement)"
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="/birthday export [format]",
+            value="Exporte les anniversaires du serveur en CSV ou JSON. (Admin uniquement)",
+            inline=False,
+        )
         embed.add_field(
             name="/birthday announce [member]",
             value=(
@@ -409,63 +877,659 @@ async def birthday_help(interaction: discord.Interaction):
 
 
 # ========================== Birthday Check Task ==========================
-@tasks.loop(time=datetime.time(hour=0, minute=0))
-async def check_birthdays():
-    # Get today's date in "DD/MM" format
-    today = datetime.datetime.utcnow().strftime("%d/%m")
-    for guild_id, guild_config in config.items():
-        channel_id = guild_config.get("birthday_channel")
-        if not channel_id:
-            print(f"Aucun salon d'anniversaire configuré pour le serveur {guild_id}.")
-            continue
-        channel = bot.get_channel(channel_id)
-        if not channel:
-            print(
-                f"L'ID du salon dans la configuration est invalide pour le serveur {guild_id}."
+
+# Announcements older than this are not replayed after a restart.
+CATCHUP_DAYS = 2
+
+announcement_run_duration = Histogram(
+    "announcement_run_duration_seconds",
+    "Duration of a scheduled or catch-up announcement run.",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+announcements_done = Counter(
+    "announcements_total", "Birthday announcements fully sent."
+)
+
+
+# Discord's limit on thread names.
+MAX_THREAD_NAME = 100
+
+
+def join_names(names: list) -> str:
+    # "a", "a et b", "a, b et c"
+    if len(names) == 1:
+        return names[0]
+    return f"{', '.join(names[:-1])} et {names[-1]}"
+
+
+def announcement_groups(entries: list, group_size: int) -> list:
+    # Splits a guild's unfinished entries into announcements. Entries already
+    # posted or threaded stay with the message or thread they were sent with;
+    # pending ones are grouped by day, at most group_size per announcement.
+    resumed = {}
+    pending = {}
+    for entry in entries:
+        if entry.status == PENDING:
+            pending.setdefault(entry.date, []).append(entry)
+        elif entry.status == POSTED:
+            resumed.setdefault((POSTED, entry.message_id), []).append(entry)
+        else:
+            resumed.setdefault((THREADED, entry.thread_id), []).append(entry)
+    groups = list(resumed.values())
+    for date in sorted(pending):
+        day = pending[date]
+        groups.extend(day[i : i + group_size] for i in range(0, len(day), group_size))
+    return groups
+
+
+async def announce_birthday(channel, users: list, entries: list):
+    # Runs the remaining steps of one announcement, for one user or for
+    # same-day users announced together (one message, one thread, one ping),
+    # recording each step in the ledger so an interrupted announcement resumes
+    # without duplicates.
+    msg = None
+    thread = None
+    first = entries[0]
+    if first.status == PENDING:
+        mentions = join_names([user.mention for user in users])
+        message_text, gif_url = resources.pick(first.guild_id, mentions)
+        embed = discord.Embed(description=message_text, color=discord.Color.green())
+        embed.set_image(url=gif_url)
+        msg = await dispatcher.call(
+            "messages", channel.id, channel.send, embed=embed
+        )
+        ledger.mark_posted(entries, msg.id)
+    if first.status == POSTED:
+        if msg is None:
+            msg = await channel.fetch_message(first.message_id)
+        thread_name = f"Souhaits pour {join_names([user.name for user in users])}"
+        if len(thread_name) > MAX_THREAD_NAME:
+            thread_name = f"Souhaits pour {len(users)} anniversaires"
+        thread = await dispatcher.call(
+            "threads",
+            channel.id,
+            msg.create_thread,
+            name=thread_name,
+            auto_archive_duration=1440,
+        )
+        ledger.mark_threaded(entries, thread.id)
+    if first.status == THREADED:
+        if thread is None:
+            thread = bot.get_channel(first.thread_id) or await bot.fetch_channel(
+                first.thread_id
             )
+        await dispatcher.call(
+            "messages",
+            thread.id,
+            thread.send,
+            "@everyone Bienvenue dans ce fil de discussion pour souhaiter un joyeux anniversaire !",
+        )
+        ledger.mark_done(entries)
+        announcements_done.inc(amount=len(entries))
+
+
+async def announce_guild(guild_id: str, entries: list):
+    # Announces the given ledger entries in the guild's channel, one after another.
+    guild_config = config.get(guild_id, {})
+    channel_id = guild_config.get("birthday_channel")
+    if not channel_id:
+        print(f"Aucun salon d'anniversaire configuré pour le serveur {guild_id}.")
+        return
+    channel = bot.get_channel(channel_id)
+    if channel is None:
+        # Not cached; always the case in the worker, which has no gateway.
+        try:
+            channel = await bot.fetch_channel(channel_id)
+        except discord.HTTPException:
+            channel = None
+    if not channel:
+        print(
+            f"L'ID du salon dans la configuration est invalide pour le serveur {guild_id}."
+        )
+        return
+    users = await user_resolver.resolve_many(
+        [int(entry.user_id) for entry in entries], guild=channel.guild
+    )
+    # A user that cannot be resolved is left for a later run, unless already
+    # part of a message that was sent.
+    entries = [
+        entry
+        for entry in entries
+        if entry.status != PENDING or users.get(int(entry.user_id)) is not None
+    ]
+    group_size = guild_config.get("group_size", 1)
+    for group in announcement_groups(entries, group_size):
+        group_users = [users.get(int(entry.user_id)) for entry in group]
+        group_users = [user for user in group_users if user is not None]
+        if not group_users:
             continue
-        if guild_id not in birthdays:
+        try:
+            await announce_birthday(channel, group_users, group)
+        except Exception as e:
+            names = join_names([user.name for user in group_users])
+            print(f"Impossible de créer un fil pour {names} : {e}")
+
+
+async def run_announcements(guild_ids, since: datetime.date):
+    # Sends every unfinished ledger entry of the given guilds from `since` on.
+    guild_jobs = {}
+    for guild_id in guild_ids:
+        entries = ledger.unfinished(guild_id, since)
+        if entries:
+            guild_jobs[guild_id] = announce_guild(guild_id, entries)
+    if not guild_jobs:
+        return
+    stats = await dispatcher.run(guild_jobs)
+    announcement_run_duration.observe(stats.duration)
+    print(
+        f"Annonces : {len(guild_jobs)} serveurs, "
+        f"{stats.api_calls} appels API, "
+        f"{stats.retries} nouvelles tentatives, "
+        f"{stats.duration:.1f}s."
+    )
+
+
+def enqueue_birthdays(due_days: list):
+    # Writes the birthdays of the given (guild_id, local_date) days to the
+    # ledger before sending, in one transaction.
+    ledger.enqueue_many(
+        (
+            guild_id,
+            local_date,
+            birthday_index.users_on(guild_id, local_date.month, local_date.day),
+        )
+        for guild_id, local_date in due_days
+    )
+
+
+async def check_birthdays(due_guilds: list):
+    # Called by the scheduler with the (guild_id, local_date) pairs whose local
+    # midnight just passed. Each guild with a birthday that day gets a worker.
+    enqueue_birthdays(due_guilds)
+    # Entries left unfinished by a recent run are retried along the way.
+    since = min(local_date for _, local_date in due_guilds) - datetime.timedelta(
+        days=CATCHUP_DAYS
+    )
+    await run_announcements([guild_id for guild_id, _ in due_guilds], since)
+
+
+def enqueue_missed_days():
+    # Records the days missed while the bot was offline, up to the local
+    # today, so that scheduling afterwards starts from the next day.
+    last_run_dates = ledger.last_run_dates()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    missed_days = []
+    for guild_id, guild_config in config.items():
+        last_date = last_run_dates.get(guild_id)
+        if not guild_config.get("birthday_channel") or last_date is None:
             continue
-        for user_id, bday in birthdays[guild_id].items():
-            if bday == today:
-                try:
-                    user = await bot.fetch_user(int(user_id))
-                except Exception as e:
-                    print(f"Erreur lors de la récupération du membre {user_id} : {e}")
-                    continue
-                gif_url = random.choice(GIFS)
-                message_text = random.choice(BIRTHDAY_MESSAGES).format(
-                    user=user.mention
-                )
-                embed = discord.Embed(
-                    description=message_text, color=discord.Color.green()
-                )
-                embed.set_image(url=gif_url)
-                try:
-                    msg = await channel.send(embed=embed)
-                    thread = await msg.create_thread(
-                        name=f"Souhaits pour {user.name}", auto_archive_duration=1440
-                    )
-                    await thread.send(
-                        "@everyone Bienvenue dans ce fil de discussion pour souhaiter un joyeux anniversaire !"
-                    )
-                except Exception as e:
-                    print(f"Impossible de créer un fil pour {user.name} : {e}")
+        tz = get_timezone(guild_config.get("timezone", DEFAULT_TIMEZONE))
+        today = now.astimezone(tz).date()
+        local_date = max(
+            last_date + datetime.timedelta(days=1),
+            today - datetime.timedelta(days=CATCHUP_DAYS),
+        )
+        while local_date <= today:
+            missed_days.append((guild_id, local_date))
+            local_date += datetime.timedelta(days=1)
+    enqueue_birthdays(missed_days)
 
 
-@bot.event
-async def on_ready():
-    print(f"Connected as {bot.user}")
+async def catch_up_announcements():
+    # Sends the missed days recorded by enqueue_missed_days and the
+    # announcements a previous run left unfinished. Both count the days in
+    # each guild's timezone, so the window starts from the earliest local
+    # today: a guild behind UTC is still on the day before.
+    today = min(
+        (guild_today(guild_id) for guild_id in config if shards.owns(guild_id)),
+        default=datetime.datetime.now(datetime.timezone.utc).date(),
+    )
+    since = today - datetime.timedelta(days=CATCHUP_DAYS)
+    unfinished = ledger.unfinished_guilds(since)
+    await run_announcements(
+        [guild_id for guild_id in unfinished if shards.owns(guild_id)], since
+    )
+
+
+# Wakes up at each guild's local midnight.
+scheduler = GuildScheduler(check_birthdays)
+
+
+def schedule_guild(guild_id: str, last_run_dates: dict = None):
+    # The next day to announce follows the last one the ledger recorded, so a
+    # new timezone whose midnight already passed does not skip today.
+    guild_config = config.get(guild_id, {})
+    if last_run_dates is None:
+        last_date = ledger.last_run_date(guild_id)
+    else:
+        last_date = last_run_dates.get(guild_id)
+    scheduler.schedule(
+        guild_id, guild_config.get("timezone", DEFAULT_TIMEZONE), last_date
+    )
+
+
+def schedule_configured_guilds():
+    # Every guild with an announcement channel is scheduled, in its timezone.
+    for guild_id in scheduler.guild_ids():
+        if not config.get(guild_id, {}).get("birthday_channel"):
+            scheduler.unschedule(guild_id)
+    last_run_dates = ledger.last_run_dates()
+    for guild_id, guild_config in config.items():
+        if guild_config.get("birthday_channel"):
+            schedule_guild(guild_id, last_run_dates)
+
+
+# ========================== Data changes ==========================
+
+# Gateway side of a split deployment: forwards the changes to the worker.
+if IPC_SOCKET is None:
+    if shards.is_partial:
+        IPC_SOCKET = os.path.join(data_dir, f"worker_shards_{shards.label()}.sock")
+    else:
+        IPC_SOCKET = os.path.join(data_dir, "worker.sock")
+publisher = EventPublisher(IPC_SOCKET)
+# Seconds the worker waits for the gateway's pending writes before a reload.
+RELOAD_DELAY = 2.0
+
+
+def apply_change(event: dict, update_mirror: bool = False):
+    # Brings the day index and the schedule up to date after a write. The
+    # worker also applies the change to its own mirror of the data.
+    op = event["op"]
+    guild_id = event["guild_id"]
+    if op == "set_birthday":
+        previous = event.get("previous")
+        if update_mirror:
+            # The index was built from the mirror: it replaces the mirror's date.
+            guild_birthdays = birthdays.setdefault(guild_id, {})
+            previous = guild_birthdays.get(event["user_id"])
+            guild_birthdays[event["user_id"]] = event["date"]
+        birthday_index.add(guild_id, event["user_id"], event["date"], previous)
+    elif op == "set_birthdays":
+        if update_mirror:
+            birthdays.setdefault(guild_id, {}).merge(
+                (int(user_id), encode_date(date)) for user_id, date in event["entries"]
+            )
+        birthday_index.set_guild(guild_id, birthdays.get(guild_id))
+    elif op == "remove_guild":
+        if update_mirror:
+            birthdays.pop(guild_id, None)
+            config.pop(guild_id, None)
+        birthday_index.remove_guild(guild_id)
+        scheduler.unschedule(guild_id)
+    elif op == "remove_birthdays":
+        if update_mirror and guild_id in birthdays:
+            birthdays[guild_id].remove_many(map(int, event["user_ids"]))
+        birthday_index.set_guild(guild_id, birthdays.get(guild_id))
+    elif op in ("set_config", "remove_config"):
+        if update_mirror:
+            if op == "set_config":
+                config.setdefault(guild_id, {})[event["key"]] = event["value"]
+            else:
+                config.get(guild_id, {}).pop(event["key"], None)
+        # Scheduled while a channel is configured; rescheduling also picks up
+        # a new timezone.
+        if config.get(guild_id, {}).get("birthday_channel"):
+            schedule_guild(guild_id)
+        else:
+            scheduler.unschedule(guild_id)
+    else:
+        raise ValueError(f"Unknown event: {op}")
+
+
+def data_changed(op: str, guild_id: str, **fields):
+    # Called by the commands after each write through storage.
+    event = {"op": op, "guild_id": guild_id, **fields}
+    if RUN_MODE == "gateway":
+        publisher.publish(event)
+    else:
+        apply_change(event)
+
+
+async def handle_worker_event(event: dict):
+    if event["op"] == "reload":
+        # The gateway dropped events while we were away: read everything
+        # again once its write-behind has flushed.
+        await asyncio.sleep(RELOAD_DELAY)
+        await load_data()
+        schedule_configured_guilds()
+        return
+    apply_change(event, update_mirror=True)
+
+
+# ========================== Pruning ==========================
+
+
+def compact_data():
+    # One compaction pass: removes, in a single write, the data of the
+    # departures whose grace period is over (at most BATCH_SIZE of them).
+    guild_ids, members = removals.due(
+        time.time(), PRUNE_GRACE_DAYS * 86400, BATCH_SIZE
+    )
+    if not guild_ids and not members:
+        return
+    started_at = time.perf_counter()
+    guild_count = sum(
+        1 for guild_id in guild_ids if guild_id in birthdays or guild_id in config
+    )
+    birthdays_removed, config_removed = storage.prune(guild_ids, members)
+    removals.done(guild_ids, members)
+    for guild_id in guild_ids:
+        data_changed("remove_guild", guild_id)
+    for guild_id, user_ids in members.items():
+        data_changed("remove_birthdays", guild_id, user_ids=user_ids)
+    pruned_guilds.inc(amount=guild_count)
+    pruned_birthdays.inc(amount=birthdays_removed)
+    print(
+        f"Compaction : {guild_count} serveur(s), {birthdays_removed} "
+        f"anniversaire(s) et {config_removed} réglage(s) supprimés, "
+        f"{birthdays_removed * BYTES_PER_BIRTHDAY / 1024:.1f} Ko libérés en "
+        f"mémoire, en {time.perf_counter() - started_at:.2f}s."
+    )
+
+
+async def run_compaction():
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL)
+        try:
+            compact_data()
+        except Exception as e:
+            print(f"Erreur lors de la compaction des données : {e}")
+
+
+def reconcile_guilds():
+    # Catches the guilds the bot left or joined again while it was offline.
+    present = {str(guild.id) for guild in bot.guilds}
+    for guild_id in set(birthdays) | set(config):
+        if guild_id in present:
+            removals.guild_joined(guild_id)
+        else:
+            removals.guild_left(guild_id)
+
+
+# ========================== Command Sync ==========================
+
+# { guild_id: hash of the command group last synced to that guild }
+if shards.is_partial:
+    command_sync_file = os.path.join(
+        data_dir, f"command_sync_shards_{shards.label()}.json"
+    )
+else:
+    command_sync_file = os.path.join(data_dir, "command_sync.json")
+command_hashes = load_json(command_sync_file)
+# Guild syncs are rate limited by Discord: keep only a few in flight.
+SYNC_CONCURRENCY = 5
+
+
+def command_tree_hash() -> str:
+    payload = json.dumps(birthday.to_dict(bot.tree), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def sync_guild_commands(guild_ids: list, force: bool = False):
+    # Syncs the /birthday group to the guilds whose last synced hash differs.
+    tree_hash = command_tree_hash()
+    stale = [
+        guild_id
+        for guild_id in guild_ids
+        if force or command_hashes.get(str(guild_id)) != tree_hash
+    ]
+    if not stale:
+        return
+    semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async def sync_one(guild_id):
+        async with semaphore:
+            try:
+                await bot.tree.sync(guild=discord.Object(id=guild_id))
+            except Exception as e:
+                print(f"Error during command sync for guild {guild_id}: {e}")
+                return
+            command_hashes[str(guild_id)] = tree_hash
+
+    await asyncio.gather(*(sync_one(guild_id) for guild_id in stale))
+    save_json_atomic(command_sync_file, command_hashes)
+    print(f"Commands synced to {len(stale)} guild(s).")
+
+
+async def prepare_commands(guild_ids: list):
+    # A failed sync is logged and the startup goes on: the scheduling and the
+    # announcements do not depend on it.
     try:
         # Clear all existing commands
         bot.tree.clear_commands(guild=None)
-        # Add the birthday command group to all guilds
-        for guild in bot.guilds:
-            bot.tree.add_command(birthday, guild=discord.Object(id=guild.id))
-            await bot.tree.sync(guild=discord.Object(id=guild.id))
+        # Add the birthday command group to all guilds; only the guilds whose
+        # command hash changed are synced with Discord. A new instance already
+        # added it to the guilds it fetched before connecting.
+        for guild_id in guild_ids:
+            bot.tree.add_command(
+                birthday, guild=discord.Object(id=guild_id), override=True
+            )
+        await sync_guild_commands(guild_ids)
     except Exception as e:
         print(f"Error during guild-specific command sync: {e}")
-    check_birthdays.start()
 
 
-bot.run(TOKEN)
+async def start_metrics():
+    # Same for the metrics endpoint, e.g. when its port is already taken.
+    if not METRICS_PORT:
+        return
+    try:
+        await serve_metrics(METRICS_HOST, METRICS_PORT, METRICS_TRACE_SLOW)
+    except Exception as e:
+        print(f"Impossible de démarrer le serveur de métriques : {e}")
+
+
+# ========================== Handover ==========================
+
+# Held by the instance that runs the scheduler (RUN_MODE=all); an instance
+# started while it is held takes over from the running one (see handover.py).
+if shards.is_partial:
+    lease = SchedulerLease(
+        os.path.join(data_dir, f"scheduler_shards_{shards.label()}.lock")
+    )
+else:
+    lease = SchedulerLease(os.path.join(data_dir, "scheduler.lock"))
+
+
+async def take_over():
+    # New instance: get ready while the old one still serves, then take the
+    # lease and connect once the old one is gone.
+    previous = lease.holder()
+    print(f"Instance {previous} en cours : préparation de la reprise.")
+    await data_loading
+    guild_ids = [
+        guild.id
+        async for guild in bot.fetch_guilds(limit=None)
+        if shards.owns(guild.id)
+    ]
+    await prepare_commands(guild_ids)
+    lease.request_handover()
+    await lease.acquire()
+    lease.clear_request()
+    print("Bail du planificateur obtenu, en attente de l'arrêt de l'ancienne instance.")
+    if previous is not None and not await wait_for_exit(previous):
+        print(f"L'instance {previous} ne s'est pas arrêtée, connexion quand même.")
+    # Picks up the changes made by the old instance since our first load,
+    # from the snapshot it wrote on exit, and the departures it recorded (we
+    # are not connected yet, so none can arrive in between).
+    await load_data()
+    removals.load()
+
+
+async def hand_over():
+    # Old instance: stop scheduling, pass the lease and disconnect once the
+    # new instance holds it.
+    print("Une nouvelle instance est prête : passage de relais.")
+    scheduler.stop()
+    await scheduler.wait_idle()
+    lease.release()
+    if await lease.wait_taken(HANDOVER_TIMEOUT) or not lease.try_acquire():
+        await bot.close()
+        return True
+    # The new instance went away before taking the lease.
+    print("La nouvelle instance n'a pas repris le bail, reprise du planificateur.")
+    lease.clear_request()
+    scheduler.start()
+    return False
+
+
+async def watch_handover():
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        if lease.handover_requested() and await hand_over():
+            return
+
+
+# on_ready fires again after every gateway reconnect; the startup work below
+# must only run once.
+startup_done = False
+
+
+# Keep a reference to these tasks so they are not garbage collected.
+data_loading = None
+handover_watch = None
+compaction = None
+
+
+@bot.event
+async def setup_hook():
+    # Runs before the gateway connection; the data loads alongside it.
+    global data_loading
+    loop_monitor.start(LOOP_STALL_THRESHOLD)
+    data_loading = asyncio.create_task(load_data())
+
+
+@bot.event
+async def on_ready():
+    global startup_done, handover_watch, compaction
+    print(f"Connected as {bot.user}")
+    if startup_done:
+        return
+    startup_done = True
+    await start_metrics()
+    await prepare_commands([guild.id for guild in bot.guilds])
+    await data_ready.wait()
+    resources.start()
+    # The process that writes the data also prunes it.
+    reconcile_guilds()
+    if PRUNE_INTERVAL:
+        compaction = asyncio.create_task(run_compaction())
+    if RUN_MODE == "gateway":
+        # The worker owns the schedule and the announcements.
+        publisher.start()
+        return
+    enqueue_missed_days()
+    schedule_configured_guilds()
+    scheduler.start()
+    await catch_up_announcements()
+    if lease.held:
+        handover_watch = asyncio.create_task(watch_handover())
+
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    # The RSS covers every shard of the process: each shard reports the
+    # memory its own guilds' birthdays take in the mirror and the index.
+    ready_after = time.monotonic() - started_at
+    await data_ready.wait()
+    guild_ids = [str(guild.id) for guild in bot.guilds if guild.shard_id == shard_id]
+    registrations = sum(len(birthdays.get(guild_id, ())) for guild_id in guild_ids)
+    data_mb = registrations * (BYTES_PER_BIRTHDAY + BYTES_PER_ENTRY) / (1024 * 1024)
+    print(
+        f"Shard {shard_id} ready in {ready_after:.1f}s: "
+        f"{len(guild_ids)} guild(s), {registrations} birthday(s) using "
+        f"{data_mb:.1f} MB (process peak RSS {peak_rss_mb():.1f} MB)."
+    )
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    removals.guild_joined(str(guild.id))
+    bot.tree.add_command(birthday, guild=discord.Object(id=guild.id), override=True)
+    await sync_guild_commands([guild.id], force=True)
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    # Kicked, banned or the guild was deleted: its data goes after the grace
+    # period, unless the bot is added back in between.
+    removals.guild_left(str(guild.id))
+
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    guild_id = str(member.guild.id)
+    if str(member.id) in birthdays.get(guild_id, {}):
+        removals.member_left(guild_id, str(member.id))
+
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    removals.member_joined(str(member.guild.id), str(member.id))
+
+
+async def run_worker():
+    # RUN_MODE=worker: the scheduler and the announcements, without a gateway
+    # connection. login() also runs setup_hook, which starts loading the data.
+    await bot.login(TOKEN)
+    try:
+        await data_loading
+        await start_metrics()
+        enqueue_missed_days()
+        schedule_configured_guilds()
+        scheduler.start()
+        resources.start()
+        server = await serve_events(IPC_SOCKET, handle_worker_event)
+        await catch_up_announcements()
+        async with server:
+            await server.serve_forever()
+    finally:
+        await bot.close()
+
+
+async def run_bot():
+    # RUN_MODE=all or gateway: bot.run(), with a handover when another
+    # instance holds the scheduler lease.
+    async with bot:
+        await bot.login(TOKEN)
+        if RUN_MODE == "all" and not lease.try_acquire():
+            await take_over()
+        await bot.connect()
+
+
+def handle_sigterm(signum, frame):
+    # systemctl stop/restart sends SIGTERM: shut down like Ctrl+C so pending
+    # writes are flushed below.
+    raise KeyboardInterrupt
+
+
+def handle_sigusr1(signum, frame):
+    # kill -USR1 <pid>: profile the event loop without restarting the bot.
+    loop_monitor.profiler.profile_to_file(
+        PROFILE_SECONDS, os.path.join(data_dir, "profiles")
+    )
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGUSR1, handle_sigusr1)
+    if RUN_MODE == "worker":
+        # The worker only mirrors the data: the gateway writes it.
+        try:
+            asyncio.run(run_worker())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ledger.close()
+    else:
+        discord.utils.setup_logging()
+        try:
+            asyncio.run(run_bot())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if storage is not None:
+                storage.close()
+            removals.flush()
+            ledger.close()
@@ -0,0 +1,270 @@
+import aiohttp
+import codecs
+import csv
+import json
+import os
+import re
+import tempfile
+
+from compact_store import CODE_TO_STR, encode_date
+
+# Streaming import and export of a guild's birthdays (/birthday import and
+# /birthday export).
+#
+# Import files are parsed chunk by chunk while they are downloaded and each
+# row is validated as soon as it is complete, so only the valid
+# { user_id: "DD/MM" } pairs are ever kept. Accepted formats:
+#   CSV:  user_id,date lines (the header line is optional)
+#   JSON: { "user_id": "DD/MM", ... }, the layout of birthdays.json for a guild,
+#         or [ { "user_id": ..., "date": "DD/MM" }, ... ]
+# Exports are written row by row to a temporary file, in a worker thread.
+
+IMPORT_FORMATS = ("csv", "json")
+MAX_IMPORT_BYTES = 10 * 1024 * 1024
+# Longest single JSON value accepted, so a broken file cannot grow the buffer.
+MAX_JSON_VALUE = 64 * 1024
+# Rejected rows kept to be shown back to the admin.
+MAX_REJECTED_KEPT = 10
+CHUNK_SIZE = 64 * 1024
+
+
+class BulkImportError(Exception):
+    # The file as a whole cannot be imported; the message is shown as is.
+    pass
+
+
+def import_format(filename):
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def validate_row(user_id, date):
+    # Returns the normalized (user_id, "DD/MM"), or raises ValueError with the
+    # reason shown to the admin.
+    user_id = str(user_id).strip()
+    if not (user_id.isascii() and user_id.isdigit()) or int(user_id) >= 2**64:
+        raise ValueError(f"identifiant invalide : {user_id!r}")
+    if not isinstance(date, str):
+        raise ValueError(f"date invalide : {date!r}")
+    try:
+        code = encode_date(date.strip())
+    except ValueError:
+        raise ValueError(f"date invalide : {date!r}") from None
+    return str(int(user_id)), CODE_TO_STR[code]
+
+
+class ImportResult:
+    def __init__(self):
+        # { user_id: "DD/MM" }; a user listed twice keeps the last date.
+        self.entries = {}
+        self.rows = 0
+        self.rejected_count = 0
+        # (row number, reason) of the first rejected rows.
+        self.rejected = []
+
+    def add(self, row, user_id, date):
+        self.rows += 1
+        try:
+            user_id, date = validate_row(user_id, date)
+        except ValueError as e:
+            self.reject(row, str(e))
+            return
+        self.entries[user_id] = date
+
+    def reject(self, row, reason):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REJECTED_KEPT:
+            self.rejected.append((row, reason))
+
+
+class CsvRowParser:
+    def __init__(self, result):
+        self.result = result
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._pending = ""
+        self._row = 0
+
+    def feed(self, data):
+        self._pending += self._decoder.decode(data)
+        lines = self._pending.split("\n")
+        self._pending = lines.pop()
+        self._parse(lines)
+
+    def close(self):
+        self._pending += self._decoder.decode(b"", final=True)
+        self._parse([self._pending])
+        self._pending = ""
+
+    def _parse(self, lines):
+        for fields in csv.reader(lines):
+            self._row += 1
+            if not fields or not "".join(fields).strip():
+                continue
+            if self._row == 1 and not fields[0].strip().isdigit():
+                # Header line.
+                continue
+            if len(fields) != 2:
+                self.result.reject(self._row, "la ligne doit contenir user_id,date")
+                continue
+            self.result.add(self._row, fields[0], fields[1])
+
+
+_WHITESPACE = re.compile(r"\s*")
+# raw_decode could not finish: the value continues in the next chunk.
+_INCOMPLETE = object()
+
+
+class JsonRowParser:
+    # Incremental parser for the top-level object or array: each member is
+    # decoded with raw_decode as soon as it is complete and then dropped.
+
+    def __init__(self, result):
+        self.result = result
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        # start -> first/next (a member) -> colon -> value -> comma -> end
+        self._state = "start"
+        self._closing = None
+        self._key = None
+        self._row = 0
+
+    def feed(self, data):
+        self._buffer = self._buffer[self._pos :] + self._decoder.decode(data)
+        self._pos = 0
+        self._parse(final=False)
+
+    def close(self):
+        self._buffer = self._buffer[self._pos :] + self._decoder.decode(
+            b"", final=True
+        )
+        self._pos = 0
+        self._parse(final=True)
+        if self._state != "end":
+            raise BulkImportError("Le fichier JSON est incomplet.")
+
+    def _decode(self, pos, final):
+        try:
+            value, end = self._json.raw_decode(self._buffer, pos)
+        except json.JSONDecodeError as e:
+            if not final and len(self._buffer) - pos < MAX_JSON_VALUE:
+                return _INCOMPLETE
+            raise BulkImportError(f"JSON invalide : {e.msg}.") from None
+        # A number at the very end of the chunk may continue in the next one.
+        if end == len(self._buffer) and not final:
+            return _INCOMPLETE
+        self._pos = end
+        return value
+
+    def _parse(self, final):
+        buffer = self._buffer
+        while True:
+            pos = _WHITESPACE.match(buffer, self._pos).end()
+            self._pos = pos
+            if pos >= len(buffer):
+                return
+            char = buffer[pos]
+            state = self._state
+            if state == "start":
+                if char not in "{[":
+                    raise BulkImportError("Le JSON doit être un objet ou une liste.")
+                self._closing = "}" if char == "{" else "]"
+                self._pos = pos + 1
+                self._state = "first"
+            elif state == "first" and char == self._closing:
+                self._pos = pos + 1
+                self._state = "end"
+            elif state in ("first", "next"):
+                value = self._decode(pos, final)
+                if value is _INCOMPLETE:
+                    return
+                if self._closing == "}":
+                    self._key = value
+                    self._state = "colon"
+                else:
+                    self._row += 1
+                    self._add_item(value)
+                    self._state = "comma"
+            elif state == "colon":
+                if char != ":":
+                    raise BulkImportError("JSON invalide : ':' attendu.")
+                self._pos = pos + 1
+                self._state = "value"
+            elif state == "value":
+                value = self._decode(pos, final)
+                if value is _INCOMPLETE:
+                    return
+                self._row += 1
+                self.result.add(self._row, self._key, value)
+                self._state = "comma"
+            elif state == "comma":
+                if char == ",":
+                    self._state = "next"
+                elif char == self._closing:
+                    self._state = "end"
+                else:
+                    raise BulkImportError(
+                        f"JSON invalide : ',' ou '{self._closing}' attendu."
+                    )
+                self._pos = pos + 1
+            else:
+                raise BulkImportError("JSON invalide : données après la fin.")
+
+    def _add_item(self, item):
+        if not isinstance(item, dict) or "user_id" not in item or "date" not in item:
+            self.result.reject(self._row, "l'élément doit avoir user_id et date")
+            return
+        self.result.add(self._row, item["user_id"], item["date"])
+
+
+PARSERS = {"csv": CsvRowParser, "json": JsonRowParser}
+
+
+async def download(url, max_bytes=MAX_IMPORT_BYTES):
+    # Yields the attachment in chunks, without holding the whole file.
+    received = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise BulkImportError(
+                        f"Le fichier dépasse {max_bytes // (1024 * 1024)} Mo."
+                    )
+                yield chunk
+
+
+async def parse_import(chunks, file_format):
+    # chunks: async iterable of bytes. Returns an ImportResult.
+    result = ImportResult()
+    parser = PARSERS[file_format](result)
+    async for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return result
+
+
+def write_export(guild_birthdays, file_format):
+    # Writes a GuildBirthdays to a temporary file, one row at a time, and
+    # returns its path. The caller deletes the file once it is sent.
+    fd, path = tempfile.mkstemp(prefix="birthdays-", suffix=f".{file_format}")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            if file_format == "csv":
+                writer = csv.writer(f)
+                writer.writerow(("user_id", "date"))
+                for user_id, code in guild_birthdays.packed_items():
+                    writer.writerow((user_id, CODE_TO_STR[code]))
+            else:
+                separator = "\n"
+                f.write("{")
+                for user_id, code in guild_birthdays.packed_items():
+                    f.write(f'{separator}    "{user_id}": "{CODE_TO_STR[code]}"')
+                    separator = ",\n"
+                f.write("\n}\n")
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
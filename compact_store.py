@@ -0,0 +1,279 @@
+import bisect
+import datetime
+
+from array import array
+from collections.abc import MutableMapping
+
+# Compact in-memory representation of the birthdays.
+#
+# A guild's birthdays are two parallel arrays sorted by user ID: the user IDs
+# as unsigned 64-bit integers and the birthdays as a day-of-year code (1-366,
+# counted in a leap year so 29/02 has its own code). That is 10 bytes per
+# registration instead of a dict entry, a key string and a value string.
+#
+# A guild that is asked for its birthdays in date order also gets the same
+# pairs sorted by (code, user ID), built on first use and then kept up to date,
+# so a range of days is found by bisection.
+#
+# Both classes behave like the dicts they replace:
+#   { guild_id: { user_id: "DD/MM", ... }, ... }
+# so the handlers keep reading birthdays[guild_id][user_id] as before.
+
+BYTES_PER_BIRTHDAY = array("Q").itemsize + array("H").itemsize
+
+_LEAP_YEAR = 2000
+_FIRST_DAY = datetime.date(_LEAP_YEAR, 1, 1)
+
+_DAYS = [_FIRST_DAY + datetime.timedelta(days=i) for i in range(366)]
+# Index 0 is unused so codes start at 1.
+CODE_TO_MONTH_DAY = [(0, 0)] + [(day.month, day.day) for day in _DAYS]
+CODE_TO_STR = [""] + [f"{day.day:02d}/{day.month:02d}" for day in _DAYS]
+_STR_TO_CODE = {date: code for code, date in enumerate(CODE_TO_STR) if code}
+MONTH_DAY_TO_CODE = {
+    month_day: code for code, month_day in enumerate(CODE_TO_MONTH_DAY) if code
+}
+
+
+def encode_date(date_str):
+    # "DD/MM" -> day-of-year code; accepts unpadded input such as "1/5".
+    code = _STR_TO_CODE.get(date_str)
+    if code is None:
+        day, month = map(int, date_str.split("/"))
+        code = _STR_TO_CODE.get(f"{day:02d}/{month:02d}")
+        if code is None:
+            raise ValueError(f"Invalid date: {date_str}")
+    return code
+
+
+class GuildBirthdays(MutableMapping):
+    __slots__ = ("_user_ids", "_codes", "_by_day")
+
+    def __init__(self):
+        self._user_ids = array("Q")
+        self._codes = array("H")
+        # (codes, user IDs) sorted by (code, user ID), or None until needed.
+        self._by_day = None
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        # Bulk build from (user_id, code) pairs, in any order.
+        guild = cls()
+        for user_id, code in sorted(pairs):
+            guild._user_ids.append(user_id)
+            guild._codes.append(code)
+        return guild
+
+    @classmethod
+    def from_arrays(cls, user_ids, codes):
+        # Takes ownership of arrays that are already sorted by user ID.
+        guild = cls()
+        guild._user_ids = user_ids
+        guild._codes = codes
+        return guild
+
+    def _find(self, user_id):
+        i = bisect.bisect_left(self._user_ids, user_id)
+        if i < len(self._user_ids) and self._user_ids[i] == user_id:
+            return i
+        return -1
+
+    def __getitem__(self, user_id):
+        i = self._find(int(user_id))
+        if i < 0:
+            raise KeyError(user_id)
+        return CODE_TO_STR[self._codes[i]]
+
+    def __setitem__(self, user_id, date_str):
+        self.set_code(int(user_id), encode_date(date_str))
+
+    def merge(self, pairs):
+        # Bulk insert/update of (user_id, code) pairs: one sort instead of a
+        # sorted insert (and an array shift) per pair.
+        merged = dict(zip(self._user_ids, self._codes))
+        merged.update(pairs)
+        guild = GuildBirthdays.from_pairs(merged.items())
+        self._user_ids, self._codes = guild._user_ids, guild._codes
+        self._by_day = None
+
+    def set_code(self, user_id, code):
+        i = bisect.bisect_left(self._user_ids, user_id)
+        if i < len(self._user_ids) and self._user_ids[i] == user_id:
+            self._day_remove(self._codes[i], user_id)
+            self._codes[i] = code
+        else:
+            self._user_ids.insert(i, user_id)
+            self._codes.insert(i, code)
+        self._day_insert(code, user_id)
+
+    def __delitem__(self, user_id):
+        i = self._find(int(user_id))
+        if i < 0:
+            raise KeyError(user_id)
+        self._day_remove(self._codes[i], self._user_ids[i])
+        del self._user_ids[i]
+        del self._codes[i]
+
+    def remove_many(self, user_ids):
+        # Bulk delete of integer user IDs: one pass over the arrays instead of
+        # a shift per user. Returns how many were removed.
+        removed = set(user_ids)
+        kept = [
+            (user_id, code)
+            for user_id, code in zip(self._user_ids, self._codes)
+            if user_id not in removed
+        ]
+        count = len(self._user_ids) - len(kept)
+        if count:
+            self._user_ids = array("Q", [user_id for user_id, _ in kept])
+            self._codes = array("H", [code for _, code in kept])
+            self._by_day = None
+        return count
+
+    def __contains__(self, user_id):
+        try:
+            return self._find(int(user_id)) >= 0
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self):
+        return (str(user_id) for user_id in self._user_ids)
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def user_ids_on(self, code):
+        # User IDs (ints) whose birthday has the given code.
+        codes = self._codes
+        if code not in codes:
+            return []
+        return [
+            user_id for user_id, other in zip(self._user_ids, codes) if other == code
+        ]
+
+    def _day_order(self):
+        if self._by_day is None:
+            # Counting sort: one bucket per code, filled in user ID order, so
+            # each bucket is already sorted and no pair is compared.
+            buckets = [array("Q") for _ in CODE_TO_STR]
+            for user_id, code in zip(self._user_ids, self._codes):
+                buckets[code].append(user_id)
+            codes, user_ids = array("H"), array("Q")
+            for code, bucket in enumerate(buckets):
+                if bucket:
+                    codes.extend(array("H", [code]) * len(bucket))
+                    user_ids.extend(bucket)
+            self._by_day = (codes, user_ids)
+        return self._by_day
+
+    def _day_position(self, code, user_id):
+        codes, user_ids = self._by_day
+        first = bisect.bisect_left(codes, code)
+        last = bisect.bisect_right(codes, code, first)
+        return bisect.bisect_left(user_ids, user_id, first, last)
+
+    def _day_insert(self, code, user_id):
+        if self._by_day is not None:
+            i = self._day_position(code, user_id)
+            self._by_day[0].insert(i, code)
+            self._by_day[1].insert(i, user_id)
+
+    def _day_remove(self, code, user_id):
+        if self._by_day is not None:
+            i = self._day_position(code, user_id)
+            del self._by_day[0][i]
+            del self._by_day[1][i]
+
+    def between(self, first, last):
+        # (code, user_id) pairs with first <= code <= last, in date order;
+        # read lazily, so stopping early costs only what was read.
+        codes, user_ids = self._day_order()
+        start = bisect.bisect_left(codes, first)
+        end = bisect.bisect_right(codes, last, start)
+        for i in range(start, end):
+            yield codes[i], user_ids[i]
+
+    def arrays(self):
+        # The underlying (user IDs, codes) arrays, for bulk serialization.
+        return self._user_ids, self._codes
+
+    def packed_items(self):
+        # (user_id as int, day-of-year code) without building any string.
+        return zip(self._user_ids, self._codes)
+
+    def copy(self):
+        guild = GuildBirthdays()
+        guild._user_ids = array("Q", self._user_ids)
+        guild._codes = array("H", self._codes)
+        return guild
+
+    def to_dict(self):
+        return {
+            str(user_id): CODE_TO_STR[code] for user_id, code in self.packed_items()
+        }
+
+
+class CompactBirthdays(MutableMapping):
+    __slots__ = ("_guilds",)
+
+    def __init__(self):
+        # { guild_id: GuildBirthdays }
+        self._guilds = {}
+
+    @classmethod
+    def from_dict(cls, data):
+        birthdays = cls()
+        for guild_id, guild_birthdays in data.items():
+            pairs = []
+            for user_id, date_str in guild_birthdays.items():
+                try:
+                    pairs.append((int(user_id), encode_date(date_str)))
+                except ValueError:
+                    print(
+                        f"Date invalide ignorée pour l'utilisateur {user_id} "
+                        f"sur le serveur {guild_id} : {date_str}"
+                    )
+            birthdays._guilds[guild_id] = GuildBirthdays.from_pairs(pairs)
+        return birthdays
+
+    def __getitem__(self, guild_id):
+        return self._guilds[guild_id]
+
+    def __setitem__(self, guild_id, guild_birthdays):
+        if not isinstance(guild_birthdays, GuildBirthdays):
+            guild_birthdays = GuildBirthdays.from_pairs(
+                (int(user_id), encode_date(date_str))
+                for user_id, date_str in guild_birthdays.items()
+            )
+        self._guilds[guild_id] = guild_birthdays
+
+    def __delitem__(self, guild_id):
+        del self._guilds[guild_id]
+
+    def __iter__(self):
+        return iter(self._guilds)
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def setdefault(self, guild_id, default=None):
+        # The default is ignored: a missing guild always gets an empty
+        # GuildBirthdays, so callers can keep writing setdefault(guild_id, {}).
+        guild = self._guilds.get(guild_id)
+        if guild is None:
+            guild = self._guilds[guild_id] = GuildBirthdays()
+        return guild
+
+    def copy(self):
+        # Copies the arrays only (a memcpy each), cheap enough for the loop.
+        birthdays = CompactBirthdays()
+        birthdays._guilds = {
+            guild_id: guild_birthdays.copy()
+            for guild_id, guild_birthdays in self._guilds.items()
+        }
+        return birthdays
+
+    def to_dict(self):
+        return {
+            guild_id: guild_birthdays.to_dict()
+            for guild_id, guild_birthdays in self._guilds.items()
+        }
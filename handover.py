@@ -0,0 +1,115 @@
+import asyncio
+import fcntl
+import os
+import time
+
+# Handover between an old and a new instance of the bot on the same machine.
+#
+# The instance that runs the scheduler holds an exclusive lock on the lease
+# file, which also holds its PID. The kernel drops the lock if the process
+# dies, so a crashed instance never keeps it. An instance started while the
+# lease is held takes over from the running one:
+#   1. new: logs in over REST, loads the data and syncs the commands while
+#      the old instance keeps serving, then writes its PID to the request
+#      file and waits for the lease.
+#   2. old: sees the request, stops its scheduler once the runs in progress
+#      are done and releases the lease.
+#   3. new: takes the lease and removes the request.
+#   4. old: sees the new PID in the lease file, closes its gateway session,
+#      flushes its data and exits.
+#   5. new: once the old process is gone, reloads the data (from the snapshot
+#      the old one just wrote) and connects to the gateway.
+# Announcements missed in between are replayed by the catch-up on ready, and
+# the ledger keeps them from being posted twice.
+
+POLL_INTERVAL = 0.5
+HANDOVER_TIMEOUT = 120.0
+
+
+class SchedulerLease:
+    def __init__(self, path):
+        self.path = path
+        self.request_file = path + ".request"
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def try_acquire(self):
+        if self._file is not None:
+            return True
+        f = open(self.path, "a+", encoding="utf-8")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def release(self):
+        if self._file is not None:
+            # The PID is left in the file: the next holder overwrites it.
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def holder(self):
+        # PID of the last instance that took the lease, if any.
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    async def wait_taken(self, timeout=HANDOVER_TIMEOUT):
+        # After release(): True once another instance holds the lease.
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.holder() != os.getpid():
+                return True
+            await asyncio.sleep(POLL_INTERVAL)
+        return False
+
+    def request_handover(self):
+        temp_file = f"{self.request_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+        os.replace(temp_file, self.request_file)
+
+    def handover_requested(self):
+        return os.path.exists(self.request_file)
+
+    def clear_request(self):
+        try:
+            os.unlink(self.request_file)
+        except FileNotFoundError:
+            pass
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+async def wait_for_exit(pid, timeout=HANDOVER_TIMEOUT):
+    # True once the process is gone, False on timeout.
+    deadline = time.monotonic() + timeout
+    while process_alive(pid):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(POLL_INTERVAL / 5)
+    return True
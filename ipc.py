@@ -0,0 +1,113 @@
+import asyncio
+import collections
+import json
+import os
+
+from metrics import Counter
+
+# Local channel between the gateway process and the scheduler worker when the
+# bot runs split (RUN_MODE=gateway / RUN_MODE=worker).
+#
+# The gateway publishes every data change as one line of JSON on a Unix
+# socket served by the worker, which applies it to its own in-memory mirror
+# and reschedules the guild if needed. publish() never waits: events are
+# queued and sent by a background task that reconnects whenever the worker
+# restarts. If the queue overflows while the worker is away, the oldest
+# events are dropped and the worker is told to reload its data from disk; so
+# is it on every connection, since events written to a lost connection, or
+# queued by a gateway that died, may never have been applied.
+
+MAX_PENDING_EVENTS = 100_000
+# A /birthday import is sent as a single event.
+MAX_EVENT_BYTES = 32 * 1024 * 1024
+RECONNECT_DELAY = 1.0
+
+ipc_events = Counter(
+    "ipc_events_total",
+    "Data change events exchanged with the worker, by direction (sent, received).",
+    labels=("direction",),
+)
+ipc_dropped = Counter(
+    "ipc_events_dropped_total", "Events dropped because the worker was unreachable."
+)
+
+
+class EventPublisher:
+    def __init__(self, socket_path, max_pending=MAX_PENDING_EVENTS):
+        self.socket_path = socket_path
+        self._pending = collections.deque()
+        self.max_pending = max_pending
+        # Set when events may have been lost: the worker must reload from disk.
+        self._resync = True
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def publish(self, event):
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self._resync = True
+            ipc_dropped.inc()
+        self._pending.append(event)
+        self._wakeup.set()
+
+    async def _send_pending(self, writer):
+        if self._resync:
+            writer.write(b'{"op": "reload"}\n')
+            await writer.drain()
+            self._resync = False
+        while self._pending:
+            event = self._pending[0]
+            writer.write(json.dumps(event).encode("utf-8") + b"\n")
+            await writer.drain()
+            # Only dropped from the queue once written to the socket.
+            self._pending.popleft()
+            ipc_events.inc("sent")
+
+    async def _run(self):
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            print(f"Connecté au worker ({self.socket_path}).")
+            # Events written to the previous connection may never have been
+            # read, and the worker may be a new one: it reloads from disk.
+            self._resync = True
+            try:
+                while True:
+                    self._wakeup.clear()
+                    await self._send_pending(writer)
+                    await self._wakeup.wait()
+            except OSError as e:
+                print(f"Connexion au worker perdue : {e}")
+            finally:
+                writer.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+
+async def serve_events(socket_path, handler):
+    # Worker side: calls handler(event) for each event, in order.
+    async def handle(reader, writer):
+        try:
+            while line := await reader.readline():
+                ipc_events.inc("received")
+                try:
+                    await handler(json.loads(line))
+                except Exception as e:
+                    print(f"Erreur lors de l'application d'un événement : {e}")
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        # Left over by a previous worker.
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(
+        handle, socket_path, limit=MAX_EVENT_BYTES
+    )
+    print(f"En attente du gateway sur {socket_path}.")
+    return server
@@ -1,5 +1,12 @@
 import json
 import os
+import tempfile
+
+# Read once at import: os.umask() can only be read by setting it, which is not
+# safe once the write-behind threads are running.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 
 # Utility functions for loading and saving JSON data
 def load_json(filename):
@@ -9,6 +16,30 @@ def load_json(filename):
     return {}
 
 
-def save_json(filename, data):
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
\ No newline at end of file
+def keep_file_mode(fd, filename):
+    # mkstemp creates the temporary file with mode 0600: give it the mode of
+    # the file it replaces, or the mode open() would have used for a new one.
+    try:
+        mode = os.stat(filename).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    os.fchmod(fd, mode)
+
+
+def save_json_atomic(filename, data):
+    # Write to a temporary file in the same directory, then rename it over the
+    # target so a crash mid-write never leaves a truncated file behind.
+    directory = os.path.dirname(filename) or "."
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(filename) + ".", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            keep_file_mode(f.fileno(), filename)
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
\ No newline at end of file
@@ -0,0 +1,151 @@
+import datetime
+import sqlite3
+import time
+
+# Durable ledger of the birthday announcements.
+#
+# Each (guild, user, local date) announcement is written to the ledger as
+# "pending" before anything is sent, then moves through the steps of an
+# announcement so a run interrupted by a crash or a restart resumes where it
+# stopped instead of posting duplicates:
+#   pending -> posted (message sent) -> threaded (thread created) -> done
+# Same-day birthdays announced together share one message and one thread:
+# their entries move through the steps together and keep the same IDs.
+# The runs table remembers the last local date handled for each guild, so
+# days missed while the bot was offline can be replayed on startup.
+
+PENDING = "pending"
+POSTED = "posted"
+THREADED = "threaded"
+DONE = "done"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS announcements (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message_id INTEGER,
+    thread_id INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (guild_id, user_id, date)
+);
+CREATE INDEX IF NOT EXISTS idx_announcements_unfinished
+    ON announcements (guild_id, date) WHERE status != 'done';
+
+CREATE TABLE IF NOT EXISTS runs (
+    guild_id TEXT PRIMARY KEY,
+    last_date TEXT NOT NULL
+);
+"""
+
+
+class LedgerEntry:
+    __slots__ = ("guild_id", "user_id", "date", "status", "message_id", "thread_id")
+
+    def __init__(self, guild_id, user_id, date, status, message_id, thread_id):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.date = date
+        self.status = status
+        self.message_id = message_id
+        self.thread_id = thread_id
+
+
+class AnnouncementLedger:
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def enqueue_many(self, due):
+        # Records the announcements of (guild_id, local_date, user_ids) days
+        # and marks those days as handled, all in one transaction: a midnight
+        # with thousands of due guilds is a single commit. Already known
+        # entries are kept as is.
+        now = time.time()
+        announcements = []
+        runs = []
+        for guild_id, local_date, user_ids in due:
+            date = local_date.isoformat()
+            announcements.extend(
+                (guild_id, user_id, date, PENDING, now) for user_id in user_ids
+            )
+            runs.append((guild_id, date))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO announcements "
+                "(guild_id, user_id, date, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                announcements,
+            )
+            self.conn.executemany(
+                "INSERT INTO runs (guild_id, last_date) VALUES (?, ?) "
+                "ON CONFLICT (guild_id) DO UPDATE SET "
+                "last_date = max(last_date, excluded.last_date)",
+                runs,
+            )
+
+    def last_run_dates(self):
+        # { guild_id: date } of the last day handled for every guild.
+        return {
+            guild_id: datetime.date.fromisoformat(last_date)
+            for guild_id, last_date in self.conn.execute(
+                "SELECT guild_id, last_date FROM runs"
+            )
+        }
+
+    def last_run_date(self, guild_id):
+        row = self.conn.execute(
+            "SELECT last_date FROM runs WHERE guild_id = ?", (guild_id,)
+        ).fetchone()
+        return datetime.date.fromisoformat(row[0]) if row else None
+
+    def unfinished(self, guild_id, since):
+        # Entries of the guild not done yet, from the given local date on.
+        rows = self.conn.execute(
+            "SELECT guild_id, user_id, date, status, message_id, thread_id "
+            "FROM announcements "
+            "WHERE guild_id = ? AND date >= ? AND status != 'done'",
+            (guild_id, since.isoformat()),
+        )
+        return [LedgerEntry(*row) for row in rows]
+
+    def unfinished_guilds(self, since):
+        return [
+            guild_id
+            for (guild_id,) in self.conn.execute(
+                "SELECT DISTINCT guild_id FROM announcements "
+                "WHERE date >= ? AND status != 'done'",
+                (since.isoformat(),),
+            )
+        ]
+
+    def _update(self, entries, **values):
+        # Moves the entries of one announcement to the next step at once.
+        for entry in entries:
+            for key, value in values.items():
+                setattr(entry, key, value)
+        assignments = ", ".join(f"{key} = ?" for key in values)
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                f"UPDATE announcements SET {assignments}, updated_at = ? "
+                "WHERE guild_id = ? AND user_id = ? AND date = ?",
+                [
+                    (*values.values(), now, entry.guild_id, entry.user_id, entry.date)
+                    for entry in entries
+                ],
+            )
+
+    def mark_posted(self, entries, message_id):
+        self._update(entries, status=POSTED, message_id=message_id)
+
+    def mark_threaded(self, entries, thread_id):
+        self._update(entries, status=THREADED, thread_id=thread_id)
+
+    def mark_done(self, entries):
+        self._update(entries, status=DONE)
+
+    def close(self):
+        self.conn.close()
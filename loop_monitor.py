@@ -0,0 +1,192 @@
+import asyncio
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import Counter, Histogram, debug_routes
+
+# Event-loop stall detection and an on-demand sampling profiler.
+#
+# Both run in their own thread and look at the event loop's thread from the
+# outside, so they still see what is going on while the loop is blocked:
+# - LoopWatchdog: a task on the loop bumps a heartbeat; when the heartbeat is
+#   older than the threshold, the watchdog thread logs the stack the loop is
+#   stuck in and the task that was running.
+# - SamplingProfiler: samples the loop thread's stack every few milliseconds
+#   for a given time and returns the stacks in the folded format read by
+#   flamegraph.pl and speedscope ("frame;frame;frame count" per line).
+#   Triggered with SIGUSR1 (written to a file) or GET /debug/profile?seconds=N
+#   on the metrics endpoint.
+
+STALL_THRESHOLD = 0.5
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 300
+
+loop_stalls = Counter(
+    "event_loop_stalls_total", "Times the event loop was blocked past the threshold."
+)
+loop_stall_duration = Histogram(
+    "event_loop_stall_seconds",
+    "How long the event loop stayed blocked, for the stalls that were logged.",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+def _current_task_name(loop):
+    # The task the loop is running, read from another thread.
+    task = asyncio.current_task(loop)
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+class LoopWatchdog:
+    def __init__(self, threshold=STALL_THRESHOLD):
+        self.threshold = threshold
+        self.interval = threshold / 5
+        self._beat = time.monotonic()
+        self._loop = None
+        self._thread_id = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        # Heartbeat of the stall being reported, if any.
+        stalled_beat = None
+        while True:
+            time.sleep(self.interval)
+            beat = self._beat
+            if stalled_beat is not None and beat != stalled_beat:
+                duration = beat - stalled_beat - self.interval
+                loop_stall_duration.observe(duration)
+                print(f"⏱️ Boucle d'événements débloquée après {duration:.2f}s.")
+                stalled_beat = None
+            lag = time.monotonic() - beat - self.interval
+            if stalled_beat is None and lag >= self.threshold:
+                stalled_beat = beat
+                loop_stalls.inc()
+                self._report(lag)
+
+    def _report(self, lag):
+        frame = sys._current_frames().get(self._thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        task = _current_task_name(self._loop) or "aucune"
+        print(
+            f"⚠️ Boucle d'événements bloquée depuis {lag:.2f}s "
+            f"(tâche : {task}). Pile :\n{stack}",
+            end="",
+        )
+
+    def start(self):
+        # Called from the event loop.
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+
+def _fold(frame, task_name):
+    # Root first: "task;module:function;...;module:function"
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    if task_name:
+        names.append(f"task:{task_name}")
+    return ";".join(reversed(names))
+
+
+class ProfilerError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._loop = None
+        self._thread_id = None
+        self._lock = threading.Lock()
+
+    def attach(self):
+        # Called from the event loop: its thread is the one sampled.
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+
+    def profile(self, seconds):
+        # Blocks the calling thread for `seconds` and returns the folded
+        # stacks, most frequent first. One profile at a time.
+        if self._thread_id is None:
+            raise ProfilerError("La boucle d'événements n'est pas encore démarrée.")
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerError("Un profil est déjà en cours.")
+        try:
+            stacks = collections.Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self._thread_id)
+                if frame is not None:
+                    task_name = _current_task_name(self._loop)
+                    stacks[_fold(frame, task_name)] += 1
+                del frame
+                time.sleep(self.interval)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def profile_to_file(self, seconds, directory):
+        # Runs a profile in a background thread and writes it to `directory`.
+        def run():
+            try:
+                folded = self.profile(seconds)
+            except ProfilerError as e:
+                print(f"Profil ignoré : {e}")
+                return
+            os.makedirs(directory, exist_ok=True)
+            name = datetime.datetime.now().strftime("profile-%Y%m%d-%H%M%S.folded")
+            path = os.path.join(directory, name)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(folded)
+            print(f"Profil de {seconds}s enregistré dans {path}.")
+
+        print(f"Profil de la boucle d'événements pendant {seconds}s...")
+        threading.Thread(target=run, name="profiler", daemon=True).start()
+
+
+watchdog = None
+profiler = SamplingProfiler()
+
+
+def start(stall_threshold=STALL_THRESHOLD):
+    # Called once from the event loop. A threshold of 0 disables the watchdog.
+    global watchdog
+    profiler.attach()
+    if stall_threshold and watchdog is None:
+        watchdog = LoopWatchdog(stall_threshold)
+        watchdog.start()
+
+
+async def _profile_route(query):
+    try:
+        seconds = float(query.get("seconds", ["10"])[0])
+    except ValueError:
+        raise ValueError("seconds must be a number") from None
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise ValueError(f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+    try:
+        folded = await asyncio.to_thread(profiler.profile, seconds)
+    except ProfilerError as e:
+        raise ValueError(str(e)) from None
+    return "text/plain", folded
+
+
+debug_routes["/debug/profile"] = _profile_route
@@ -0,0 +1,232 @@
+import asyncio
+import functools
+import heapq
+import json
+import time
+import urllib.parse
+
+# Lightweight in-process metrics, exposed in the Prometheus text format.
+#
+# Counters and histograms are registered once at import time by the modules
+# that record them. serve() exposes them over HTTP:
+#   GET /metrics     Prometheus text format
+#   GET /debug/slow  slowest handler invocations (when tracing is enabled)
+# Other modules can add endpoints to debug_routes.
+
+# Default latency buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+# { path: async handler(query) -> (content_type, body) }, query being the
+# parsed query string ({ name: [values] }).
+debug_routes = {}
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        key = tuple(label_values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(tuple(label_values), 0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        self._values[tuple(label_values)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # { label_values: [bucket counts..., sum, count] }
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        key = tuple(label_values)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def samples(self):
+        for key, state in self._values.items():
+            for bound, count in zip(self.buckets, state):
+                labels = _format_labels(self.labels, key, [("le", bound)])
+                yield f"{self.name}_bucket", labels, count
+            labels = _format_labels(self.labels, key, [("le", "+Inf")])
+            yield f"{self.name}_bucket", labels, state[-1]
+            yield f"{self.name}_sum", _format_labels(self.labels, key), state[-2]
+            yield f"{self.name}_count", _format_labels(self.labels, key), state[-1]
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ========================== Slow handler tracing ==========================
+
+
+class SlowTracer:
+    # Keeps the N slowest invocations seen since startup.
+
+    def __init__(self, size=0):
+        self.size = size
+        self._heap = []
+
+    def record(self, duration, name, detail):
+        if not self.size:
+            return
+        entry = (duration, time.time(), name, detail)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+        elif duration > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def slowest(self):
+        return [
+            {"duration_s": duration, "at": at, "name": name, "detail": detail}
+            for duration, at, name, detail in sorted(self._heap, reverse=True)
+        ]
+
+
+slow_tracer = SlowTracer()
+
+command_latency = Histogram(
+    "birthday_command_duration_seconds",
+    "Time spent handling a /birthday subcommand.",
+    labels=("command",),
+)
+command_errors = Counter(
+    "birthday_command_errors_total",
+    "/birthday subcommands that raised an exception.",
+    labels=("command",),
+)
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between when a periodic wake-up was due and when it ran.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+
+def instrument_command(name):
+    # Decorator for the /birthday subcommand callbacks. functools.wraps keeps
+    # the signature discord.py reads the command parameters from.
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction, *args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await func(interaction, *args, **kwargs)
+            except Exception:
+                command_errors.inc(name)
+                raise
+            finally:
+                duration = time.perf_counter() - started_at
+                command_latency.observe(duration, name)
+                guild = getattr(interaction, "guild", None)
+                detail = {"guild_id": getattr(guild, "id", None)}
+                slow_tracer.record(duration, f"/birthday {name}", detail)
+
+        return wrapper
+
+    return decorator
+
+
+async def monitor_event_loop_lag(interval=1.0):
+    # A sleep that wakes up late means something blocked the event loop.
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, time.perf_counter() - expected))
+
+
+# ========================== HTTP endpoint ==========================
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain the headers; the body is never used.
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode("latin-1").split()
+        url = urllib.parse.urlsplit(parts[1] if len(parts) > 1 else "/")
+        path = url.path
+        if path == "/metrics":
+            status, content_type = "200 OK", "text/plain; version=0.0.4"
+            body = render()
+        elif path == "/debug/slow":
+            status, content_type = "200 OK", "application/json"
+            body = json.dumps(slow_tracer.slowest(), indent=2)
+        elif path in debug_routes:
+            query = urllib.parse.parse_qs(url.query)
+            try:
+                content_type, body = await debug_routes[path](query)
+                status = "200 OK"
+            except ValueError as e:
+                status, content_type, body = "400 Bad Request", "text/plain", f"{e}\n"
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", "Not found\n"
+        payload = body.encode("utf-8")
+        headers = (
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode("latin-1") + payload)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host, port, trace_slow=0):
+    # Starts the metrics endpoint and the event-loop lag monitor.
+    slow_tracer.size = trace_slow
+    server = await asyncio.start_server(_handle, host, port)
+    asyncio.get_running_loop().create_task(monitor_event_loop_lag())
+    print(f"Metrics available on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import time
+
+from json_helper import save_json_atomic
+from metrics import Histogram
+
+# Write-behind persistence for the JSON files.
+#
+# A change only marks the file dirty. Bursts of changes within the debounce
+# window are coalesced into a single write, which runs in a worker thread so
+# the event loop (and the gateway heartbeat) is never blocked by json.dump.
+
+flush_duration = Histogram(
+    "persistence_flush_seconds",
+    "Time spent writing a data file, in the worker thread.",
+    labels=("file",),
+)
+
+
+def save_timed(filename, data):
+    started_at = time.perf_counter()
+    save_json_atomic(filename, data)
+    duration = time.perf_counter() - started_at
+    flush_duration.observe(duration, os.path.basename(filename))
+
+
+class WriteBehindPersister:
+    def __init__(self, filename, snapshot, delay=1.0, encode=None):
+        self.filename = filename
+        # Called on the event loop to take a copy of the data to write, so the
+        # worker thread never iterates a dict that is being modified.
+        self.snapshot = snapshot
+        # Optional conversion of the snapshot to JSON-ready data, run in the
+        # worker thread.
+        self.encode = encode
+        self.delay = delay
+        self._dirty = False
+        self._task = None
+
+    def mark_dirty(self):
+        self._dirty = True
+        if self._task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (e.g. scripts): write immediately.
+            self.flush()
+            return
+        self._task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            while self._dirty:
+                await asyncio.sleep(self.delay)
+                self._dirty = False
+                data = self.snapshot()
+                try:
+                    await asyncio.to_thread(self._save, data)
+                except Exception as e:
+                    self._dirty = True
+                    print(f"Erreur lors de l'enregistrement de {self.filename} : {e}")
+                    return
+        finally:
+            self._task = None
+
+    def flush(self):
+        # Synchronous flush, used on shutdown once the event loop has stopped.
+        if self._dirty:
+            self._dirty = False
+            self._save(self.snapshot())
+
+    def _save(self, data):
+        if self.encode is not None:
+            data = self.encode(data)
+        save_timed(self.filename, data)
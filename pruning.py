@@ -0,0 +1,126 @@
+import time
+
+from json_helper import load_json
+from metrics import Counter, Gauge
+from persistence import WriteBehindPersister
+
+# Cleanup of the data of the guilds the bot left and of the members who left
+# a guild.
+#
+# on_guild_remove and on_member_remove only record the departure and its time
+# in a small JSON file; coming back within the grace period cancels it. A
+# periodic compaction pass then removes the data of the departures older than
+# the grace period, in batches: each batch is a single write of the data (one
+# transaction for SQLite, one rewrite of each JSON file). The grace period and
+# the compaction interval are set by the bot (PRUNE_GRACE_DAYS, PRUNE_INTERVAL).
+
+# Most departures handled by one pass; the others wait for the next one.
+BATCH_SIZE = 1000
+
+pruned_guilds = Counter(
+    "pruned_guilds_total", "Guilds whose data was removed after the bot left them."
+)
+pruned_birthdays = Counter(
+    "pruned_birthdays_total",
+    "Birthdays removed because their guild or member left.",
+)
+pending_departures = Gauge(
+    "pending_departures", "Guilds and members waiting for the grace period to end."
+)
+
+
+class PendingRemovals:
+    def __init__(self, path, delay=1.0):
+        self.path = path
+        # { guild_id: left_at }
+        self.guilds = {}
+        # { guild_id: { user_id: left_at } }
+        self.members = {}
+        self._persister = WriteBehindPersister(
+            path,
+            lambda: {
+                "guilds": dict(self.guilds),
+                "members": {
+                    guild_id: dict(users) for guild_id, users in self.members.items()
+                },
+            },
+            delay,
+        )
+
+    def load(self):
+        # Replaces what is in memory: call it on the event loop, before the
+        # gateway events that record departures can fire.
+        data = load_json(self.path)
+        self.guilds = data.get("guilds", {})
+        self.members = data.get("members", {})
+        self._changed(persist=False)
+
+    def _changed(self, persist=True):
+        pending_departures.set(
+            len(self.guilds) + sum(map(len, self.members.values()))
+        )
+        if persist:
+            self._persister.mark_dirty()
+
+    def guild_left(self, guild_id, now=None):
+        # The first departure counts: seeing it again does not restart the wait.
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = now or time.time()
+            self._changed()
+
+    def guild_joined(self, guild_id):
+        if self.guilds.pop(guild_id, None) is not None:
+            self._changed()
+
+    def member_left(self, guild_id, user_id, now=None):
+        users = self.members.setdefault(guild_id, {})
+        if user_id not in users:
+            users[user_id] = now or time.time()
+            self._changed()
+
+    def member_joined(self, guild_id, user_id):
+        users = self.members.get(guild_id, {})
+        if users.pop(user_id, None) is not None:
+            if not users:
+                del self.members[guild_id]
+            self._changed()
+
+    def due(self, now, grace, limit=BATCH_SIZE):
+        # (guild IDs, { guild_id: [user_id] }) whose grace period is over, at
+        # most `limit` departures in all.
+        deadline = now - grace
+        guild_ids = [
+            guild_id for guild_id, left_at in self.guilds.items() if left_at <= deadline
+        ][:limit]
+        members = {}
+        count = len(guild_ids)
+        for guild_id, users in self.members.items():
+            if count >= limit:
+                break
+            user_ids = [
+                user_id for user_id, left_at in users.items() if left_at <= deadline
+            ][: limit - count]
+            if user_ids:
+                members[guild_id] = user_ids
+                count += len(user_ids)
+        return guild_ids, members
+
+    def done(self, guild_ids, members):
+        # Forgets the departures whose data was removed.
+        for guild_id in guild_ids:
+            self.guilds.pop(guild_id, None)
+            # The guild's members went with it.
+            self.members.pop(guild_id, None)
+        for guild_id, user_ids in members.items():
+            users = self.members.get(guild_id)
+            if users is None:
+                continue
+            for user_id in user_ids:
+                users.pop(user_id, None)
+            if not users:
+                del self.members[guild_id]
+        self._changed()
+
+    def flush(self):
+        # Synchronous flush, used on shutdown once the event loop has stopped.
+        self._persister.flush()
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import random
+import string
+
+from array import array
+from json_helper import load_json
+from metrics import Counter
+
+# Announcement messages and GIFs, reloaded without a restart.
+#
+# The resource files are polled for changes (mtime and size). A changed set is
+# loaded, validated and compiled off to the side and only then swapped in, so
+# an announcement always sees a complete, valid set; a broken edit is logged
+# and the previous set stays in use.
+#
+# Each guild draws from its own shuffle bag: every message (and GIF) comes up
+# once per cycle, in a random order, before any of them repeats.
+
+POLL_INTERVAL = 10.0
+
+resource_reloads = Counter(
+    "resource_reloads_total",
+    "Reloads of the announcement resources, by result (ok, invalid).",
+    labels=("result",),
+)
+
+
+class ResourceError(Exception):
+    pass
+
+
+def compile_template(template):
+    # "Joyeux anniversaire {user} !" -> ("Joyeux anniversaire ", " !"), so that
+    # rendering is user.join(pieces). {user} is the only field allowed.
+    if not isinstance(template, str) or not template.strip():
+        raise ResourceError(f"message vide ou invalide : {template!r}")
+    pieces = [""]
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise ResourceError(f"message invalide ({e}) : {template!r}") from None
+    for literal, field, format_spec, conversion in parsed:
+        pieces[-1] += literal
+        if field is None:
+            continue
+        if field != "user" or format_spec or conversion:
+            raise ResourceError(
+                f"seul {{user}} est autorisé, sans format : {template!r}"
+            )
+        pieces.append("")
+    return tuple(pieces)
+
+
+def render(pieces, user):
+    return user.join(pieces)
+
+
+def validate_gif(url):
+    if not isinstance(url, str) or not url.startswith(("https://", "http://")):
+        raise ResourceError(f"URL de GIF invalide : {url!r}")
+    return url
+
+
+class ResourceSet:
+    # One validated, compiled version of the resource files.
+    __slots__ = ("version", "templates", "gifs")
+
+    def __init__(self, version, templates, gifs):
+        self.version = version
+        self.templates = templates
+        self.gifs = gifs
+
+
+def load_resource_set(messages_file, gifs_file, version):
+    messages = load_json(messages_file).get("BIRTHDAY_MESSAGES")
+    gifs = load_json(gifs_file).get("GIFS")
+    if not messages or not isinstance(messages, list):
+        raise ResourceError(f"{messages_file} : BIRTHDAY_MESSAGES vide ou absent")
+    if not gifs or not isinstance(gifs, list):
+        raise ResourceError(f"{gifs_file} : GIFS vide ou absent")
+    return ResourceSet(
+        version,
+        [compile_template(message) for message in messages],
+        [validate_gif(url) for url in gifs],
+    )
+
+
+class ShuffleBag:
+    # Indices 0..size-1 in a random order, refilled when empty. The first pick
+    # of a new cycle is never the last pick of the previous one.
+    __slots__ = ("version", "_remaining", "_last")
+
+    def __init__(self, version):
+        self.version = version
+        # array("H") keeps a bag at 2 bytes per entry for every guild.
+        self._remaining = array("H")
+        self._last = None
+
+    def draw(self, size, rng):
+        if not self._remaining:
+            indices = list(range(size))
+            rng.shuffle(indices)
+            # Drawn from the end: avoid starting with the previous pick.
+            if size > 1 and indices[-1] == self._last:
+                indices[0], indices[-1] = indices[-1], indices[0]
+            self._remaining = array("H", indices)
+        self._last = self._remaining.pop()
+        return self._last
+
+
+class ResourceManager:
+    def __init__(self, messages_file, gifs_file, poll_interval=POLL_INTERVAL):
+        self.messages_file = messages_file
+        self.gifs_file = gifs_file
+        self.poll_interval = poll_interval
+        self._rng = random.Random()
+        self._current = None
+        self._fingerprint = None
+        self._versions = 0
+        # { (guild_id, kind): ShuffleBag }
+        self._bags = {}
+        self._task = None
+
+    def _file_fingerprint(self):
+        fingerprint = []
+        for filename in (self.messages_file, self.gifs_file):
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                fingerprint.append(None)
+                continue
+            fingerprint.append((stat.st_mtime_ns, stat.st_size))
+        return fingerprint
+
+    def load(self):
+        # Initial load: a missing or invalid file is an error at startup.
+        self._fingerprint = self._file_fingerprint()
+        self._versions += 1
+        self._current = load_resource_set(
+            self.messages_file, self.gifs_file, self._versions
+        )
+
+    def reload_if_changed(self):
+        # Returns True if a new set was swapped in.
+        fingerprint = self._file_fingerprint()
+        if fingerprint == self._fingerprint:
+            return False
+        # Even an invalid edit is only reported once.
+        self._fingerprint = fingerprint
+        try:
+            resource_set = load_resource_set(
+                self.messages_file, self.gifs_file, self._versions + 1
+            )
+        except (ResourceError, OSError, ValueError) as e:
+            resource_reloads.inc("invalid")
+            print(f"Ressources invalides, les précédentes restent utilisées : {e}")
+            return False
+        self._versions += 1
+        self._current = resource_set
+        resource_reloads.inc("ok")
+        print(
+            f"Ressources rechargées : {len(resource_set.templates)} messages, "
+            f"{len(resource_set.gifs)} GIFs."
+        )
+        return True
+
+    def _draw(self, guild_id, kind, size):
+        key = (guild_id, kind)
+        bag = self._bags.get(key)
+        if bag is None or bag.version != self._current.version:
+            # New guild, or the resources changed: the old indices are stale.
+            bag = self._bags[key] = ShuffleBag(self._current.version)
+        return bag.draw(size, self._rng)
+
+    def pick(self, guild_id, user):
+        # (message text, GIF URL) for an announcement of `user` (a mention).
+        resource_set = self._current
+        template = resource_set.templates[
+            self._draw(guild_id, "message", len(resource_set.templates))
+        ]
+        gif_url = resource_set.gifs[self._draw(guild_id, "gif", len(resource_set.gifs))]
+        return render(template, user), gif_url
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                print(f"Erreur lors du rechargement des ressources : {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._watch())
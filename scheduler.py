@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Per-guild midnight scheduler.
+#
+# Every guild with an announcement channel has its next local midnight in a
+# min-heap. The scheduler sleeps until the earliest entry is due and only
+# wakes the guilds that are due, so guilds in different timezones are spread
+# across the day. Rescheduling a guild pushes a new entry with a new version;
+# stale heap entries are skipped when they reach the top.
+
+DEFAULT_TIMEZONE = "UTC"
+
+
+def get_timezone(name):
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"Fuseau horaire inconnu : {name}, utilisation de {DEFAULT_TIMEZONE}.")
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def local_midnight(tz, local_date):
+    # UTC timestamp of 00:00 on local_date in the given timezone.
+    midnight = datetime.datetime.combine(local_date, datetime.time(0), tzinfo=tz)
+    return midnight.timestamp()
+
+
+class GuildScheduler:
+    def __init__(self, callback):
+        # callback(due) is awaited with a list of (guild_id, local_date).
+        self.callback = callback
+        # (fire_at, guild_id, version, local_date)
+        self._heap = []
+        # { guild_id: (version, tz) } for the guilds currently scheduled.
+        self._guilds = {}
+        self._versions = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+
+    def _push(self, guild_id, version, tz, local_date):
+        fire_at = local_midnight(tz, local_date)
+        heapq.heappush(self._heap, (fire_at, guild_id, version, local_date))
+
+    def schedule(self, guild_id, timezone_name=None, last_date=None, now=None):
+        # last_date is the last local date already handled for the guild. If
+        # it is before the local today, today's midnight has passed without
+        # being handled (e.g. the guild just moved to a timezone ahead of its
+        # old one) and today is due at once; otherwise the next day is.
+        tz = get_timezone(timezone_name)
+        version = next(self._versions)
+        self._guilds[guild_id] = (version, tz)
+        now = datetime.datetime.fromtimestamp(
+            time.time() if now is None else now, datetime.timezone.utc
+        )
+        today = now.astimezone(tz).date()
+        if last_date is None:
+            local_date = today + datetime.timedelta(days=1)
+        else:
+            local_date = max(today, last_date + datetime.timedelta(days=1))
+        self._push(guild_id, version, tz, local_date)
+        self._wakeup.set()
+
+    def unschedule(self, guild_id):
+        # The guild's heap entry becomes stale and is dropped when popped.
+        self._guilds.pop(guild_id, None)
+
+    def guild_ids(self):
+        return list(self._guilds)
+
+    def _is_current(self, entry):
+        _, guild_id, version, _ = entry
+        current = self._guilds.get(guild_id)
+        return current is not None and current[0] == version
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+            _, guild_id, version, local_date = entry
+            due.append((guild_id, local_date))
+            _, tz = self._guilds[guild_id]
+            self._push(guild_id, version, tz, local_date + datetime.timedelta(days=1))
+        return due
+
+    async def _fire(self, due):
+        try:
+            await self.callback(due)
+        except Exception as e:
+            print(f"Erreur lors de la vérification des anniversaires : {e}")
+
+    async def _run(self):
+        while True:
+            # Drop stale entries so the head is always a live guild.
+            while self._heap and not self._is_current(self._heap[0]):
+                heapq.heappop(self._heap)
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = self._pop_due(time.time())
+            if due:
+                # Run in the background so a long run never delays the next
+                # guilds that become due.
+                task = asyncio.get_running_loop().create_task(self._fire(due))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def wait_idle(self):
+        # Waits for the runs already started, e.g. after stop().
+        if self._running:
+            await asyncio.wait(set(self._running))
@@ -0,0 +1,68 @@
+import resource
+
+# Shard ownership for multi-process deployments.
+#
+# Discord routes a guild to shard (guild_id >> 22) % shard_count. A process
+# started with SHARD_COUNT and SHARD_IDS only connects those shards, so it
+# only needs to load and schedule the guilds that hash to them.
+
+
+def parse_shard_ids(spec):
+    # "0-3,8" -> [0, 1, 2, 3, 8]
+    shard_ids = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = map(int, part.split("-"))
+            shard_ids.update(range(first, last + 1))
+        else:
+            shard_ids.add(int(part))
+    return sorted(shard_ids)
+
+
+def shard_for_guild(guild_id, shard_count):
+    return (int(guild_id) >> 22) % shard_count
+
+
+class ShardFilter:
+    def __init__(self, shard_count=None, shard_ids=None):
+        self.shard_count = shard_count
+        # None means every shard is handled by this process.
+        self.shard_ids = None
+        if shard_count and shard_ids is not None:
+            shard_ids = set(shard_ids)
+            if shard_ids != set(range(shard_count)):
+                self.shard_ids = shard_ids
+
+    @property
+    def is_partial(self):
+        return self.shard_ids is not None
+
+    def owns(self, guild_id):
+        if self.shard_ids is None:
+            return True
+        return shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+    def label(self):
+        # Names the files of this subset, e.g. "0,1_of_4". The shard count is
+        # part of it: the same shard IDs hold other guilds under another count.
+        if self.shard_ids is None:
+            return "all"
+        shard_ids = ",".join(map(str, sorted(self.shard_ids)))
+        return f"{shard_ids}_of_{self.shard_count}"
+
+
+def peak_rss_mb():
+    # VmHWM starts over when a process execs, unlike ru_maxrss, which keeps
+    # the peak of the parent that forked it (e.g. a supervisor or a harness
+    # that started each shard). Both are in kilobytes.
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,150 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+from array import array
+from compact_store import CompactBirthdays, GuildBirthdays
+from json_helper import keep_file_mode
+
+# Binary snapshot of the birthdays and the config, for fast restarts.
+#
+# Layout (native byte order; the snapshot is a local cache, never shipped):
+#   header     magic, version, checksum (CRC-32 of everything after the
+#              header), metadata length, guild count, registration count
+#   metadata   JSON: the source fingerprint, the shards and the config
+#   guild IDs  uint64 per guild
+#   counts     uint32 per guild (registrations in that guild)
+#   user IDs   uint64 per registration, grouped by guild, sorted
+#   codes      uint16 per registration (compact_store day-of-year codes)
+#
+# The file is memory-mapped and each guild's arrays are copied straight out
+# of it, without any parsing. The snapshot is only a cache of the real data
+# files: it records their size and mtime when it was written, and the shards
+# (sharding.ShardFilter.label) whose guilds it holds, and is ignored (the
+# caller falls back to JSON or SQLite) when either no longer matches.
+
+MAGIC = b"BDAYSNAP"
+VERSION = 1
+HEADER = struct.Struct("=8sHxxIIIQ")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def source_fingerprint(filenames):
+    # [name, size, mtime_ns] of each data file, None for missing ones.
+    fingerprint = []
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            fingerprint.append(None)
+            continue
+        fingerprint.append(
+            [os.path.basename(filename), stat.st_size, stat.st_mtime_ns]
+        )
+    return fingerprint
+
+
+def write_snapshot(filename, birthdays, config, source, shards="all"):
+    guild_ids = array("Q")
+    counts = array("I")
+    user_ids = array("Q")
+    codes = array("H")
+    for guild_id, guild_birthdays in birthdays.items():
+        guild_user_ids, guild_codes = guild_birthdays.arrays()
+        guild_ids.append(int(guild_id))
+        counts.append(len(guild_user_ids))
+        user_ids.extend(guild_user_ids)
+        codes.extend(guild_codes)
+    metadata = json.dumps(
+        {"source": source, "shards": shards, "config": config}
+    ).encode("utf-8")
+    body = [metadata, guild_ids, counts, user_ids, codes]
+    checksum = 0
+    for part in body:
+        checksum = zlib.crc32(part, checksum)
+    header = HEADER.pack(
+        MAGIC, VERSION, checksum, len(metadata), len(guild_ids), len(user_ids)
+    )
+    # Same pattern as save_json_atomic: a crash never leaves a partial file.
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            keep_file_mode(f.fileno(), filename)
+            f.write(header)
+            for part in body:
+                f.write(part)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _array(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def read_snapshot(filename, source, shards="all"):
+    # Returns (birthdays, config), or None when the snapshot is missing or was
+    # written from other data files or for other shards. Raises SnapshotError
+    # if it is corrupt.
+    try:
+        f = open(filename, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise SnapshotError(f"{filename} is truncated")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                return _decode(view, source, shards, filename)
+            finally:
+                view.release()
+
+
+def _decode(view, source, shards, filename):
+    magic, version, checksum, metadata_len, guild_count, total = HEADER.unpack_from(
+        view
+    )
+    if magic != MAGIC:
+        raise SnapshotError(f"{filename} is not a snapshot")
+    if version != VERSION:
+        # Written by another version of the bot: rebuilt from the data files.
+        return None
+    offset = HEADER.size
+    expected_size = offset + metadata_len + guild_count * 12 + total * 10
+    if len(view) != expected_size:
+        raise SnapshotError(f"{filename} is truncated")
+    if zlib.crc32(view[offset:]) != checksum:
+        raise SnapshotError(f"{filename} has a bad checksum")
+
+    metadata = json.loads(bytes(view[offset : offset + metadata_len]))
+    if metadata["source"] != source or metadata.get("shards", "all") != shards:
+        return None
+    offset += metadata_len
+    guild_ids = _array("Q", view[offset : offset + guild_count * 8])
+    offset += guild_count * 8
+    counts = _array("I", view[offset : offset + guild_count * 4])
+    offset += guild_count * 4
+    codes_offset = offset + total * 8
+
+    birthdays = CompactBirthdays()
+    for guild_id, count in zip(guild_ids, counts):
+        birthdays[str(guild_id)] = GuildBirthdays.from_arrays(
+            _array("Q", view[offset : offset + count * 8]),
+            _array("H", view[codes_offset : codes_offset + count * 2]),
+        )
+        offset += count * 8
+        codes_offset += count * 2
+    return birthdays, metadata["config"]
@@ -0,0 +1,414 @@
+import json
+import os
+import sqlite3
+import sys
+
+from birthday_index import parse_day_month
+from compact_store import CompactBirthdays, GuildBirthdays, encode_date
+from json_helper import load_json
+from persistence import WriteBehindPersister
+from snapshot import SnapshotError, read_snapshot, source_fingerprint, write_snapshot
+
+# Storage backends for the birthdays and the per-guild configuration.
+#
+# Every backend keeps an in-memory mirror of the data with the same layout the
+# bot has always used:
+#   birthdays: { guild_id: { user_id: "DD/MM", ... }, ... }
+#   config:    { guild_id: { "birthday_channel": channel_id, ... }, ... }
+# The handlers read from the mirror and go through the methods below to write,
+# so each backend decides how a single change is persisted. The birthdays
+# mirror is a CompactBirthdays, which behaves like the nested dict above.
+#
+# With a snapshot_file, the mirror is saved as a binary snapshot on close and
+# loaded from it on the next start, as long as the data files did not change
+# in between; otherwise the data files are read and the snapshot rebuilt.
+
+
+def _read_snapshot(storage, source):
+    # (birthdays, config) from the storage's snapshot, or None if unusable.
+    if storage.snapshot_file is None:
+        return None
+    try:
+        return read_snapshot(storage.snapshot_file, source, storage.shards)
+    except (SnapshotError, OSError, ValueError) as e:
+        print(f"Snapshot ignoré ({e}), chargement depuis les fichiers de données.")
+        return None
+
+
+def _write_snapshot(storage, source=None):
+    # source is the fingerprint of the data files the mirror was read from,
+    # taken before reading them: a write that lands during the load then
+    # makes the snapshot stale instead of hiding the write. By default the
+    # files are fingerprinted as they are now, e.g. once flushed on close.
+    if storage.snapshot_file is None:
+        return
+    if source is None:
+        source = source_fingerprint(storage.source_files)
+    try:
+        write_snapshot(
+            storage.snapshot_file,
+            storage.birthdays,
+            storage.config,
+            source,
+            storage.shards,
+        )
+    except (OSError, ValueError) as e:
+        print(f"Impossible d'écrire le snapshot {storage.snapshot_file} : {e}")
+
+
+def _prune_mirror(storage, guild_ids, members):
+    # Removes whole guilds and some members ({ guild_id: [user_id] }) from the
+    # mirror. Returns the number of (birthdays, config values) removed.
+    birthdays_removed = 0
+    config_removed = 0
+    for guild_id in guild_ids:
+        guild_birthdays = storage.birthdays.pop(guild_id, None)
+        if guild_birthdays is not None:
+            birthdays_removed += len(guild_birthdays)
+        config_removed += len(storage.config.pop(guild_id, {}))
+    for guild_id, user_ids in members.items():
+        guild_birthdays = storage.birthdays.get(guild_id)
+        if guild_birthdays is not None:
+            birthdays_removed += guild_birthdays.remove_many(map(int, user_ids))
+    return birthdays_removed, config_removed
+
+
+class JsonStorage:
+    # Original layout: two JSON files, written back in full. Writes go through
+    # a write-behind persister so bursts of changes cost a single rewrite.
+
+    def __init__(self, birthdays_file, config_file, delay=1.0, snapshot_file=None):
+        self.birthdays_file = birthdays_file
+        self.config_file = config_file
+        self.snapshot_file = snapshot_file
+        self.source_files = [birthdays_file, config_file]
+        # Always the whole data (see open_storage).
+        self.shards = "all"
+        # "snapshot" or "json" once loaded.
+        self.loaded_from = None
+        self.birthdays = CompactBirthdays()
+        self.config = {}
+        self.birthdays_persister = WriteBehindPersister(
+            birthdays_file,
+            lambda: self.birthdays.copy(),
+            delay,
+            encode=CompactBirthdays.to_dict,
+        )
+        self.config_persister = WriteBehindPersister(
+            config_file, lambda: _copy_nested(self.config), delay
+        )
+
+    def load(self):
+        source = source_fingerprint(self.source_files)
+        snapshot = _read_snapshot(self, source)
+        if snapshot is not None:
+            self.birthdays, self.config = snapshot
+            self.loaded_from = "snapshot"
+            return
+        self.birthdays = CompactBirthdays.from_dict(load_json(self.birthdays_file))
+        self.config = load_json(self.config_file)
+        self.loaded_from = "json"
+        _write_snapshot(self, source)
+
+    def set_birthday(self, guild_id, user_id, date):
+        self.birthdays.setdefault(guild_id, {})[user_id] = date
+        self.birthdays_persister.mark_dirty()
+
+    def set_birthdays(self, guild_id, entries):
+        # Bulk version of set_birthday for (user_id, date) pairs: a single
+        # rewrite of the file however many entries there are.
+        self.birthdays.setdefault(guild_id, {}).merge(
+            (int(user_id), encode_date(date)) for user_id, date in entries
+        )
+        self.birthdays_persister.mark_dirty()
+
+    def set_config_value(self, guild_id, key, value):
+        self.config.setdefault(guild_id, {})[key] = value
+        self.config_persister.mark_dirty()
+
+    def remove_config_value(self, guild_id, key):
+        if key in self.config.get(guild_id, {}):
+            del self.config[guild_id][key]
+            self.config_persister.mark_dirty()
+
+    def prune(self, guild_ids, members):
+        # Removes whole guilds and some members ({ guild_id: [user_id] }) at
+        # once: a single rewrite of each file.
+        birthdays_removed, config_removed = _prune_mirror(self, guild_ids, members)
+        if birthdays_removed:
+            self.birthdays_persister.mark_dirty()
+        if config_removed:
+            self.config_persister.mark_dirty()
+        return birthdays_removed, config_removed
+
+    def close(self):
+        self.birthdays_persister.flush()
+        self.config_persister.flush()
+        _write_snapshot(self)
+
+    def discard(self):
+        # Dropped for a storage reloaded from disk: nothing is written back.
+        pass
+
+
+def _copy_nested(data):
+    # { guild_id: { ... } } -> copy deep enough to be serialized off the loop.
+    return {guild_id: dict(values) for guild_id, values in data.items()}
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS birthdays (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    month INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_birthdays_user ON birthdays (user_id);
+CREATE INDEX IF NOT EXISTS idx_birthdays_month_day ON birthdays (month, day);
+
+CREATE TABLE IF NOT EXISTS config (
+    guild_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (guild_id, key)
+);
+"""
+
+
+def connect_sqlite(db_file):
+    # The data may be loaded in a worker thread and then used from the event
+    # loop; the connection is never used from two threads at once.
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    # WAL keeps readers unblocked and makes each commit an append to the log.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class SqliteStorage:
+    # One row per birthday and per config key; every change is a single-row
+    # upsert or delete in its own transaction.
+
+    def __init__(self, db_file, snapshot_file=None):
+        self.db_file = db_file
+        self.snapshot_file = snapshot_file
+        self.source_files = [db_file, db_file + "-wal"]
+        # Label of the shards loaded (sharding.ShardFilter.label).
+        self.shards = "all"
+        # "snapshot" or "sqlite" once loaded.
+        self.loaded_from = None
+        self.conn = None
+        self.birthdays = CompactBirthdays()
+        self.config = {}
+
+    def load(self, owns=None, shards="all"):
+        # owns(guild_id) restricts the mirror to the guilds of this process
+        # when the bot is split across several processes, and shards labels
+        # that subset; the snapshot file must then be specific to it.
+        # The snapshot is checked before connecting, which touches the WAL.
+        self.shards = shards
+        source = source_fingerprint(self.source_files)
+        snapshot = _read_snapshot(self, source)
+        self.conn = connect_sqlite(self.db_file)
+        if snapshot is not None:
+            self.birthdays, self.config = snapshot
+            self.loaded_from = "snapshot"
+            return
+        owned = {}
+
+        def is_owned(guild_id):
+            if owns is None:
+                return True
+            if guild_id not in owned:
+                owned[guild_id] = owns(guild_id)
+            return owned[guild_id]
+
+        # Rows come grouped by guild (primary key order); each guild is built
+        # in bulk rather than by one sorted insert per row.
+        pairs_by_guild = {}
+        for guild_id, user_id, date in self.conn.execute(
+            "SELECT guild_id, user_id, date FROM birthdays ORDER BY guild_id"
+        ):
+            if is_owned(guild_id):
+                pairs_by_guild.setdefault(guild_id, []).append(
+                    (int(user_id), encode_date(date))
+                )
+        self.birthdays = CompactBirthdays()
+        for guild_id, pairs in pairs_by_guild.items():
+            self.birthdays[guild_id] = GuildBirthdays.from_pairs(pairs)
+        self.config = {}
+        for guild_id, key, value in self.conn.execute(
+            "SELECT guild_id, key, value FROM config"
+        ):
+            if is_owned(guild_id):
+                self.config.setdefault(guild_id, {})[key] = json.loads(value)
+        self.loaded_from = "sqlite"
+        _write_snapshot(self, source)
+
+    def set_birthday(self, guild_id, user_id, date):
+        month, day = parse_day_month(date)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO birthdays (guild_id, user_id, date, month, day) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, user_id) DO UPDATE SET "
+                "date = excluded.date, month = excluded.month, day = excluded.day",
+                (guild_id, user_id, date, month, day),
+            )
+        self.birthdays.setdefault(guild_id, {})[user_id] = date
+
+    def set_birthdays(self, guild_id, entries):
+        # Bulk version of set_birthday for (user_id, date) pairs, in a single
+        # transaction.
+        entries = list(entries)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO birthdays (guild_id, user_id, date, month, day) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, user_id) DO UPDATE SET "
+                "date = excluded.date, month = excluded.month, day = excluded.day",
+                (
+                    (guild_id, user_id, date, *parse_day_month(date))
+                    for user_id, date in entries
+                ),
+            )
+        self.birthdays.setdefault(guild_id, {}).merge(
+            (int(user_id), encode_date(date)) for user_id, date in entries
+        )
+
+    def set_config_value(self, guild_id, key, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO config (guild_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, key) DO UPDATE SET value = excluded.value",
+                (guild_id, key, json.dumps(value)),
+            )
+        self.config.setdefault(guild_id, {})[key] = value
+
+    def remove_config_value(self, guild_id, key):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM config WHERE guild_id = ? AND key = ?", (guild_id, key)
+            )
+        self.config.get(guild_id, {}).pop(key, None)
+
+    def prune(self, guild_ids, members):
+        # Removes whole guilds and some members ({ guild_id: [user_id] }) in a
+        # single transaction.
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM birthdays WHERE guild_id = ?",
+                ((guild_id,) for guild_id in guild_ids),
+            )
+            self.conn.executemany(
+                "DELETE FROM config WHERE guild_id = ?",
+                ((guild_id,) for guild_id in guild_ids),
+            )
+            self.conn.executemany(
+                "DELETE FROM birthdays WHERE guild_id = ? AND user_id = ?",
+                (
+                    (guild_id, user_id)
+                    for guild_id, user_ids in members.items()
+                    for user_id in user_ids
+                ),
+            )
+        return _prune_mirror(self, guild_ids, members)
+
+    def close(self):
+        if self.conn is not None:
+            # Closing the last connection checkpoints the WAL: the snapshot is
+            # fingerprinted against the files as they are left on disk.
+            self.conn.close()
+            self.conn = None
+            _write_snapshot(self)
+
+    def discard(self):
+        # Dropped for a storage reloaded from disk: nothing is written back.
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# ========================== Migration ==========================
+
+
+def migrate_json_to_sqlite(birthdays_file, config_file, db_file):
+    # Copy the JSON files into the database in a single transaction.
+    # The JSON files are left untouched so a rollback stays possible.
+    birthdays = load_json(birthdays_file)
+    config = load_json(config_file)
+    conn = connect_sqlite(db_file)
+    migrated = 0
+    try:
+        with conn:
+            for guild_id, guild_birthdays in birthdays.items():
+                for user_id, date in guild_birthdays.items():
+                    try:
+                        month, day = parse_day_month(date)
+                    except ValueError:
+                        print(
+                            f"Date invalide ignorée pour l'utilisateur {user_id} "
+                            f"sur le serveur {guild_id} : {date}"
+                        )
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO birthdays "
+                        "(guild_id, user_id, date, month, day) VALUES (?, ?, ?, ?, ?)",
+                        (guild_id, user_id, date, month, day),
+                    )
+                    migrated += 1
+            for guild_id, guild_config in config.items():
+                for key, value in guild_config.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO config (guild_id, key, value) "
+                        "VALUES (?, ?, ?)",
+                        (guild_id, key, json.dumps(value)),
+                    )
+    finally:
+        conn.close()
+    return migrated
+
+
+def open_storage(backend, data_dir, owns=None, snapshot_file=None, shards="all"):
+    birthdays_file = os.path.join(data_dir, "birthdays.json")
+    config_file = os.path.join(data_dir, "config.json")
+    if backend == "json":
+        if owns is not None:
+            # Each process would rewrite the whole file with only its guilds.
+            raise ValueError(
+                "Running a subset of the shards requires the sqlite backend"
+            )
+        storage = JsonStorage(birthdays_file, config_file, snapshot_file=snapshot_file)
+    elif backend == "sqlite":
+        db_file = os.path.join(data_dir, "birthdays.db")
+        # One-shot migration the first time the SQLite backend is used.
+        if not os.path.exists(db_file) and (
+            os.path.exists(birthdays_file) or os.path.exists(config_file)
+        ):
+            migrated = migrate_json_to_sqlite(birthdays_file, config_file, db_file)
+            print(f"{migrated} anniversaires migrés vers {db_file}.")
+        storage = SqliteStorage(db_file, snapshot_file=snapshot_file)
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    if owns is None:
+        storage.load()
+    else:
+        storage.load(owns=owns, shards=shards)
+    return storage
+
+
+if __name__ == "__main__":
+    # Usage: python storage.py migrate [data_dir]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python storage.py migrate [data_dir]")
+        sys.exit(1)
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else "data"
+    migrated = migrate_json_to_sqlite(
+        os.path.join(data_dir, "birthdays.json"),
+        os.path.join(data_dir, "config.json"),
+        os.path.join(data_dir, "birthdays.db"),
+    )
+    print(f"{migrated} anniversaires migrés.")
@@ -0,0 +1,28 @@
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def bot_module(tmp_path_factory):
+    # bot.py reads DATA_DIR and its resources (relative to the working
+    # directory) when it is imported, so it is imported once for the session
+    # against an empty data directory. Tests swap the pieces they use.
+    os.environ["DATA_DIR"] = str(tmp_path_factory.mktemp("data"))
+    os.environ["STORAGE_BACKEND"] = "json"
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        module = importlib.import_module("bot")
+        asyncio.run(module.load_data())
+    finally:
+        os.chdir(cwd)
+    yield module
+    module.storage.close()
+    module.ledger.close()
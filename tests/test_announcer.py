@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from announcer import AnnouncementDispatcher
+from benchmark import FakeChannel, FakeTransport
+
+LATENCY = 0.01
+
+
+async def busy_guild(dispatcher, channel, messages):
+    # More messages than the channel's limit, all queued at once.
+    await asyncio.gather(
+        *(
+            dispatcher.call("messages", channel.id, channel.send)
+            for _ in range(messages)
+        )
+    )
+
+
+async def idle_guild(dispatcher, channel, finished):
+    # Arrives once the busy channels have used up their tokens.
+    await asyncio.sleep(0.1)
+    started_at = time.monotonic()
+    await dispatcher.call("messages", channel.id, channel.send)
+    finished.append(time.monotonic() - started_at)
+
+
+def test_channel_at_its_limit_does_not_hold_up_other_guilds():
+    transport = FakeTransport(latency=LATENCY)
+    dispatcher = AnnouncementDispatcher()
+    finished = []
+
+    async def run():
+        jobs = {
+            str(index): busy_guild(dispatcher, FakeChannel(index, None, transport), 12)
+            for index in range(10)
+        }
+        idle_channel = FakeChannel(99, None, transport)
+        jobs["idle"] = idle_guild(dispatcher, idle_channel, finished)
+        return await dispatcher.run(jobs)
+
+    stats = asyncio.run(run())
+    # The busy calls waiting for their channel's tokens (one per second) do
+    # not hold the semaphore, so the idle guild's call goes straight through.
+    assert finished[0] < 0.3
+    assert stats.api_calls == 121
+    assert transport.calls["messages"] == 121
+
+
+def test_overlapping_runs_count_their_own_calls():
+    transport = FakeTransport(latency=LATENCY)
+    dispatcher = AnnouncementDispatcher()
+
+    async def run():
+        first = dispatcher.run(
+            {"a": busy_guild(dispatcher, FakeChannel(1, None, transport), 3)}
+        )
+        second = dispatcher.run(
+            {"b": busy_guild(dispatcher, FakeChannel(2, None, transport), 2)}
+        )
+        return await asyncio.gather(first, second)
+
+    first, second = asyncio.run(run())
+    assert first.api_calls == 3
+    assert second.api_calls == 2
@@ -0,0 +1,80 @@
+import calendar
+import datetime
+import random
+
+from birthday_index import BirthdayIndex, upcoming_birthdays
+from compact_store import CODE_TO_MONTH_DAY, CompactBirthdays, GuildBirthdays
+
+
+def random_guild(rng, size):
+    return GuildBirthdays.from_pairs(
+        {rng.randrange(10**18): rng.randrange(1, 367) for _ in range(size)}.items()
+    )
+
+
+def naive_upcoming(guild, today, days):
+    upcoming = []
+    for user_id, code in guild.packed_items():
+        month, day = CODE_TO_MONTH_DAY[code]
+        for year in (today.year, today.year + 1):
+            if (month, day) == (2, 29) and not calendar.isleap(year):
+                continue
+            date = datetime.date(year, month, day)
+            delta = (date - today).days
+            if 0 <= delta < days:
+                upcoming.append((delta, date, user_id))
+    return sorted(upcoming)
+
+
+def test_upcoming_matches_naive_scan():
+    rng = random.Random(2)
+    guild = random_guild(rng, 800)
+    for today in (
+        datetime.date(2026, 1, 1),
+        datetime.date(2027, 12, 31),
+        datetime.date(2027, 2, 28),
+        datetime.date(2028, 2, 29),
+        datetime.date(2026, 7, 14),
+    ):
+        for days in (1, 7, 60, 365):
+            expected = naive_upcoming(guild, today, days)
+            assert upcoming_birthdays(guild, today, days) == expected
+            assert upcoming_birthdays(guild, today, days, limit=5) == expected[:5]
+
+
+def test_index_matches_naive_scan():
+    rng = random.Random(3)
+    birthdays = CompactBirthdays()
+    for guild_id in range(1, 30):
+        birthdays[str(guild_id)] = random_guild(rng, rng.randrange(40))
+    index = BirthdayIndex.from_birthdays(birthdays)
+
+    def check():
+        assert len(index) == sum(map(len, birthdays.values()))
+        for month, day in ((1, 1), (2, 29), (6, 15), (12, 31)):
+            count = 0
+            for guild_id, guild in birthdays.items():
+                expected = [
+                    str(user_id)
+                    for user_id, code in guild.packed_items()
+                    if CODE_TO_MONTH_DAY[code] == (month, day)
+                ]
+                assert index.users_on(guild_id, month, day) == expected
+                count += len(expected)
+            assert index.count_on(month, day) == count
+
+    check()
+    for _ in range(300):
+        guild_id = str(rng.randrange(1, 30))
+        guild = birthdays[guild_id]
+        user_id = str(rng.choice([*guild, "5"]) if guild else "5")
+        date = rng.choice(["01/01", "29/02", "15/06", "31/12"])
+        index.add(guild_id, user_id, date, previous=guild.get(user_id))
+        guild[user_id] = date
+    check()
+    birthdays["7"] = random_guild(rng, 50)
+    index.set_guild("7", birthdays["7"])
+    index.remove_guild("8")
+    birthdays["8"] = GuildBirthdays()
+    check()
+    assert index.users_on("1", 2, 30) == []
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from bulk_io import BulkImportError, CsvRowParser, ImportResult, JsonRowParser
+
+CSV = (
+    "\ufeffuser_id,date\r\n"
+    "1,01/01\r\n"
+    "\n"
+    "2,\"29/02\"\n"
+    "3,31/02\n"
+    "x,01/01\n"
+    "4,1/5,extra\n"
+    "2,15/06\n"
+    "5,é\n"
+    "6,31/12"
+)
+JSON_OBJECT = json.dumps(
+    {"1": "01/01", "2": "29/02", "3": "31/02", "x": "01/01", "4": 12, "2 ": "15/06"},
+    indent=1,
+)
+JSON_LIST = json.dumps(
+    [
+        {"user_id": 1, "date": "01/01"},
+        {"user_id": "2", "date": "29/02"},
+        [1, 2],
+        {"user_id": 18446744073709551616, "date": "01/01"},
+        {"user_id": "3", "date": "1/5"},
+    ]
+)
+
+
+def parse(parser_class, data, chunk_size):
+    result = ImportResult()
+    parser = parser_class(result)
+    for i in range(0, len(data), chunk_size):
+        parser.feed(data[i : i + chunk_size])
+    parser.close()
+    return result
+
+
+@pytest.mark.parametrize(
+    "parser_class, text",
+    [
+        (CsvRowParser, CSV),
+        (JsonRowParser, JSON_OBJECT),
+        (JsonRowParser, JSON_LIST),
+    ],
+)
+def test_small_chunks_match_one_shot(parser_class, text):
+    data = ("\ufeff" + text if parser_class is JsonRowParser else text).encode()
+    whole = parse(parser_class, data, len(data))
+    assert whole.entries
+    assert whole.rejected
+    for chunk_size in (1, 2, 3, 7):
+        result = parse(parser_class, data, chunk_size)
+        assert result.entries == whole.entries
+        assert result.rows == whole.rows
+        assert result.rejected == whole.rejected
+
+
+def test_csv_rows():
+    result = parse(CsvRowParser, CSV.encode(), 1)
+    assert result.entries == {"1": "01/01", "2": "15/06", "6": "31/12"}
+    assert [row for row, _ in result.rejected] == [5, 6, 7, 9]
+
+
+def test_json_numbers_split_across_chunks():
+    data = b'[{"user_id": 123456789012, "date": "01/01"}]'
+    assert parse(JsonRowParser, data, 1).entries == {"123456789012": "01/01"}
+
+
+@pytest.mark.parametrize(
+    "data", [b'{"1": "01/01"', b'"text"', b'{"1" "01/01"}', b"[1] 2", b"{,}"]
+)
+def test_invalid_json(data):
+    for chunk_size in (1, len(data)):
+        with pytest.raises(BulkImportError):
+            parse(JsonRowParser, data, chunk_size)
@@ -0,0 +1,43 @@
+import random
+
+from compact_store import CODE_TO_STR, GuildBirthdays, encode_date
+
+
+def day_order(guild):
+    return sorted((code, user_id) for user_id, code in guild.packed_items())
+
+
+def test_writes_keep_day_order_consistent():
+    rng = random.Random(1)
+    guild = GuildBirthdays()
+    expected = {}
+    # Builds the day order first so every write has to update it.
+    assert list(guild.between(1, 366)) == []
+    for _ in range(2000):
+        user_id = rng.randrange(300)
+        if user_id in expected and rng.random() < 0.3:
+            del guild[str(user_id)]
+            del expected[user_id]
+        else:
+            date = CODE_TO_STR[rng.randrange(1, 367)]
+            guild[str(user_id)] = date
+            expected[user_id] = encode_date(date)
+        assert list(guild.between(1, 366)) == day_order(guild)
+    assert dict(guild.packed_items()) == expected
+
+
+def test_bulk_writes_rebuild_day_order():
+    guild = GuildBirthdays.from_pairs([(3, 10), (1, 10), (2, 5)])
+    assert list(guild.between(1, 366)) == [(5, 2), (10, 1), (10, 3)]
+    guild.merge([(4, 5), (1, 20)])
+    assert list(guild.between(1, 366)) == [(5, 2), (5, 4), (10, 3), (20, 1)]
+    assert guild.remove_many([2, 3, 99]) == 2
+    assert list(guild.between(1, 366)) == [(5, 4), (20, 1)]
+    assert list(guild.between(6, 20)) == [(20, 1)]
+
+
+def test_unpadded_dates():
+    guild = GuildBirthdays()
+    guild["7"] = "1/5"
+    assert guild["7"] == "01/05"
+    assert "7" in guild and "8" not in guild and "x" not in guild
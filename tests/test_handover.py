@@ -0,0 +1,33 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_new_instance_takes_over_without_overlap(tmp_path):
+    # An old and a new instance in two processes, with the benchmark's fake
+    # gateway; the bot joins a guild while the new one waits for the lease.
+    output = tmp_path / "handover.json"
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(ROOT, "benchmark.py"),
+            "--handover",
+            "--guilds",
+            "50",
+            "--output",
+            str(output),
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        cwd=ROOT,
+        timeout=300,
+    )
+    with open(output, encoding="utf-8") as f:
+        run = json.load(f)["handover"][0]
+    assert run["lease_overlap_s"] == 0
+    assert run["scheduler_overlap_s"] == 0
+    assert run["late_write_seen"]
+    assert run["missing_commands"] == 0
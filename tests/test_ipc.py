@@ -0,0 +1,45 @@
+import asyncio
+import json
+
+import ipc
+
+from ipc import EventPublisher
+
+
+async def read_lines(reader, count):
+    return [json.loads(await reader.readline()) for _ in range(count)]
+
+
+def test_every_reconnect_asks_for_a_reload(monkeypatch, tmp_path):
+    monkeypatch.setattr(ipc, "RECONNECT_DELAY", 0.01)
+    socket_path = str(tmp_path / "worker.sock")
+    connections = asyncio.Queue()
+
+    async def accept(reader, writer):
+        await connections.put((reader, writer))
+
+    async def run():
+        server = await asyncio.start_unix_server(accept, socket_path)
+        publisher = EventPublisher(socket_path)
+        publisher.publish({"op": "first"})
+        publisher.start()
+        reader, writer = await connections.get()
+        first = await read_lines(reader, 2)
+        # The worker restarts: whatever is written now is lost with it.
+        writer.close()
+        await writer.wait_closed()
+        for index in range(50):
+            publisher.publish({"op": "lost", "index": index})
+            await asyncio.sleep(0.01)
+            if not connections.empty():
+                break
+        reader, writer = await asyncio.wait_for(connections.get(), 5)
+        second = await read_lines(reader, 1)
+        publisher._task.cancel()
+        writer.close()
+        server.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert [event["op"] for event in first] == ["reload", "first"]
+    assert second == [{"op": "reload"}]
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+
+import pytest
+
+from announcer import AnnouncementDispatcher
+from benchmark import FakeClient, FakeMessage, FakeTransport
+from birthday_index import BirthdayIndex
+from compact_store import CompactBirthdays
+from ledger import DONE, POSTED, AnnouncementLedger
+
+GUILD_ID = "1000"
+CHANNEL_ID = 2000
+USER_ID = "3000"
+
+
+@pytest.fixture
+def transport(bot_module, monkeypatch, tmp_path):
+    # One guild with an announcement channel, behind the fake transport, and
+    # a ledger of its own.
+    config = {GUILD_ID: {"birthday_channel": CHANNEL_ID}}
+    transport = FakeTransport(latency=0)
+    client = FakeClient(transport, config)
+    monkeypatch.setattr(bot_module, "config", config)
+    monkeypatch.setattr(bot_module, "dispatcher", AnnouncementDispatcher())
+    monkeypatch.setattr(bot_module.bot, "get_channel", client.get_channel)
+    monkeypatch.setattr(bot_module.bot, "fetch_channel", client.fetch_channel)
+    monkeypatch.setattr(bot_module.user_resolver, "client", client)
+    ledger = AnnouncementLedger(str(tmp_path / "announcements.db"))
+    monkeypatch.setattr(bot_module, "ledger", ledger)
+    yield transport
+    bot_module.ledger.close()
+
+
+def restart(bot_module, tmp_path, monkeypatch):
+    # A new process only has what the ledger wrote to disk.
+    bot_module.ledger.close()
+    ledger = AnnouncementLedger(str(tmp_path / "announcements.db"))
+    monkeypatch.setattr(bot_module, "ledger", ledger)
+    return ledger
+
+
+def set_birthdays(bot_module, monkeypatch, data):
+    birthdays = CompactBirthdays.from_dict(data)
+    monkeypatch.setattr(bot_module, "birthdays", birthdays)
+    monkeypatch.setattr(
+        bot_module, "birthday_index", BirthdayIndex.from_birthdays(birthdays)
+    )
+
+
+def statuses(ledger):
+    return [
+        status for (status,) in ledger.conn.execute("SELECT status FROM announcements")
+    ]
+
+
+def test_failed_thread_resumes_without_second_message(
+    bot_module, transport, monkeypatch, tmp_path
+):
+    today = datetime.date.today()
+    bot_module.ledger.enqueue_many([(GUILD_ID, today, [USER_ID])])
+    create_thread = FakeMessage.create_thread
+
+    async def failing_create_thread(self, **kwargs):
+        await self.transport.request("threads")
+        raise RuntimeError("crash")
+
+    monkeypatch.setattr(FakeMessage, "create_thread", failing_create_thread)
+    asyncio.run(bot_module.run_announcements([GUILD_ID], today))
+    assert statuses(bot_module.ledger) == [POSTED]
+    assert transport.calls["messages"] == 1
+
+    monkeypatch.setattr(FakeMessage, "create_thread", create_thread)
+    ledger = restart(bot_module, tmp_path, monkeypatch)
+    asyncio.run(bot_module.run_announcements([GUILD_ID], today))
+    assert statuses(ledger) == [DONE]
+    # The message sent before the crash is reused, not sent again.
+    assert transport.calls["messages"] == 1
+    assert transport.calls["fetch_message"] == 1
+    assert transport.calls["threads"] == 2
+    assert transport.calls["thread_messages"] == 1
+
+    asyncio.run(bot_module.run_announcements([GUILD_ID], today))
+    assert transport.calls["thread_messages"] == 1
+
+
+def test_catch_up_replays_skipped_day(bot_module, transport, monkeypatch):
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    yesterday = today - datetime.timedelta(days=1)
+    later = today + datetime.timedelta(days=10)
+    set_birthdays(
+        bot_module,
+        monkeypatch,
+        {
+            GUILD_ID: {
+                USER_ID: yesterday.strftime("%d/%m"),
+                "3001": later.strftime("%d/%m"),
+            }
+        },
+    )
+    # The bot was down over yesterday's midnight.
+    last_run = today - datetime.timedelta(days=2)
+    bot_module.ledger.enqueue_many([(GUILD_ID, last_run, [])])
+    bot_module.enqueue_missed_days()
+    asyncio.run(bot_module.catch_up_announcements())
+    rows = list(
+        bot_module.ledger.conn.execute(
+            "SELECT user_id, date, status FROM announcements"
+        )
+    )
+    assert rows == [(USER_ID, yesterday.isoformat(), DONE)]
+    assert bot_module.ledger.last_run_dates() == {GUILD_ID: today}
+    assert transport.calls["messages"] == 1
+
+    # Another restart finds nothing left to send.
+    bot_module.enqueue_missed_days()
+    asyncio.run(bot_module.catch_up_announcements())
+    assert transport.calls["messages"] == 1
+
+
+def test_catch_up_replays_oldest_day_behind_utc(bot_module, transport, monkeypatch):
+    # Before noon UTC, a guild at UTC-12 is still on the day before, so its
+    # oldest missed day is older than the UTC window.
+    bot_module.config[GUILD_ID]["timezone"] = "Etc/GMT+12"
+    today = bot_module.guild_today(GUILD_ID)
+    oldest = today - datetime.timedelta(days=bot_module.CATCHUP_DAYS)
+    set_birthdays(
+        bot_module, monkeypatch, {GUILD_ID: {USER_ID: oldest.strftime("%d/%m")}}
+    )
+    # The bot was down for days.
+    last_run = today - datetime.timedelta(days=5)
+    bot_module.ledger.enqueue_many([(GUILD_ID, last_run, [])])
+    bot_module.enqueue_missed_days()
+    asyncio.run(bot_module.catch_up_announcements())
+    assert statuses(bot_module.ledger) == [DONE]
+    assert transport.calls["messages"] == 1
@@ -0,0 +1,38 @@
+from pruning import PendingRemovals
+
+DAY = 86400
+
+
+def removals(tmp_path):
+    pending = PendingRemovals(str(tmp_path / "removals.json"))
+    pending.guild_left("1", now=1 * DAY)
+    pending.guild_left("2", now=5 * DAY)
+    pending.member_left("1", "10", now=1 * DAY)
+    pending.member_left("3", "30", now=1 * DAY)
+    pending.member_left("3", "31", now=2 * DAY)
+    pending.member_left("3", "32", now=6 * DAY)
+    return pending
+
+
+def test_due_respects_grace_and_limit(tmp_path):
+    pending = removals(tmp_path)
+    assert pending.due(4 * DAY, grace=2 * DAY) == (
+        ["1"],
+        {"1": ["10"], "3": ["30", "31"]},
+    )
+    assert pending.due(4 * DAY, grace=2 * DAY, limit=2) == (["1"], {"1": ["10"]})
+    assert pending.due(DAY, grace=2 * DAY) == ([], {})
+    # Seeing a departure again does not restart the wait; coming back cancels it.
+    pending.guild_left("1", now=4 * DAY)
+    pending.member_joined("3", "31")
+    assert pending.due(4 * DAY, grace=2 * DAY) == (["1"], {"1": ["10"], "3": ["30"]})
+
+
+def test_done_forgets_guilds_and_their_members(tmp_path):
+    pending = removals(tmp_path)
+    guild_ids, members = pending.due(4 * DAY, grace=2 * DAY)
+    pending.done(guild_ids, members)
+    assert pending.guilds == {"2": 5 * DAY}
+    assert pending.members == {"3": {"32": 6 * DAY}}
+    pending.done(["2"], {"3": ["32"], "9": ["90"]})
+    assert pending.guilds == {} and pending.members == {}
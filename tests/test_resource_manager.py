@@ -0,0 +1,15 @@
+import random
+
+from resource_manager import ShuffleBag
+
+
+def test_shuffle_bag_cycles():
+    rng = random.Random(4)
+    for size in (1, 2, 3, 10):
+        bag = ShuffleBag(version=1)
+        picks = [bag.draw(size, rng) for _ in range(size * 50)]
+        for start in range(0, len(picks), size):
+            assert sorted(picks[start : start + size]) == list(range(size))
+        if size > 1:
+            # No pick repeats the previous one, across cycles included.
+            assert all(a != b for a, b in zip(picks, picks[1:]))
@@ -0,0 +1,73 @@
+import datetime
+
+from scheduler import GuildScheduler
+
+UTC = datetime.timezone.utc
+
+
+def timestamp(*args):
+    return datetime.datetime(*args, tzinfo=UTC).timestamp()
+
+
+def test_new_guild_starts_tomorrow():
+    scheduler = GuildScheduler(None)
+    now = timestamp(2026, 3, 10, 11)
+    scheduler.schedule("1", "UTC", now=now)
+    assert scheduler._pop_due(now) == []
+    assert scheduler._pop_due(timestamp(2026, 3, 11)) == [
+        ("1", datetime.date(2026, 3, 11))
+    ]
+
+
+def test_timezone_ahead_does_not_skip_today():
+    # At 11:00 UTC the guild's UTC day (10/03) was handled, and it is already
+    # 01:00 on 11/03 in Kiritimati (UTC+14): that day is due at once.
+    scheduler = GuildScheduler(None)
+    now = timestamp(2026, 3, 10, 11)
+    scheduler.schedule(
+        "1", "Pacific/Kiritimati", last_date=datetime.date(2026, 3, 10), now=now
+    )
+    assert scheduler._pop_due(now) == [("1", datetime.date(2026, 3, 11))]
+
+
+def test_timezone_behind_does_not_repeat_a_day():
+    # Back from Kiritimati to UTC: 11/03 was handled there, so the next UTC
+    # midnight to fire is that of 12/03.
+    scheduler = GuildScheduler(None)
+    now = timestamp(2026, 3, 10, 11)
+    scheduler.schedule("1", "UTC", last_date=datetime.date(2026, 3, 11), now=now)
+    assert scheduler._pop_due(timestamp(2026, 3, 11, 12)) == []
+    assert scheduler._pop_due(timestamp(2026, 3, 12)) == [
+        ("1", datetime.date(2026, 3, 12))
+    ]
+
+
+def test_pop_due_skips_stale_entries():
+    scheduler = GuildScheduler(None)
+    now = timestamp(2026, 3, 10, 11)
+    for guild_id in ("1", "2", "3"):
+        scheduler.schedule(guild_id, "UTC", now=now)
+    scheduler.unschedule("2")
+    # Rescheduled in another timezone: only the new entry fires.
+    scheduler.schedule("3", "Pacific/Kiritimati", now=now)
+    assert scheduler._pop_due(timestamp(2026, 3, 11)) == [
+        ("1", datetime.date(2026, 3, 11))
+    ]
+    assert scheduler._pop_due(timestamp(2026, 3, 11, 12)) == [
+        ("3", datetime.date(2026, 3, 12))
+    ]
+    assert scheduler.guild_ids() == ["1", "3"]
+
+
+def test_pop_due_pushes_the_next_day():
+    scheduler = GuildScheduler(None)
+    now = timestamp(2026, 3, 10, 11)
+    scheduler.schedule("1", "UTC", now=now)
+    # A late wakeup catches up one day at a time, never the same day twice.
+    assert scheduler._pop_due(timestamp(2026, 3, 13, 1)) == [
+        ("1", datetime.date(2026, 3, 11)),
+        ("1", datetime.date(2026, 3, 12)),
+        ("1", datetime.date(2026, 3, 13)),
+    ]
+    assert scheduler._pop_due(timestamp(2026, 3, 13, 23)) == []
+    assert [entry[3] for entry in scheduler._heap] == [datetime.date(2026, 3, 14)]
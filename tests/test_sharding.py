@@ -0,0 +1,27 @@
+from compact_store import CompactBirthdays
+from sharding import ShardFilter, parse_shard_ids, shard_for_guild
+from snapshot import read_snapshot, write_snapshot
+
+
+def test_label_includes_shard_count():
+    assert ShardFilter().label() == "all"
+    assert ShardFilter(4, range(4)).label() == "all"
+    assert ShardFilter(4, [1, 0]).label() == "0,1_of_4"
+    assert ShardFilter(8, [0, 1]).label() != ShardFilter(4, [0, 1]).label()
+
+
+def test_owns_only_its_shards():
+    shards = ShardFilter(4, parse_shard_ids("1-2"))
+    guild_ids = [str(index << 22) for index in range(8)]
+    assert [shards.owns(guild_id) for guild_id in guild_ids] == [
+        shard_for_guild(guild_id, 4) in (1, 2) for guild_id in guild_ids
+    ]
+
+
+def test_snapshot_of_other_shards_is_ignored(tmp_path):
+    filename = str(tmp_path / "snapshot.bin")
+    birthdays = CompactBirthdays.from_dict({"1": {"2": "01/01"}})
+    write_snapshot(filename, birthdays, {}, ["source"], "0_of_4")
+    assert read_snapshot(filename, ["source"], "0_of_8") is None
+    loaded, config = read_snapshot(filename, ["source"], "0_of_4")
+    assert loaded.to_dict() == {"1": {"2": "01/01"}}
@@ -0,0 +1,76 @@
+import pytest
+import storage
+
+from compact_store import CompactBirthdays
+from json_helper import save_json_atomic
+from snapshot import SnapshotError, read_snapshot, source_fingerprint, write_snapshot
+from storage import JsonStorage
+
+BIRTHDAYS = {"1": {"10": "01/01", "2": "29/02"}, "3": {}, "4": {"5": "31/12"}}
+CONFIG = {"1": {"channel_id": 42}}
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    source_file = tmp_path / "birthdays.json"
+    source_file.write_text("{}")
+    source = source_fingerprint([str(source_file), str(tmp_path / "missing")])
+    filename = str(tmp_path / "data.snapshot")
+    birthdays = CompactBirthdays.from_dict(BIRTHDAYS)
+    write_snapshot(filename, birthdays, CONFIG, source, shards="0_of_2")
+    return filename, source, source_file
+
+
+def test_round_trip(snapshot):
+    filename, source, _ = snapshot
+    birthdays, config = read_snapshot(filename, source, shards="0_of_2")
+    assert birthdays.to_dict() == BIRTHDAYS
+    assert config == CONFIG
+
+
+def test_stale_snapshot_is_ignored(snapshot, tmp_path):
+    filename, source, source_file = snapshot
+    source_file.write_text('{"1": {}}')
+    changed = source_fingerprint([str(source_file), str(tmp_path / "missing")])
+    assert read_snapshot(filename, changed, shards="0_of_2") is None
+    assert read_snapshot(filename, source, shards="all") is None
+    assert read_snapshot(filename + ".missing", source, shards="0_of_2") is None
+
+
+@pytest.mark.parametrize("damage", ["truncate", "flip"])
+def test_corrupt_snapshot_raises(snapshot, damage):
+    filename, source, _ = snapshot
+    with open(filename, "rb") as f:
+        data = bytearray(f.read())
+    if damage == "truncate":
+        data = data[:-3]
+    else:
+        data[-1] ^= 0xFF
+    with open(filename, "wb") as f:
+        f.write(data)
+    with pytest.raises(SnapshotError):
+        read_snapshot(filename, source, shards="0_of_2")
+
+
+def test_write_during_load_makes_snapshot_stale(tmp_path, monkeypatch):
+    birthdays_file = str(tmp_path / "birthdays.json")
+    config_file = str(tmp_path / "config.json")
+    snapshot_file = str(tmp_path / "data.snapshot")
+    save_json_atomic(birthdays_file, {"1": {"10": "01/01"}})
+    save_json_atomic(config_file, {})
+    load_json = storage.load_json
+
+    def load_then_write(filename):
+        # Another process flushes a registration right after our read.
+        data = load_json(filename)
+        if filename == birthdays_file:
+            save_json_atomic(birthdays_file, {"1": {"10": "01/01", "11": "02/02"}})
+        return data
+
+    monkeypatch.setattr(storage, "load_json", load_then_write)
+    JsonStorage(birthdays_file, config_file, snapshot_file=snapshot_file).load()
+    monkeypatch.setattr(storage, "load_json", load_json)
+    reloaded = JsonStorage(birthdays_file, config_file, snapshot_file=snapshot_file)
+    reloaded.load()
+    assert reloaded.loaded_from == "json"
+    assert reloaded.birthdays["1"].get("11") == "02/02"
@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_commands_stay_fast_while_the_worker_announces(tmp_path):
+    # A gateway process and a worker process connected by IPC, with the
+    # benchmark's fake Discord transport.
+    output = tmp_path / "split.json"
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(ROOT, "benchmark.py"),
+            "--split",
+            "--guilds",
+            "200",
+            "--latency",
+            "0.005",
+            "--output",
+            str(output),
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        cwd=ROOT,
+        timeout=300,
+    )
+    with open(output, encoding="utf-8") as f:
+        run = json.load(f)["split"][0]
+    assert run["changes"] > 0
+    assert run["applied"] == run["changes"]
+    # Against the same commands timed once the worker is idle, on the same
+    # machine; the slack absorbs scheduling noise on sub-millisecond times.
+    assert run["p99_ms"] < 10 * run["idle_p99_ms"] + 20
@@ -0,0 +1,45 @@
+import asyncio
+
+from ledger import AnnouncementLedger
+from pruning import PendingRemovals
+from scheduler import GuildScheduler
+
+GUILD_ID = "1000"
+
+
+def test_on_ready_schedules_despite_failing_sync_and_metrics(
+    bot_module, monkeypatch, tmp_path
+):
+    async def fail(*args, **kwargs):
+        raise OSError("unavailable")
+
+    async def no_check(due):
+        pass
+
+    monkeypatch.setattr(bot_module, "startup_done", False)
+    monkeypatch.setattr(bot_module, "compaction", None)
+    monkeypatch.setattr(bot_module, "METRICS_PORT", 9000)
+    monkeypatch.setattr(bot_module, "serve_metrics", fail)
+    monkeypatch.setattr(bot_module, "sync_guild_commands", fail)
+    monkeypatch.setattr(bot_module, "config", {GUILD_ID: {"birthday_channel": 1}})
+    monkeypatch.setattr(bot_module, "scheduler", GuildScheduler(no_check))
+    monkeypatch.setattr(bot_module.resources, "start", lambda: None)
+    monkeypatch.setattr(
+        bot_module, "removals", PendingRemovals(str(tmp_path / "departures.json"))
+    )
+    ledger = AnnouncementLedger(str(tmp_path / "announcements.db"))
+    monkeypatch.setattr(bot_module, "ledger", ledger)
+
+    async def start():
+        await bot_module.on_ready()
+        scheduled = bot_module.scheduler.guild_ids()
+        running = bot_module.scheduler._task is not None
+        compaction = bot_module.compaction is not None
+        bot_module.scheduler.stop()
+        bot_module.compaction.cancel()
+        return scheduled, running, compaction
+
+    try:
+        assert asyncio.run(start()) == ([GUILD_ID], True, True)
+    finally:
+        ledger.close()
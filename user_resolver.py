@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from metrics import Counter
+
+# Resolves user IDs to discord users with as few REST calls as possible:
+#   1. the guild member cache (filled by the gateway),
+#   2. a TTL/LRU cache of users fetched earlier,
+#   3. the client's own user cache,
+#   4. fetch_user for whatever is left, run concurrently under a semaphore.
+
+user_lookups = Counter(
+    "user_resolver_lookups_total",
+    "User lookups by where they were answered from (member, cache, client, fetch).",
+    labels=("source",),
+)
+user_fetch_errors = Counter(
+    "user_resolver_fetch_errors_total", "fetch_user calls that failed."
+)
+
+
+class UserResolver:
+    def __init__(self, client, ttl=3600, max_size=10000, concurrency=10):
+        self.client = client
+        self.ttl = ttl
+        self.max_size = max_size
+        # Shared by every call so concurrent commands stay within the bound.
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # { user_id: (user, expires_at) }, least recently used first.
+        self._cache = OrderedDict()
+
+    def _cache_get(self, user_id):
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._cache[user_id]
+            return None
+        self._cache.move_to_end(user_id)
+        return user
+
+    def _cache_put(self, user_id, user):
+        self._cache[user_id] = (user, time.monotonic() + self.ttl)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _lookup_cached(self, user_id, guild):
+        if guild is not None:
+            member = guild.get_member(user_id)
+            if member is not None:
+                user_lookups.inc("member")
+                return member
+        user = self._cache_get(user_id)
+        if user is not None:
+            user_lookups.inc("cache")
+            return user
+        user = self.client.get_user(user_id)
+        if user is not None:
+            user_lookups.inc("client")
+        return user
+
+    async def _fetch(self, user_id):
+        user_lookups.inc("fetch")
+        async with self._semaphore:
+            try:
+                user = await self.client.fetch_user(user_id)
+            except Exception as e:
+                user_fetch_errors.inc()
+                print(f"Erreur lors de la récupération du membre {user_id} : {e}")
+                return None
+        self._cache_put(user_id, user)
+        return user
+
+    async def resolve_many(self, user_ids, guild=None):
+        # Returns { user_id: user or None } for the given integer IDs.
+        resolved = {}
+        missing = []
+        for user_id in user_ids:
+            user = self._lookup_cached(user_id, guild)
+            if user is not None:
+                resolved[user_id] = user
+            else:
+                missing.append(user_id)
+        if missing:
+            users = await asyncio.gather(*(self._fetch(user_id) for user_id in missing))
+            resolved.update(zip(missing, users))
+        return resolved